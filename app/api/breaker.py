@@ -0,0 +1,224 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+
+from dotenv import load_dotenv
+
+load_dotenv()
+log = logging.getLogger("aiogram-stars-bot.breaker")
+
+# окно, по которому считается доля ошибок и медленных вызовов
+BREAKER_WINDOW = float(os.getenv("BREAKER_WINDOW", "60"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "10"))
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+BREAKER_SLOW_CALL = float(os.getenv("BREAKER_SLOW_CALL", "20"))
+BREAKER_SLOW_RATE = float(os.getenv("BREAKER_SLOW_RATE", "0.8"))
+# сколько держать цепь разомкнутой, прежде чем пустить пробные запросы
+BREAKER_OPEN_FOR = float(os.getenv("BREAKER_OPEN_FOR", "30"))
+BREAKER_PROBES = int(os.getenv("BREAKER_PROBES", "2"))
+
+# AIMD: лимит параллельных /music/generate растёт на 1 за «окно» успешных вызовов и режется при деградации
+GENERATE_LIMIT_INITIAL = int(os.getenv("GENERATE_LIMIT_INITIAL", "8"))
+GENERATE_LIMIT_MIN = int(os.getenv("GENERATE_LIMIT_MIN", "1"))
+GENERATE_LIMIT_MAX = int(os.getenv("GENERATE_LIMIT_MAX", "64"))
+GENERATE_LIMIT_TARGET = float(os.getenv("GENERATE_LIMIT_TARGET", "10"))
+GENERATE_LIMIT_BACKOFF = float(os.getenv("GENERATE_LIMIT_BACKOFF", "0.7"))
+GENERATE_QUEUE_TIMEOUT = float(os.getenv("GENERATE_QUEUE_TIMEOUT", "30"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class BackendUnavailable(RuntimeError):
+    """Бэкенд заведомо не справится: цепь разомкнута или очередь к нему не освободилась вовремя."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Размыкается по доле ошибок или медленных вызовов за окно, через BREAKER_OPEN_FOR пускает пробы."""
+
+    def __init__(
+        self,
+        name: str,
+        window: float = BREAKER_WINDOW,
+        min_calls: int = BREAKER_MIN_CALLS,
+        error_rate: float = BREAKER_ERROR_RATE,
+        slow_call: float = BREAKER_SLOW_CALL,
+        slow_rate: float = BREAKER_SLOW_RATE,
+        open_for: float = BREAKER_OPEN_FOR,
+        probes: int = BREAKER_PROBES,
+    ):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.slow_rate = slow_rate
+        self.open_for = open_for
+        self.probes = probes
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probing = 0
+        self._probe_ok = 0
+        # (monotonic-время, ошибка, медленный)
+        self._calls: deque[tuple[float, bool, bool]] = deque()
+        self.rejected = 0
+        self.opened = 0
+
+    def retry_after(self) -> float:
+        if self.state != OPEN:
+            return 0.0
+        return max(self._opened_at + self.open_for - time.monotonic(), 0.0)
+
+    @property
+    def is_open(self) -> bool:
+        # в полуоткрытом состоянии платежи принимаем: их заказы и станут пробными запросами
+        return self.retry_after() > 0
+
+    def before_call(self) -> None:
+        """Пропускает вызов или бросает BackendUnavailable."""
+        if self.state == OPEN:
+            if self.retry_after() > 0:
+                self.rejected += 1
+                raise BackendUnavailable(f"{self.name}: circuit is open", self.retry_after())
+            self.state = HALF_OPEN
+            self._probing = 0
+            self._probe_ok = 0
+            log.info("%s: circuit half-open, probing", self.name)
+        if self.state == HALF_OPEN:
+            if self._probing >= self.probes:
+                self.rejected += 1
+                raise BackendUnavailable(f"{self.name}: circuit is half-open", self.open_for / 2)
+            self._probing += 1
+
+    def cancelled(self) -> None:
+        # вызов отменён (остановка процесса) — о бэкенде он ничего не говорит
+        if self.state == HALF_OPEN:
+            self._probing -= 1
+
+    def record(self, latency: float, failed: bool) -> None:
+        now = time.monotonic()
+        slow = latency >= self.slow_call
+
+        if self.state == HALF_OPEN:
+            self._probing -= 1
+            if failed or slow:
+                self._open(now, "probe failed")
+                return
+            self._probe_ok += 1
+            if self._probe_ok >= self.probes:
+                self.state = CLOSED
+                self._calls.clear()
+                log.warning("%s: circuit closed, backend recovered", self.name)
+            return
+        if self.state == OPEN:
+            # ответ на запрос, начатый до размыкания
+            return
+
+        self._calls.append((now, failed, slow))
+        while self._calls and self._calls[0][0] < now - self.window:
+            self._calls.popleft()
+        total = len(self._calls)
+        if total < self.min_calls:
+            return
+        errors = sum(1 for _, f, _ in self._calls if f)
+        slows = sum(1 for _, _, s in self._calls if s)
+        if errors / total >= self.error_rate:
+            self._open(now, f"error rate {errors}/{total}")
+        elif slows / total >= self.slow_rate:
+            self._open(now, f"slow calls {slows}/{total}")
+
+    def _open(self, now: float, reason: str) -> None:
+        self.state = OPEN
+        self._opened_at = now
+        self._calls.clear()
+        self.opened += 1
+        log.error("%s: circuit opened for %.0fs (%s)", self.name, self.open_for, reason)
+
+    def stats(self) -> dict:
+        return {
+            "state": {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}[self.state],
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+class AdaptiveLimiter:
+    """Лимит параллельных запросов по AIMD: +1 за limit успешных быстрых ответов, ×backoff при медленном или ошибке."""
+
+    def __init__(
+        self,
+        name: str,
+        initial: int = GENERATE_LIMIT_INITIAL,
+        minimum: int = GENERATE_LIMIT_MIN,
+        maximum: int = GENERATE_LIMIT_MAX,
+        target: float = GENERATE_LIMIT_TARGET,
+        backoff: float = GENERATE_LIMIT_BACKOFF,
+        queue_timeout: float = GENERATE_QUEUE_TIMEOUT,
+    ):
+        self.name = name
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target = target
+        self.backoff = backoff
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        # не режем лимит чаще, чем раз за «поколение» запросов, начатых после прошлого сокращения
+        self._decreased_at = 0.0
+        self.timeouts = 0
+
+    async def acquire(self) -> float:
+        """Ждёт свободный слот (FIFO); возвращает monotonic-время начала запроса."""
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return time.monotonic()
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise BackendUnavailable(f"{self.name}: no free slot in {self.queue_timeout:.0f}s", self.target)
+        except asyncio.CancelledError:
+            # слот мог быть выдан в тот же момент — возвращаем его следующему
+            if waiter.done() and not waiter.cancelled():
+                self.in_flight -= 1
+                self._wake()
+            raise
+        return time.monotonic()
+
+    def release(self, started: float, latency: float, failed: bool | None) -> None:
+        """failed=None — запрос отменён, на лимит это не влияет."""
+        self.in_flight -= 1
+        if failed is not None:
+            if failed or latency > self.target:
+                if started > self._decreased_at and self.limit > self.minimum:
+                    self.limit = max(self.minimum, self.limit * self.backoff)
+                    self._decreased_at = time.monotonic()
+                    log.info("%s: concurrency limit down to %d", self.name, int(self.limit))
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self.in_flight += 1
+            waiter.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            "queue_timeouts": self.timeouts,
+        }
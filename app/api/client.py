@@ -0,0 +1,142 @@
+import os
+import time
+import asyncio
+import logging
+
+import httpx
+from dotenv import load_dotenv
+
+from api.breaker import AdaptiveLimiter, CircuitBreaker
+from metrics import API_LATENCY, API_REQUESTS
+from tracing import span
+
+load_dotenv()
+log = logging.getLogger("aiogram-stars-bot.api")
+
+API_BASE_URL = os.getenv("API_BASE_URL", "http://127.0.0.1:8000").rstrip("/")
+BOT_SERVICE_TOKEN = os.getenv("BOT_SERVICE_TOKEN")
+
+API_MAX_CONNECTIONS = int(os.getenv("API_MAX_CONNECTIONS", "100"))
+API_MAX_KEEPALIVE = int(os.getenv("API_MAX_KEEPALIVE", "20"))
+API_KEEPALIVE_EXPIRY = float(os.getenv("API_KEEPALIVE_EXPIRY", "30"))
+API_HTTP2 = os.getenv("API_HTTP2", "0") == "1"
+
+API_CONNECT_TIMEOUT = float(os.getenv("API_CONNECT_TIMEOUT", "5"))
+API_GENERATE_TIMEOUT = float(os.getenv("API_GENERATE_TIMEOUT", "120"))
+API_STATUS_TIMEOUT = float(os.getenv("API_STATUS_TIMEOUT", "15"))
+API_PAID_TIMEOUT = float(os.getenv("API_PAID_TIMEOUT", "60"))
+
+_client: httpx.AsyncClient | None = None
+# один выключатель на весь бэкенд: при деградации страдают все ручки сразу
+backend_breaker = CircuitBreaker("backend")
+generate_limiter = AdaptiveLimiter("generate")
+
+
+def _timeout(read: float) -> httpx.Timeout:
+    return httpx.Timeout(read, connect=API_CONNECT_TIMEOUT)
+
+
+async def open_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            base_url=API_BASE_URL,
+            http2=API_HTTP2,
+            limits=httpx.Limits(
+                max_connections=API_MAX_CONNECTIONS,
+                max_keepalive_connections=API_MAX_KEEPALIVE,
+                keepalive_expiry=API_KEEPALIVE_EXPIRY,
+            ),
+            timeout=_timeout(API_GENERATE_TIMEOUT),
+            headers={"X-Bot-Token": BOT_SERVICE_TOKEN or ""},
+        )
+    return _client
+
+
+async def close_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_client() -> httpx.AsyncClient:
+    # клиент открывается в on_startup и закрывается в on_shutdown
+    if _client is None:
+        raise RuntimeError("backend client is not opened, call open_client() first")
+    return _client
+
+
+def is_backend_failure(code: int) -> bool:
+    # 4xx — ошибка запроса, а не бэкенда; цепь размыкают только 5xx, 408, 429 и сетевые ошибки
+    return code >= 500 or code in (408, 429)
+
+
+async def _request(
+    endpoint: str,
+    method: str,
+    url: str,
+    limiter: AdaptiveLimiter | None = None,
+    **kwargs,
+) -> httpx.Response:
+    client = get_client()
+    backend_breaker.before_call()
+    try:
+        slot = await limiter.acquire() if limiter is not None else 0.0
+    except BaseException:
+        # до бэкенда запрос не дошёл — пробный слот полуоткрытой цепи возвращаем
+        backend_breaker.cancelled()
+        raise
+    started = time.perf_counter()
+    code = "error"
+    failed: bool | None = True
+    try:
+        with span(f"http.{endpoint}", http_method=method, http_url=url) as s:
+            # traceparent уходит и из несэмплированных трасс: бэкенд продолжает то же решение о записи
+            kwargs["headers"] = {**kwargs.get("headers", {}), "traceparent": s.traceparent}
+            r = await client.request(method, url, **kwargs)
+            code = str(r.status_code)
+            s.set(http_status_code=r.status_code)
+        failed = is_backend_failure(r.status_code)
+        return r
+    except asyncio.CancelledError:
+        failed = None
+        raise
+    finally:
+        latency = time.perf_counter() - started
+        API_LATENCY.labels(endpoint=endpoint).observe(latency)
+        API_REQUESTS.labels(endpoint=endpoint, code=code).inc()
+        if failed is None:
+            backend_breaker.cancelled()
+        else:
+            backend_breaker.record(latency, failed)
+        if limiter is not None:
+            limiter.release(slot, latency, failed)
+
+
+async def api_generate(payload: dict) -> str:
+    r = await _request(
+        "generate",
+        "POST",
+        "/music/generate",
+        limiter=generate_limiter,
+        json=payload,
+        timeout=_timeout(API_GENERATE_TIMEOUT),
+    )
+    if r.status_code == 422:
+        log.error("422 from API. Sent payload=%s", payload)
+        log.error("422 details=%s", r.text)
+    r.raise_for_status()
+    return r.json()["taskId"]
+
+
+async def check_task(task_id: str) -> dict:
+    r = await _request("status", "GET", f"/music/status/{task_id}", timeout=_timeout(API_STATUS_TIMEOUT))
+    r.raise_for_status()
+    return r.json()
+
+
+async def api_mark_paid(order_id: int, charge_id: str) -> None:
+    payload = {"order_id": order_id, "telegram_payment_charge_id": charge_id}
+    r = await _request("mark_paid", "POST", "/payments/stars/paid", json=payload, timeout=_timeout(API_PAID_TIMEOUT))
+    r.raise_for_status()
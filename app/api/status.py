@@ -0,0 +1,109 @@
+import os
+import json
+import asyncio
+import logging
+
+from dotenv import load_dotenv
+
+from api.client import check_task
+from db.db import SessionLocal
+from db.writer import run_write
+from db.dao import get_order_by_task_id, save_task_result
+from db.cache import TTLCache
+
+load_dotenv()
+log = logging.getLogger("aiogram-stars-bot.status")
+
+SUCCESS_STATUSES = frozenset({"SUCCESS"})
+FAILED_STATUSES = frozenset({
+    "CREATE_TASK_FAILED",
+    "GENERATE_AUDIO_FAILED",
+    "CALLBACK_EXCEPTION",
+    "SENSITIVE_WORD_ERROR",
+    "FAILED",
+    "ERROR",
+})
+
+
+def task_status(result: dict) -> str:
+    return str(result.get("status") or "UNKNOWN")
+
+
+def is_success(result: dict) -> bool:
+    return task_status(result) in SUCCESS_STATUSES
+
+
+def is_failed(result: dict) -> bool:
+    return task_status(result) in FAILED_STATUSES
+
+
+def is_terminal(result: dict) -> bool:
+    return is_success(result) or is_failed(result)
+
+
+STATUS_CACHE_TTL = float(os.getenv("STATUS_CACHE_TTL", "5"))
+STATUS_TERMINAL_TTL = float(os.getenv("STATUS_TERMINAL_TTL", "3600"))
+STATUS_CACHE_SIZE = int(os.getenv("STATUS_CACHE_SIZE", "10000"))
+
+status_cache = TTLCache(STATUS_CACHE_SIZE, STATUS_CACHE_TTL)
+_inflight: dict[str, asyncio.Future] = {}
+
+
+async def _load_terminal(task_id: str) -> dict | None:
+    async with SessionLocal() as session:
+        order = await get_order_by_task_id(session, task_id)
+    if order and order.result:
+        return json.loads(order.result)
+    return None
+
+
+async def _persist_terminal(task_id: str, result: dict) -> None:
+    value = json.dumps(result, ensure_ascii=False)
+    await run_write(lambda session: save_task_result(session, task_id, value))
+
+
+async def _fetch(task_id: str) -> dict:
+    # результат, уже сохранённый в заказе, — без запроса к бэкенду
+    result = await _load_terminal(task_id)
+    if result is not None:
+        status_cache.set(task_id, result, ttl=STATUS_TERMINAL_TTL)
+        return result
+
+    result = await check_task(task_id)
+    if is_terminal(result):
+        try:
+            await _persist_terminal(task_id, result)
+        except Exception:
+            log.exception("failed to persist result for task %s", task_id)
+        status_cache.set(task_id, result, ttl=STATUS_TERMINAL_TTL)
+    else:
+        status_cache.set(task_id, result)
+    return result
+
+
+async def get_task_status(task_id: str) -> dict:
+    cached = status_cache.get(task_id)
+    if cached is not None:
+        return cached
+
+    # single-flight: одновременные запросы одного task_id ждут одного лидера — и чтение БД, и апстрим-вызов
+    fut = _inflight.get(task_id)
+    if fut is not None:
+        return await asyncio.shield(fut)
+
+    fut = asyncio.get_running_loop().create_future()
+    _inflight[task_id] = fut
+    try:
+        result = await _fetch(task_id)
+    except BaseException as e:
+        if isinstance(e, asyncio.CancelledError):
+            e = RuntimeError(f"status check for {task_id} was cancelled")
+        fut.set_exception(e)
+        # помечаем исключение как полученное, даже если ждущих не было
+        fut.exception()
+        raise
+    else:
+        fut.set_result(result)
+        return result
+    finally:
+        _inflight.pop(task_id, None)
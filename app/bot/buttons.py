@@ -1,30 +1,50 @@
+from typing import Mapping
+
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 
+# Клавиатуры собираются один раз на язык при импорте bot/messages.py
+# (модели aiogram заморожены, поэтому один объект безопасно отдавать во все ответы).
+
 
-def main_menu():
+def main_menu(t: Mapping[str, str]) -> ReplyKeyboardMarkup:
     return ReplyKeyboardMarkup(
         keyboard=[
-            [KeyboardButton(text="❌ Сброс")],
+            [KeyboardButton(text=t["btn_reset"])],
         ],
         resize_keyboard=True,
         one_time_keyboard=True,
-        input_field_placeholder="Выбери действие…",
+        input_field_placeholder=t["menu_placeholder"],
     )
 
-def start_menu() -> InlineKeyboardMarkup:
+def start_menu(t: Mapping[str, str]) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Генерация музыки", callback_data="function:generation_music")],
-        [InlineKeyboardButton(text="Редактирование музыки", callback_data="function:edit_music")],
+        [InlineKeyboardButton(text=t["btn_generate"], callback_data="function:generation_music")],
+        [InlineKeyboardButton(text=t["btn_batch"], callback_data="function:batch_music")],
+        [InlineKeyboardButton(text=t["btn_edit"], callback_data="function:edit_music")],
     ])
 
-def generation_song_mode_menu() -> InlineKeyboardMarkup:
+def generation_song_mode_menu(t: Mapping[str, str]) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Обычный", callback_data="mode:classic")],
-        [InlineKeyboardButton(text="Расширенный", callback_data="mode:custom")],
+        [InlineKeyboardButton(text=t["btn_mode_classic"], callback_data="mode:classic")],
+        [InlineKeyboardButton(text=t["btn_mode_custom"], callback_data="mode:custom")],
     ])
 
-def song_type_menu() -> InlineKeyboardMarkup:
+def song_type_menu(t: Mapping[str, str]) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🎵 Инструментал", callback_data="instrumental:true")],
-        [InlineKeyboardButton(text="🎤 Песня", callback_data="instrumental:false")],
-    ])
\ No newline at end of file
+        [InlineKeyboardButton(text=t["btn_instrumental"], callback_data="instrumental:true")],
+        [InlineKeyboardButton(text=t["btn_song"], callback_data="instrumental:false")],
+    ])
+
+def fresh_menu(t: Mapping[str, str]) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=t["btn_generate_fresh"], callback_data="prompt:fresh")],
+    ])
+
+def history_nav(t: Mapping[str, str], older: int | None, newer: int | None) -> InlineKeyboardMarkup | None:
+    # курсоры keyset-пагинации: id крайних заказов на текущей странице
+    row = []
+    if older is not None:
+        row.append(InlineKeyboardButton(text=t["btn_history_older"], callback_data=f"history:older:{older}"))
+    if newer is not None:
+        row.append(InlineKeyboardButton(text=t["btn_history_newer"], callback_data=f"history:newer:{newer}"))
+    return InlineKeyboardMarkup(inline_keyboard=[row]) if row else None
@@ -0,0 +1,449 @@
+import os
+import html
+from string import Template
+from dataclasses import dataclass, fields
+from types import MappingProxyType
+from typing import Callable, Mapping
+
+from aiogram.types import InlineKeyboardMarkup, ReplyKeyboardMarkup
+from dotenv import load_dotenv
+
+from bot import buttons
+
+load_dotenv()
+
+# те же переменные окружения, что читает main.py: значения подставляются в тексты один раз при импорте
+PRICE_STARS = int(os.getenv("PRICE_STARS", "6"))
+BATCH_MAX = int(os.getenv("BATCH_MAX", "5"))
+MAX_PROMPT_CLASSIC = int(os.getenv("MAX_PROMPT_CLASSIC", "500"))
+DEFAULT_LANG = os.getenv("DEFAULT_LANG", "ru")
+
+# Исходники текстов. $name — статические значения (подставляются при импорте),
+# {} / {name} — динамические части шаблонов из TEMPLATES.
+SOURCES: dict[str, dict[str, str]] = {
+    "ru": {
+        "btn_reset": "❌ Сброс",
+        "menu_placeholder": "Выбери действие…",
+        "btn_generate": "Генерация музыки",
+        "btn_batch": "Пакет треков",
+        "btn_edit": "Редактирование музыки",
+        "btn_mode_classic": "Обычный",
+        "btn_mode_custom": "Расширенный",
+        "btn_instrumental": "🎵 Инструментал",
+        "btn_song": "🎤 Песня",
+
+        "start": "Бот умеет генерировать и редактировать музыку. Выбери действие.",
+        "start_hint": 'Начать занаво можно нажав "Сбросить" в нижнем меню 👇',
+        "status_usage": "Пришли так: <code>/status &lt;task_id&gt;</code>",
+        "status_error": "Что-то пошло не так. Проверь task_id или попробуй немного позже.",
+        "batch_hint": (
+            "Пакет — до $batch_max треков одним счётом ($price⭐ за трек).\n\n"
+            "На последнем шаге пришли несколько описаний/текстов, разделяя их строкой ---\n"
+            "или одно описание и последней строкой x3, чтобы получить 3 варианта."
+        ),
+        "mode_prompt": (
+            "Выбери режим: \n\nОбычный - указывается только описание трека, "
+            "по описанию генерируется текст песни и жанры."
+            "\n\nРасширенный - Описываетсся жанр трека, выберается инмтрументальный трек или песня, "
+            "для песни указывается текст."
+        ),
+        "edit_unavailable": "Функция пока в разработке",
+        "throttled": "Слишком часто, подожди секунду ⏳",
+        "song_type_prompt": "Выбери что хочешь получить, мелодию(только музыка, без текста) или песню(с текстом)",
+        "style_classic": "Опиши стиль трека который хочешь получить. Описывать нужно в свободной форме.",
+        "style_custom": (
+            "Опиши стиль трека который хочешь получить. Описывать нужно в свободной форме на английском языке. например:\n"
+            "Dark ambient techno, 128 BPM, deep drones, industrial textures, distorted kick, no vocals"
+        ),
+        "reset_done": "Состояние сброшено. Начнём заново 👌",
+        "choose_action": "Выбери действие:",
+        "prompt_too_long": "Слишком длинный запрос для обычного режима (лимит $max_prompt символов).\nСейчас: {}.\n",
+        "lyrics_prompt": "2/2) Пришли текст песни (lyrics). Можно с [verse]/[chorus].",
+        "invoice_sending": "Ок. Отправляю счёт на оплату ⭐",
+        "invoice_title": "AI Music Generation",
+        "invoice_description": "Запуск генерации (Suno). Цена: $price⭐",
+        "invoice_label": "$price Stars",
+        "batch_count_invalid": (
+            "В пакете должно быть от 2 до $batch_max треков, сейчас: {}.\n"
+            "Раздели описания строкой --- или добавь последней строкой x3."
+        ),
+        "batch_prompt_too_long": "Одно из описаний длиннее $max_prompt символов.",
+        "batch_invoice_sending": "Ок. Пакет из {} треков. Отправляю счёт на оплату ⭐",
+        "batch_invoice_description": "Пакетная генерация (Suno): {count} трека(ов). Цена: {total}⭐",
+        "batch_invoice_label": "{} × $price Stars",
+        "paid_duplicate": "Этот заказ уже оплачен и обрабатывается ✅",
+        "miniapp_started": "✅ Оплата получена! Запуск в MiniApp…",
+        "miniapp_refunded": "⚠️ Не удалось запустить заказ MiniApp. Средства возвращены.",
+        "payment_bad_payload": "Оплата получена ✅, но payload заказа непонятен. /start",
+        "payment_order_missing": "Оплата получена, но заказ не найден — Stars вернутся на баланс. Напиши /start.",
+        "payment_queued": "✅ Оплата получена! Заказ поставлен в очередь на генерацию…",
+        "backend_unavailable": "⏳ Сервис генерации сейчас перегружен, оплату не принимаем. Попробуй через пару минут.",
+        "invoice_expired": "Этот счёт устарел или уже оплачен. Собери заказ заново: /start",
+        "prompt_reused": "♻️ Ты уже генерировал ровно такой запрос — вот готовый результат, без оплаты.",
+        "prompt_in_flight": "⏳ Ровно такой же запрос уже генерируется — результат придёт в чат, как только будет готов.",
+        "btn_generate_fresh": "🔁 Всё равно сгенерировать заново ($price⭐)",
+
+        "generation_started": (
+            "🎛 Генерация запущена! Пришлю результат, как только он будет готов.\n"
+            " Для проверки статуса, отправь в чат:  \n `/status {}`"
+        ),
+        "batch_started": "🎛 Генерация {} треков запущена! Пришлю результаты по мере готовности.",
+        "batch_track_failed": "⚠️ Один из треков пакета не удалось запустить.",
+        "generation_refunded": "⚠️ Неудалось запустить генерацию. Средства возвращены.",
+        "payment_refunded": "💫 Stars за этот заказ возвращены.",
+        "generation_failed": "⚠️ Генерация не удалась (task_id: {}).",
+
+        "status_line": "Статус: <b>{}</b>",
+        "track_title": "{}\n<b>Название: {}</b>",
+        "track_default_title": "Трек {}",
+        "track_ordinals": "ПЕРВЫЙ|ВТОРОЙ",
+        "cover_link": '🖼 <a href="{}">Обложка</a>',
+        "cover_missing": "🖼 Обложка: нет ссылки",
+        "audio_link": '🎵 <a href="{}">Трек</a>',
+        "audio_missing": "🎵 Трек: нет ссылки",
+
+        "history_title": "🗂 Твои заказы:",
+        "history_empty": "Заказов пока нет. Начать — /start",
+        "history_line": "#{id} · {date} · {status} · {stars}⭐\n{prompt}",
+        "history_batch": "пакет из {} треков",
+        "order_statuses": (
+            "INVOICED:ждёт оплаты|PAID:в очереди|PROCESSING:в очереди|SUBMITTED:генерируется|"
+            "COMPLETED:готово|FAILED:ошибка|DEAD:средства возвращены"
+        ),
+        "btn_history_older": "⬅️ Старше",
+        "btn_history_newer": "Новее ➡️",
+
+        "stats_title": "📊 Статистика за {} дн. (UTC)",
+        "stats_tracks": (
+            "Треки: создано {created}, оплачено {paid}, отправлено {submitted}, "
+            "готово {completed}, ошибок {failed}, возвратов {dead}"
+        ),
+        "stats_revenue": "Платежей: {payments}, получено {paid}⭐, возвращено {refunded}⭐ ({refunds} шт.)",
+        "stats_rates": "Доля сбоев: {failure}, доля возвратов: {refund}",
+        "stats_latency": "Медиана «оплата → отправка»: {} с",
+        "stats_latency_none": "Медиана «оплата → отправка»: нет данных",
+    },
+    "en": {
+        "btn_reset": "❌ Reset",
+        "menu_placeholder": "Choose an action…",
+        "btn_generate": "Generate music",
+        "btn_batch": "Track pack",
+        "btn_edit": "Edit music",
+        "btn_mode_classic": "Simple",
+        "btn_mode_custom": "Advanced",
+        "btn_instrumental": "🎵 Instrumental",
+        "btn_song": "🎤 Song",
+
+        "start": "The bot can generate and edit music. Choose an action.",
+        "start_hint": 'You can start over with "Reset" in the menu below 👇',
+        "status_usage": "Send it like this: <code>/status &lt;task_id&gt;</code>",
+        "status_error": "Something went wrong. Check the task_id or try again a bit later.",
+        "batch_hint": (
+            "A pack is up to $batch_max tracks on one invoice ($price⭐ per track).\n\n"
+            "At the last step send several descriptions/lyrics separated by a --- line\n"
+            "or one description with x3 on the last line to get 3 variations."
+        ),
+        "mode_prompt": (
+            "Choose a mode:\n\nSimple - you only describe the track, "
+            "lyrics and genres are generated from the description."
+            "\n\nAdvanced - you describe the genre, choose an instrumental or a song, "
+            "and provide lyrics for a song."
+        ),
+        "edit_unavailable": "This feature is not available yet",
+        "throttled": "Too many requests, wait a second ⏳",
+        "song_type_prompt": "What do you want: a melody (music only, no lyrics) or a song (with lyrics)?",
+        "style_classic": "Describe the track you want, in free form.",
+        "style_custom": (
+            "Describe the style of the track in free form, in English. For example:\n"
+            "Dark ambient techno, 128 BPM, deep drones, industrial textures, distorted kick, no vocals"
+        ),
+        "reset_done": "State reset. Let's start over 👌",
+        "choose_action": "Choose an action:",
+        "prompt_too_long": "The request is too long for simple mode (limit $max_prompt characters).\nNow: {}.\n",
+        "lyrics_prompt": "2/2) Send the lyrics. [verse]/[chorus] tags are welcome.",
+        "invoice_sending": "OK. Sending the invoice ⭐",
+        "invoice_title": "AI Music Generation",
+        "invoice_description": "Music generation (Suno). Price: $price⭐",
+        "invoice_label": "$price Stars",
+        "batch_count_invalid": (
+            "A pack must have 2 to $batch_max tracks, now: {}.\n"
+            "Separate descriptions with a --- line or add x3 as the last line."
+        ),
+        "batch_prompt_too_long": "One of the descriptions is longer than $max_prompt characters.",
+        "batch_invoice_sending": "OK. A pack of {} tracks. Sending the invoice ⭐",
+        "batch_invoice_description": "Batch generation (Suno): {count} track(s). Price: {total}⭐",
+        "batch_invoice_label": "{} × $price Stars",
+        "paid_duplicate": "This order is already paid and being processed ✅",
+        "miniapp_started": "✅ Payment received! Starting in the MiniApp…",
+        "miniapp_refunded": "⚠️ Could not start the MiniApp order. The payment was refunded.",
+        "payment_bad_payload": "Payment received ✅, but the order payload is not recognised. /start",
+        "payment_order_missing": "Payment received, but the order was not found — the Stars will be refunded. Send /start.",
+        "payment_queued": "✅ Payment received! The order is queued for generation…",
+        "backend_unavailable": "⏳ The generation service is overloaded, payments are paused. Try again in a few minutes.",
+        "invoice_expired": "This invoice has expired or is already paid. Start a new order: /start",
+        "prompt_reused": "♻️ You have already generated exactly this request — here is the result, free of charge.",
+        "prompt_in_flight": "⏳ Exactly the same request is being generated right now — the result will arrive in the chat.",
+        "btn_generate_fresh": "🔁 Generate a fresh one anyway ($price⭐)",
+
+        "generation_started": (
+            "🎛 Generation started! I will send the result as soon as it is ready.\n"
+            " To check the status, send:  \n `/status {}`"
+        ),
+        "batch_started": "🎛 Generation of {} tracks started! I will send the results as they are ready.",
+        "batch_track_failed": "⚠️ One of the pack tracks could not be started.",
+        "generation_refunded": "⚠️ Could not start the generation. The payment was refunded.",
+        "payment_refunded": "💫 The Stars for this order were refunded.",
+        "generation_failed": "⚠️ Generation failed (task_id: {}).",
+
+        "status_line": "Status: <b>{}</b>",
+        "track_title": "{}\n<b>Title: {}</b>",
+        "track_default_title": "Track {}",
+        "track_ordinals": "FIRST|SECOND",
+        "cover_link": '🖼 <a href="{}">Cover</a>',
+        "cover_missing": "🖼 Cover: no link",
+        "audio_link": '🎵 <a href="{}">Track</a>',
+        "audio_missing": "🎵 Track: no link",
+
+        "history_title": "🗂 Your orders:",
+        "history_empty": "No orders yet. Start with /start",
+        "history_line": "#{id} · {date} · {status} · {stars}⭐\n{prompt}",
+        "history_batch": "pack of {} tracks",
+        "order_statuses": (
+            "INVOICED:awaiting payment|PAID:queued|PROCESSING:queued|SUBMITTED:generating|"
+            "COMPLETED:done|FAILED:failed|DEAD:refunded"
+        ),
+        "btn_history_older": "⬅️ Older",
+        "btn_history_newer": "Newer ➡️",
+
+        "stats_title": "📊 Stats for {} days (UTC)",
+        "stats_tracks": (
+            "Tracks: created {created}, paid {paid}, submitted {submitted}, "
+            "done {completed}, failed {failed}, refunded {dead}"
+        ),
+        "stats_revenue": "Payments: {payments}, received {paid}⭐, refunded {refunded}⭐ ({refunds})",
+        "stats_rates": "Failure rate: {failure}, refund rate: {refund}",
+        "stats_latency": "Median paid → submitted: {} s",
+        "stats_latency_none": "Median paid → submitted: no data",
+    },
+}
+
+# ключи с динамическими частями: в Texts лежит str.format шаблона
+TEMPLATES = frozenset({
+    "prompt_too_long", "batch_count_invalid", "batch_invoice_sending", "batch_invoice_description",
+    "batch_invoice_label", "generation_started", "batch_started", "generation_failed",
+    "status_line", "track_title", "track_default_title", "cover_link", "audio_link",
+    "history_line", "history_batch", "stats_title", "stats_tracks", "stats_revenue", "stats_rates",
+    "stats_latency",
+})
+
+
+@dataclass(frozen=True, slots=True)
+class Texts:
+    """Тексты и клавиатуры одного языка, собранные при импорте."""
+
+    lang: str
+
+    start: str
+    start_hint: str
+    status_usage: str
+    status_error: str
+    batch_hint: str
+    mode_prompt: str
+    edit_unavailable: str
+    throttled: str
+    song_type_prompt: str
+    style_classic: str
+    style_custom: str
+    reset_done: str
+    choose_action: str
+    lyrics_prompt: str
+    invoice_sending: str
+    invoice_title: str
+    invoice_description: str
+    invoice_label: str
+    batch_prompt_too_long: str
+    paid_duplicate: str
+    miniapp_started: str
+    miniapp_refunded: str
+    payment_bad_payload: str
+    payment_order_missing: str
+    payment_queued: str
+    backend_unavailable: str
+    invoice_expired: str
+    prompt_reused: str
+    prompt_in_flight: str
+    batch_track_failed: str
+    generation_refunded: str
+    payment_refunded: str
+    cover_missing: str
+    audio_missing: str
+    btn_reset: str
+    history_title: str
+    history_empty: str
+    stats_latency_none: str
+    track_ordinals: tuple[str, ...]
+    order_statuses: Mapping[str, str]
+    # исходники после подстановки $-значений — для клавиатур, собираемых на лету
+    labels: Mapping[str, str]
+
+    prompt_too_long: Callable[..., str]
+    batch_count_invalid: Callable[..., str]
+    batch_invoice_sending: Callable[..., str]
+    batch_invoice_description: Callable[..., str]
+    batch_invoice_label: Callable[..., str]
+    generation_started: Callable[..., str]
+    batch_started: Callable[..., str]
+    generation_failed: Callable[..., str]
+    status_line: Callable[..., str]
+    track_title: Callable[..., str]
+    track_default_title: Callable[..., str]
+    cover_link: Callable[..., str]
+    audio_link: Callable[..., str]
+    history_line: Callable[..., str]
+    history_batch: Callable[..., str]
+    stats_title: Callable[..., str]
+    stats_tracks: Callable[..., str]
+    stats_revenue: Callable[..., str]
+    stats_rates: Callable[..., str]
+    stats_latency: Callable[..., str]
+
+    start_menu: InlineKeyboardMarkup
+    main_menu: ReplyKeyboardMarkup
+    mode_menu: InlineKeyboardMarkup
+    song_type_menu: InlineKeyboardMarkup
+    fresh_menu: InlineKeyboardMarkup
+
+
+def _compile(lang: str, source: Mapping[str, str]) -> Texts:
+    static = {"price": PRICE_STARS, "batch_max": BATCH_MAX, "max_prompt": MAX_PROMPT_CLASSIC}
+    text = {key: Template(value).substitute(static) for key, value in source.items()}
+
+    values: dict[str, object] = {"lang": lang}
+    for f in fields(Texts):
+        if f.name in text:
+            values[f.name] = text[f.name].format if f.name in TEMPLATES else text[f.name]
+    values["track_ordinals"] = tuple(text["track_ordinals"].split("|"))
+    values["order_statuses"] = MappingProxyType(dict(
+        item.split(":", 1) for item in text["order_statuses"].split("|")
+    ))
+    values["labels"] = MappingProxyType(text)
+    values["start_menu"] = buttons.start_menu(text)
+    values["main_menu"] = buttons.main_menu(text)
+    values["mode_menu"] = buttons.generation_song_mode_menu(text)
+    values["song_type_menu"] = buttons.song_type_menu(text)
+    values["fresh_menu"] = buttons.fresh_menu(text)
+    return Texts(**values)
+
+
+CATALOGS: Mapping[str, Texts] = MappingProxyType({lang: _compile(lang, src) for lang, src in SOURCES.items()})
+DEFAULT_TEXTS = CATALOGS.get(DEFAULT_LANG) or CATALOGS["ru"]
+# кнопка «Сброс» на любом из языков
+RESET_BUTTONS = frozenset(t.btn_reset for t in CATALOGS.values())
+
+
+def texts_for(language_code: str | None) -> Texts:
+    if not language_code:
+        return DEFAULT_TEXTS
+    found = CATALOGS.get(language_code)
+    if found is None:
+        # "en-US" -> "en"
+        found = CATALOGS.get(language_code.split("-", 1)[0], DEFAULT_TEXTS)
+    return found
+
+
+def result_tracks(result: dict) -> list[dict]:
+    # Ожидаем список треков
+    data = (
+        result.get("raw", {})
+              .get("data", {})
+              .get("response", {})
+              .get("sunoData")
+    ) or []
+    if not isinstance(data, list):
+        return []
+    return [item if isinstance(item, dict) else {} for item in data[:2]]
+
+
+def render_status(result: dict, texts: Texts = DEFAULT_TEXTS) -> str:
+    status = result.get("status") or "UNKNOWN"
+    data = result_tracks(result)
+
+    lines = [texts.status_line(html.escape(str(status)))]
+
+    if status == "SUCCESS" and len(data) > 0:
+        for i, item in enumerate(data, start=1):
+            if not item:
+                continue
+
+            image_url = item.get("imageUrl")
+            audio_url = item.get("audioUrl")
+            title = item.get("title") or texts.track_default_title(i)
+
+            lines.append("\n".join((
+                texts.track_title(texts.track_ordinals[i - 1], html.escape(str(title))),
+                texts.cover_link(html.escape(image_url)) if image_url else texts.cover_missing,
+                texts.audio_link(html.escape(audio_url)) if audio_url else texts.audio_missing,
+            )))
+
+    return "\n\n".join(lines)
+
+
+HISTORY_PROMPT_PREVIEW = 60
+
+
+def render_history(orders, texts: Texts = DEFAULT_TEXTS) -> str:
+    if not orders:
+        return texts.history_empty
+    lines = [texts.history_title]
+    for order in orders:
+        if order.batch_size > 1:
+            prompt = texts.history_batch(order.batch_size)
+        else:
+            prompt = " ".join((order.prompt or "").split())
+            if len(prompt) > HISTORY_PROMPT_PREVIEW:
+                prompt = prompt[:HISTORY_PROMPT_PREVIEW - 1] + "…"
+        status = order.status.value
+        if order.batch_size > 1 and status == "PROCESSING":
+            # пакет в PROCESSING — его треки уже генерируются
+            status = "SUBMITTED"
+        lines.append(texts.history_line(
+            id=order.id,
+            date=order.created_at.strftime("%d.%m.%Y"),
+            status=texts.order_statuses.get(status, status),
+            stars=order.price_stars,
+            prompt=prompt,
+        ))
+    return "\n\n".join(lines)
+
+
+def _rate(part: int, whole: int) -> str:
+    return f"{part / whole:.1%}" if whole else "—"
+
+
+def render_stats(totals: Mapping[str, int], days: int, median_latency: float | None,
+                 texts: Texts = DEFAULT_TEXTS) -> str:
+    status = {name: totals.get(f"status:{name}", 0) for name in (
+        "DRAFT", "PAID", "SUBMITTED", "COMPLETED", "FAILED", "DEAD")}
+    return "\n".join((
+        texts.stats_title(days),
+        texts.stats_tracks(
+            created=status["DRAFT"],
+            paid=status["PAID"],
+            submitted=status["SUBMITTED"],
+            completed=status["COMPLETED"],
+            failed=status["FAILED"],
+            dead=status["DEAD"],
+        ),
+        texts.stats_revenue(
+            payments=totals.get("payments", 0),
+            paid=totals.get("stars_paid", 0),
+            refunded=totals.get("stars_refunded", 0),
+            refunds=totals.get("refunds", 0),
+        ),
+        texts.stats_rates(
+            # сбой — трек, который не дошёл до результата: FAILED после отправки или DEAD до неё
+            failure=_rate(status["FAILED"] + status["DEAD"], status["PAID"]),
+            refund=_rate(totals.get("refunds", 0), totals.get("payments", 0)),
+        ),
+        texts.stats_latency(f"{median_latency:.1f}") if median_latency is not None else texts.stats_latency_none,
+    ))
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from db.writer import run_write
+from db.dao import get_or_create_user
+from db.cache import CachedUser, TTLCache, user_cache
+from bot.state_storage import StateStorage
+from bot.messages import texts_for
+
+log = logging.getLogger("aiogram-stars-bot.middlewares")
+
+
+class UserStateMiddleware(BaseMiddleware):
+    """Кладёт в data["user"], data["state"] и data["texts"] пользователя, его состояние и тексты на его языке."""
+
+    def __init__(self, storage: StateStorage):
+        self.storage = storage
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        tg_user = data.get("event_from_user")
+        if tg_user is None:
+            return await handler(event, data)
+
+        user: CachedUser | None = user_cache.get(tg_user.id)
+        profile_changed = user is not None and (
+            user.username != tg_user.username
+            or user.first_name != tg_user.first_name
+            or user.language_code != tg_user.language_code
+        )
+        if user is None or profile_changed:
+            db_user = await run_write(lambda session: get_or_create_user(
+                session=session,
+                telegram_user_id=tg_user.id,
+                username=tg_user.username,
+                first_name=tg_user.first_name,
+                language_code=tg_user.language_code,
+            ))
+
+            user = CachedUser(
+                id=db_user.id,
+                telegram_user_id=db_user.telegram_user_id,
+                username=db_user.username,
+                first_name=db_user.first_name,
+                language_code=db_user.language_code,
+            )
+            user_cache.set(tg_user.id, user)
+
+        data["user"] = user
+        data["state"] = await self.storage.get(user.id)
+        data["texts"] = texts_for(tg_user.language_code)
+        return await handler(event, data)
+
+
+class ConcurrencyLimitMiddleware(BaseMiddleware):
+    """Ограничивает число одновременно обрабатываемых апдейтов и умеет дождаться их завершения."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self._sem = asyncio.Semaphore(limit)
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        self.in_flight += 1
+        self._idle.clear()
+        try:
+            async with self._sem:
+                return await handler(event, data)
+        finally:
+            self.in_flight -= 1
+            if self.in_flight == 0:
+                self._idle.set()
+
+    def stats(self) -> dict:
+        return {"in_flight": self.in_flight, "limit": self.limit}
+
+    async def drain(self, timeout: float) -> bool:
+        # апдейты, уже отданные в задачи, но ещё не дошедшие до middleware
+        await asyncio.sleep(0)
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            log.warning("drain timeout: %s updates still in flight", self.in_flight)
+            return False
+        return True
+
+
+class UpdateDedupMiddleware(BaseMiddleware):
+    """Отбрасывает повторные доставки одного update_id (ретраи вебхука, переподключения polling)."""
+
+    def __init__(self, size: int = 50_000, ttl: float = 600):
+        self._seen = TTLCache(size, ttl)
+        self.duplicates = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        update_id = getattr(event, "update_id", None)
+        if update_id is not None:
+            if self._seen.get(update_id) is not None:
+                self.duplicates += 1
+                return None
+            self._seen.set(update_id, True)
+        return await handler(event, data)
+
+    def stats(self) -> dict:
+        return {"duplicates": self.duplicates, "tracked": len(self._seen)}
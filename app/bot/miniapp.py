@@ -0,0 +1,34 @@
+import logging
+
+from aiogram.types import Message, SuccessfulPayment
+
+from api.client import api_mark_paid
+from bot.messages import Texts
+from db.writer import run_write
+from db.dao import record_payment, request_refund
+from workers.refunds import refund_payment
+
+log = logging.getLogger("aiogram-stars-bot.miniapp")
+
+
+async def miniapp_payment(message: Message, sp: SuccessfulPayment, mini_order_id: int, texts: Texts) -> None:
+    """Оплата заказа MiniApp (payload morder:N): заказ живёт в бэкенде, бот только подтверждает платёж."""
+    is_new = await run_write(
+        lambda session: record_payment(session, sp.telegram_payment_charge_id, None, sp.total_amount)
+    )
+    if not is_new:
+        await message.answer(texts.paid_duplicate)
+        return
+
+    # сообщаем FastAPI: miniapp order оплачен
+    try:
+        await api_mark_paid(mini_order_id, sp.telegram_payment_charge_id)
+    except Exception as e:
+        log.exception("mark paid failed: %s", e)
+        charge = sp.telegram_payment_charge_id
+        await run_write(lambda session: request_refund(session, charge, message.from_user.id, sp.total_amount))
+        # не прошедший возврат повторит recovery
+        if await refund_payment(message.bot, charge, message.from_user.id):
+            await message.answer(texts.miniapp_refunded)
+        return
+    await message.answer(texts.miniapp_started)
@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import logging
+from abc import ABC, abstractmethod
+from dataclasses import asdict, fields, replace
+
+from dotenv import load_dotenv
+
+from db.db import SessionLocal
+from db.writer import run_write
+from db.dao import get_state, set_state, clear_state
+from db.cache import CachedState, state_cache
+
+load_dotenv()
+log = logging.getLogger("aiogram-stars-bot.state")
+
+# пусто — memory в режиме polling; для webhook бэкенд нужно выбрать явно
+STATE_BACKEND = os.getenv("STATE_BACKEND", "")
+STATE_TTL = int(os.getenv("STATE_TTL", "86400"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0")
+REDIS_STATE_PREFIX = os.getenv("REDIS_STATE_PREFIX", "congen:state:")
+
+_STATE_FIELDS = frozenset(f.name for f in fields(CachedState))
+
+
+class StateStorage(ABC):
+    """Хранилище шагов визарда function → mode → instrumental → style → prompt."""
+
+    @abstractmethod
+    async def get(self, user_id: int) -> CachedState: ...
+
+    @abstractmethod
+    async def update(self, user_id: int, **values) -> CachedState: ...
+
+    @abstractmethod
+    async def clear(self, user_id: int) -> None: ...
+
+    async def close(self) -> None:
+        pass
+
+
+def _merge(st: CachedState, values: dict) -> CachedState:
+    unknown = set(values) - _STATE_FIELDS
+    if unknown:
+        raise TypeError(f"unknown state fields: {', '.join(sorted(unknown))}")
+    # None означает «не трогать», как в db.dao.set_state
+    return replace(st, **{k: v for k, v in values.items() if v is not None})
+
+
+class MemoryStateStorage(StateStorage):
+    def __init__(self, ttl: float = STATE_TTL, purge_every: int = 1000):
+        self.ttl = ttl
+        self.purge_every = purge_every
+        self._data: dict[int, tuple[float, CachedState]] = {}
+        self._ops = 0
+
+    async def get(self, user_id: int) -> CachedState:
+        item = self._data.get(user_id)
+        if item is None:
+            return CachedState()
+        expires_at, st = item
+        if expires_at < time.monotonic():
+            del self._data[user_id]
+            return CachedState()
+        return st
+
+    async def update(self, user_id: int, **values) -> CachedState:
+        st = _merge(await self.get(user_id), values)
+        self._data[user_id] = (time.monotonic() + self.ttl, st)
+        self._ops += 1
+        if self._ops % self.purge_every == 0:
+            self.purge()
+        return st
+
+    async def clear(self, user_id: int) -> None:
+        self._data.pop(user_id, None)
+
+    def purge(self) -> int:
+        now = time.monotonic()
+        expired = [uid for uid, (expires_at, _) in self._data.items() if expires_at < now]
+        for uid in expired:
+            del self._data[uid]
+        return len(expired)
+
+
+class RedisStateStorage(StateStorage):
+    """Любой клиент с протоколом redis.asyncio (get/set/delete), в т.ч. fakeredis."""
+
+    def __init__(self, client, ttl: int = STATE_TTL, prefix: str = REDIS_STATE_PREFIX):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str = REDIS_URL, **kwargs) -> "RedisStateStorage":
+        from redis.asyncio import Redis
+
+        return cls(Redis.from_url(url, decode_responses=True), **kwargs)
+
+    def _key(self, user_id: int) -> str:
+        return f"{self.prefix}{user_id}"
+
+    async def get(self, user_id: int) -> CachedState:
+        raw = await self.client.get(self._key(user_id))
+        if not raw:
+            return CachedState()
+        return CachedState(**json.loads(raw))
+
+    async def update(self, user_id: int, **values) -> CachedState:
+        st = _merge(await self.get(user_id), values)
+        # каждое обновление продлевает TTL, брошенные визарды истекают сами
+        await self.client.set(self._key(user_id), json.dumps(asdict(st)), ex=self.ttl)
+        return st
+
+    async def clear(self, user_id: int) -> None:
+        await self.client.delete(self._key(user_id))
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+class SqlStateStorage(StateStorage):
+    """Долговечный вариант поверх таблицы states (db.dao)."""
+
+    async def get(self, user_id: int) -> CachedState:
+        st = state_cache.get(user_id)
+        if st is not None:
+            return st
+        async with SessionLocal() as session:
+            st = CachedState.from_model(await get_state(session, user_id))
+        state_cache.set(user_id, st)
+        return st
+
+    async def update(self, user_id: int, **values) -> CachedState:
+        _merge(CachedState(), values)
+        st = await run_write(lambda session: set_state(session, user_id, **values))
+        return CachedState.from_model(st)
+
+    async def clear(self, user_id: int) -> None:
+        await run_write(lambda session: clear_state(session, user_id))
+
+
+def create_state_storage(backend: str = STATE_BACKEND, run_mode: str = "polling") -> StateStorage:
+    # в polling апдейты пользователя приходят в один процесс (и при супервизоре: шард по user_id),
+    # в webhook реплики за балансировщиком получают шаги одного визарда вперемешку
+    if not backend:
+        if run_mode != "polling":
+            raise RuntimeError(
+                f"STATE_BACKEND is not set for RUN_MODE={run_mode}: "
+                "use redis when several replicas share the webhook, memory or sql for a single one"
+            )
+        backend = "memory"
+    elif backend in ("memory", "sql") and run_mode != "polling":
+        # sql тоже: состояние кэшируется в процессе (state_cache) на USER_CACHE_TTL
+        log.warning("STATE_BACKEND=%s keeps wizard state per process: run a single webhook replica or use redis", backend)
+    if backend == "memory":
+        return MemoryStateStorage()
+    if backend == "redis":
+        return RedisStateStorage.from_url()
+    if backend == "sql":
+        return SqlStateStorage()
+    raise ValueError(f"unknown STATE_BACKEND: {backend!r}")
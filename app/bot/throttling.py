@@ -0,0 +1,196 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+from aiogram.types import CallbackQuery, Message, TelegramObject
+from dotenv import load_dotenv
+
+from db.cache import TTLCache
+from bot.messages import texts_for
+
+load_dotenv()
+log = logging.getLogger("aiogram-stars-bot.throttling")
+
+USER_RATE = float(os.getenv("USER_RATE", "1"))
+USER_BURST = float(os.getenv("USER_BURST", "8"))
+CHAT_RATE = float(os.getenv("CHAT_RATE", "2"))
+CHAT_BURST = float(os.getenv("CHAT_BURST", "10"))
+# лимит Bot API общий на бота: при WORKERS > 1 каждый шард получает свою долю
+_WORKERS = max(1, int(os.getenv("WORKERS", "1")))
+SEND_RATE = float(os.getenv("SEND_RATE", "30")) / _WORKERS
+SEND_BURST = max(1.0, float(os.getenv("SEND_BURST", "30")) / _WORKERS)
+SEND_QUEUE_SIZE = int(os.getenv("SEND_QUEUE_SIZE", "1000"))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def reserve(self) -> float:
+        """Берёт токен «в долг» и возвращает, сколько секунд нужно подождать."""
+        self._refill()
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Входящий лимит: token bucket на пользователя и на чат, лишние апдейты отбрасываются."""
+
+    def __init__(
+        self,
+        user_rate: float = USER_RATE,
+        user_burst: float = USER_BURST,
+        chat_rate: float = CHAT_RATE,
+        chat_burst: float = CHAT_BURST,
+    ):
+        self.user_rate, self.user_burst = user_rate, user_burst
+        self.chat_rate, self.chat_burst = chat_rate, chat_burst
+        # бакеты неактивных пользователей вытесняются сами
+        self._users = TTLCache(100_000, 600)
+        self._chats = TTLCache(100_000, 600)
+        self.dropped = 0
+
+    def _bucket(self, cache: TTLCache, key: int, rate: float, burst: float) -> TokenBucket:
+        bucket = cache.get(key)
+        if bucket is None:
+            bucket = TokenBucket(rate, burst)
+            cache.set(key, bucket)
+        return bucket
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        # оплату нельзя терять ни при каком лимите
+        if isinstance(event, Message) and event.successful_payment:
+            return await handler(event, data)
+
+        user = data.get("event_from_user")
+        chat = data.get("event_chat")
+        allowed = True
+        if user is not None:
+            allowed = self._bucket(self._users, user.id, self.user_rate, self.user_burst).consume()
+        if allowed and chat is not None:
+            allowed = self._bucket(self._chats, chat.id, self.chat_rate, self.chat_burst).consume()
+        if allowed:
+            return await handler(event, data)
+
+        self.dropped += 1
+        if isinstance(event, CallbackQuery):
+            await event.answer(texts_for(user.language_code if user is not None else None).throttled)
+        return None
+
+    def stats(self) -> dict:
+        return {"dropped": self.dropped, "tracked_users": len(self._users), "tracked_chats": len(self._chats)}
+
+
+class SendQueueFull(RuntimeError):
+    pass
+
+
+class SendRateLimiter(BaseRequestMiddleware):
+    """Глобальный лимит исходящих сообщений бота (~30 msg/s) с ограниченной очередью и учётом retry_after."""
+
+    def __init__(
+        self,
+        rate: float = SEND_RATE,
+        burst: float = SEND_BURST,
+        queue_size: int = SEND_QUEUE_SIZE,
+        max_retries: int = SEND_MAX_RETRIES,
+    ):
+        self.bucket = TokenBucket(rate, burst)
+        self.queue_size = queue_size
+        self.max_retries = max_retries
+        self._paused_until = 0.0
+        self.waiting = 0
+        self.sent = 0
+        self.dropped = 0
+        self.delayed = 0
+        self.delay_seconds = 0.0
+        self.retried = 0
+
+    @staticmethod
+    def is_limited(method: TelegramMethod) -> bool:
+        # ответы на callback/pre_checkout не считаются в лимит рассылки и должны уходить сразу
+        name = type(method).__name__
+        return name.startswith(("Send", "Copy", "Forward", "Edit"))
+
+    async def _acquire(self) -> None:
+        if self.waiting >= self.queue_size:
+            self.dropped += 1
+            raise SendQueueFull(f"outgoing send queue is full ({self.queue_size})")
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            pause = self._paused_until - started
+            if pause > 0:
+                await asyncio.sleep(pause)
+            delay = self.bucket.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        finally:
+            self.waiting -= 1
+        waited = time.monotonic() - started
+        if waited > 0.001:
+            self.delayed += 1
+            self.delay_seconds += waited
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if not self.is_limited(method):
+            return await make_request(bot, method)
+
+        attempt = 0
+        while True:
+            await self._acquire()
+            try:
+                response = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                attempt += 1
+                self.retried += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                if attempt > self.max_retries:
+                    raise
+                log.warning("429 from Telegram on %s, retry after %ss", type(method).__name__, e.retry_after)
+                continue
+            self.sent += 1
+            return response
+
+    def stats(self) -> dict:
+        return {
+            "waiting": self.waiting,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "delayed": self.delayed,
+            "delay_seconds": self.delay_seconds,
+            "retried": self.retried,
+        }
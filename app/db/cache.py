@@ -0,0 +1,87 @@
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Hashable
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+
+
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable) -> Any | None:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+@dataclass(slots=True)
+class CachedUser:
+    id: int
+    telegram_user_id: int
+    username: str | None
+    first_name: str | None
+    language_code: str | None = None
+
+
+@dataclass(slots=True)
+class CachedState:
+    step: str | None = None
+    function: str | None = None
+    mode: str | None = None
+    instrumental: bool | None = None
+    style: str | None = None
+    prompt: str | None = None
+
+    @classmethod
+    def from_model(cls, st) -> "CachedState":
+        if st is None:
+            return cls()
+        return cls(
+            step=st.step,
+            function=st.function,
+            mode=st.mode,
+            instrumental=st.instrumental,
+            style=st.style,
+            prompt=st.prompt,
+        )
+
+
+# ключ — telegram_user_id
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+# ключ — users.id
+state_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
@@ -1,33 +1,93 @@
-from datetime import datetime
-from sqlalchemy import select
+import json
+import zlib
+import bisect
+from datetime import date, datetime, timedelta
+from sqlalchemy import select, update, delete, or_, func
+from sqlalchemy.orm import selectinload, aliased
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from db.models import User, Order, OrderStatus, State
+from db.models import User, Order, OrderStatus, State, ProcessedPayment, DailyRollup, PromptCache, OrderArchive
+from db.db import after_commit
+from db.cache import CachedState, state_cache
+from metrics import observe_dao, ORDER_TRANSITIONS
 
+# корзины латентности «оплата -> отправка в бэкенд», секунды; последняя корзина — всё, что дольше
+SUBMIT_LATENCY_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1800, 3600, 7200)
 
+
+def _count_transitions(session: AsyncSession, status: OrderStatus, n: int = 1) -> None:
+    child = ORDER_TRANSITIONS.labels(status=status.value)
+    after_commit(session, lambda: child.inc(n))
+
+
+def _dialect_insert(session: AsyncSession):
+    dialect = session.bind.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    return insert
+
+
+async def bump_daily(session: AsyncSession, counters: dict[str, int], day: date | None = None) -> None:
+    """Инкремент дневных счётчиков в той же транзакции, что и изменение заказа."""
+    day = day or datetime.utcnow().date()
+    counters = {metric: value for metric, value in counters.items() if value}
+    if not counters:
+        return
+    insert = _dialect_insert(session)
+    if insert is None:
+        for metric, value in counters.items():
+            row = await session.get(DailyRollup, (day, metric))
+            if row is None:
+                session.add(DailyRollup(day=day, metric=metric, value=value))
+            else:
+                row.value += value
+        await session.flush()
+        return
+    stmt = insert(DailyRollup).values([
+        {"day": day, "metric": metric, "value": value} for metric, value in counters.items()
+    ])
+    await session.execute(stmt.on_conflict_do_update(
+        index_elements=["day", "metric"],
+        set_={"value": DailyRollup.value + stmt.excluded.value},
+    ))
+
+
+@observe_dao
 async def get_or_create_user(
     session: AsyncSession,
     telegram_user_id: int,
     username: str | None,
     first_name: str | None,
+    language_code: str | None = None,
 ) -> User:
     res = await session.execute(select(User).where(User.telegram_user_id == telegram_user_id))
     user = res.scalar_one_or_none()
     if user:
-        user.username = username
-        user.first_name = first_name
+        # пишем профиль только если он реально поменялся
+        if user.username != username:
+            user.username = username
+        if user.first_name != first_name:
+            user.first_name = first_name
+        if user.language_code != language_code:
+            user.language_code = language_code
         return user
 
     user = User(
         telegram_user_id=telegram_user_id,
         username=username,
         first_name=first_name,
+        language_code=language_code,
     )
     session.add(user)
     await session.flush()
     return user
 
 
+@observe_dao
 async def create_order(
     session: AsyncSession,
     user: User,
@@ -55,56 +115,791 @@ async def create_order(
     )
     session.add(order)
     await session.flush()
+    _count_transitions(session, OrderStatus.DRAFT)
+    await bump_daily(session, {"status:DRAFT": 1})
     return order
 
 
-async def set_order_invoiced(session: AsyncSession, order: Order, invoice_payload: str) -> None:
-    order.invoice_payload = invoice_payload
-    order.status = OrderStatus.INVOICED
+@observe_dao
+async def create_batch_order(
+    session: AsyncSession,
+    user: User,
+    chat_id: int,
+    function: str,
+    prompts: list[str],
+    model: str,
+    price_stars: int,
+    instrumental: bool | None,
+    mode: str = "classic",
+    style: str = "",
+) -> Order:
+    parent = Order(
+        user_id=user.id,
+        chat_id=chat_id,
+        function=function,
+        instrumental=instrumental,
+        mode=mode,
+        style=style,
+        prompt=None,
+        model=model,
+        price_stars=price_stars * len(prompts),
+        batch_size=len(prompts),
+        status=OrderStatus.DRAFT,
+    )
+    session.add(parent)
+    await session.flush()
+    # дочерние заказы вставляются одним executemany
+    session.add_all([
+        Order(
+            user_id=user.id,
+            chat_id=chat_id,
+            function=function,
+            instrumental=instrumental,
+            mode=mode,
+            style=style,
+            prompt=prompt,
+            model=model,
+            price_stars=price_stars,
+            parent_id=parent.id,
+            status=OrderStatus.DRAFT,
+        )
+        for prompt in prompts
+    ])
     await session.flush()
+    _count_transitions(session, OrderStatus.DRAFT, len(prompts) + 1)
+    # в отчётах считаем треки: родитель пакета — только счёт
+    await bump_daily(session, {"status:DRAFT": len(prompts)})
+    return parent
+
 
+@observe_dao
+async def set_order_invoiced(session: AsyncSession, order_id: int, invoice_payload: str) -> bool:
+    return await transition(session, order_id, OrderStatus.INVOICED, invoice_payload=invoice_payload)
 
-async def get_order_by_id(session: AsyncSession, order_id: int) -> Order | None:
-    res = await session.execute(select(Order).where(Order.id == order_id))
+
+@observe_dao
+async def get_order_by_id(session: AsyncSession, order_id: int, related: bool = False) -> Order | None:
+    query = select(Order).where(Order.id == order_id)
+    if related:
+        # пользователь и родитель пакета — для возврата платежа
+        query = query.options(selectinload(Order.user), selectinload(Order.parent))
+    res = await session.execute(query)
     return res.scalar_one_or_none()
 
 
+@observe_dao
+async def get_order_by_task_id(session: AsyncSession, task_id: str, related: bool = False) -> Order | None:
+    query = select(Order).where(Order.task_id == task_id).limit(1)
+    if related:
+        # пользователь — для языка сообщений о результате
+        query = query.options(selectinload(Order.user))
+    res = await session.execute(query)
+    return res.scalar_one_or_none()
+
+
+@observe_dao
+async def save_task_result(session: AsyncSession, task_id: str, result: str) -> None:
+    await session.execute(
+        update(Order)
+        .where(Order.task_id == task_id, Order.result.is_(None))
+        .values(result=result)
+    )
+
+
+@observe_dao
+async def set_audio_file_ids(session: AsyncSession, order_id: int, file_ids: str) -> None:
+    await session.execute(update(Order).where(Order.id == order_id).values(audio_file_ids=file_ids))
+
+
+TERMINAL_STATUSES = (OrderStatus.COMPLETED, OrderStatus.FAILED, OrderStatus.DEAD)
+
+# из каких статусов разрешён переход в данный
+ALLOWED_FROM: dict[OrderStatus, tuple[OrderStatus, ...]] = {
+    OrderStatus.INVOICED: (OrderStatus.DRAFT,),
+    OrderStatus.PAID: (OrderStatus.DRAFT, OrderStatus.INVOICED, OrderStatus.PROCESSING),
+    OrderStatus.PROCESSING: (OrderStatus.PAID,),
+    OrderStatus.SUBMITTED: (OrderStatus.PROCESSING,),
+    OrderStatus.COMPLETED: (OrderStatus.SUBMITTED,),
+    OrderStatus.FAILED: (OrderStatus.SUBMITTED, OrderStatus.PROCESSING),
+    # PAID -> DEAD — только восстановление после простоя: заказ так и не взяли в работу
+    OrderStatus.DEAD: (OrderStatus.PROCESSING, OrderStatus.PAID),
+}
+
+
+@observe_dao
+async def transition(
+    session: AsyncSession,
+    order_id: int,
+    new: OrderStatus,
+    expected: tuple[OrderStatus, ...] | None = None,
+    **values,
+) -> bool:
+    """Атомарно: UPDATE ... WHERE id = :id AND status IN (:expected) RETURNING id.
+
+    Возвращает False, если заказа нет или его статус уже не тот, что ожидался, —
+    так конкурирующие обработчики не могут применить один и тот же переход дважды.
+    """
+    expected = expected or ALLOWED_FROM[new]
+    res = await session.execute(
+        update(Order)
+        .where(Order.id == order_id, Order.status.in_(expected))
+        .values(status=new, **values)
+        .returning(Order.id)
+        .execution_options(synchronize_session=False)
+    )
+    ok = res.scalar_one_or_none() is not None
+    if ok:
+        _count_transitions(session, new)
+    return ok
+
+
+@observe_dao
+async def record_payment(
+    session: AsyncSession,
+    telegram_payment_charge_id: str,
+    order_id: int | None,
+    amount: int = 0,
+) -> bool:
+    """Вставляет charge_id в processed_payments; False — такой платёж уже обрабатывали."""
+    insert = _dialect_insert(session)
+    if insert is None:
+        existing = await session.get(ProcessedPayment, telegram_payment_charge_id)
+        if existing:
+            return False
+        session.add(ProcessedPayment(telegram_payment_charge_id=telegram_payment_charge_id, order_id=order_id))
+        await session.flush()
+    else:
+        res = await session.execute(
+            insert(ProcessedPayment)
+            .values(
+                telegram_payment_charge_id=telegram_payment_charge_id,
+                order_id=order_id,
+                created_at=datetime.utcnow(),
+            )
+            .on_conflict_do_nothing(index_elements=["telegram_payment_charge_id"])
+        )
+        if res.rowcount != 1:
+            return False
+    await bump_daily(session, {"payments": 1, "stars_paid": amount})
+    return True
+
+
+@observe_dao
+async def record_refund(session: AsyncSession, amount: int) -> None:
+    await bump_daily(session, {"refunds": 1, "stars_refunded": amount})
+
+
+@observe_dao
+async def request_refund(
+    session: AsyncSession,
+    telegram_payment_charge_id: str,
+    telegram_user_id: int,
+    amount: int,
+    order_id: int | None = None,
+) -> bool:
+    """Отмечает, что платёж надо вернуть; False — возврат по нему уже запрошен.
+
+    Пишется в одной транзакции с переходом заказа, поэтому сбой самого RefundStarPayment
+    не теряет долг: его повторит recovery по get_pending_refunds.
+    """
+    row = await session.get(ProcessedPayment, telegram_payment_charge_id)
+    if row is None:
+        # платежи до processed_payments и те, что не дошли до record_payment
+        row = ProcessedPayment(telegram_payment_charge_id=telegram_payment_charge_id, order_id=order_id)
+        session.add(row)
+    elif row.refund_due_at is not None:
+        return False
+    row.telegram_user_id = telegram_user_id
+    row.amount = amount
+    row.refund_due_at = datetime.utcnow()
+    await session.flush()
+    return True
+
+
+@observe_dao
+async def mark_refunded(session: AsyncSession, telegram_payment_charge_id: str) -> bool:
+    res = await session.execute(
+        update(ProcessedPayment)
+        .where(
+            ProcessedPayment.telegram_payment_charge_id == telegram_payment_charge_id,
+            ProcessedPayment.refunded_at.is_(None),
+        )
+        .values(refunded_at=datetime.utcnow())
+        .returning(ProcessedPayment.amount)
+        .execution_options(synchronize_session=False)
+    )
+    row = res.first()
+    if row is None:
+        return False
+    await record_refund(session, row.amount or 0)
+    return True
+
+
+@observe_dao
+async def get_pending_refunds(
+    session: AsyncSession,
+    before: datetime,
+    limit: int = 500,
+) -> list[tuple[ProcessedPayment, str | None]]:
+    """Запрошенные, но не прошедшие возвраты старше before — с языком пользователя для сообщения."""
+    res = await session.execute(
+        select(ProcessedPayment, User.language_code)
+        .outerjoin(User, User.telegram_user_id == ProcessedPayment.telegram_user_id)
+        .where(ProcessedPayment.refund_due_at < before, ProcessedPayment.refunded_at.is_(None))
+        .order_by(ProcessedPayment.refund_due_at)
+        .limit(limit)
+    )
+    return [(payment, language_code) for payment, language_code in res.all()]
+
+
+def charge_id(order: Order) -> str | None:
+    # у треков пакета платёж один — на родительском заказе
+    if order.parent is not None:
+        return order.parent.telegram_payment_charge_id
+    return order.telegram_payment_charge_id
+
+
+@observe_dao
+async def request_order_refund(session: AsyncSession, order: Order) -> str:
+    """Возврат после перевода заказа в DEAD/FAILED, в той же транзакции; order — с user и parent.
+
+    "refund" — весь платёж записан к возврату, "track" — трек пакета, а пакет целиком не провалился,
+    "none" — возвращать нечего (нет charge_id или возврат уже запрошен).
+    """
+    # частичный возврат Stars невозможен: по пакету возвращаем, только если не удался ни один трек
+    if order.parent_id is not None and await settle_batch(session, order.parent_id) != OrderStatus.DEAD:
+        return "track"
+    charge = charge_id(order)
+    # возвращается весь платёж: для пакета — сумма родителя
+    stars = order.parent.price_stars if order.parent is not None else order.price_stars
+    if charge is None or not await request_refund(session, charge, order.user.telegram_user_id, stars, order.id):
+        return "none"
+    return "refund"
+
+
+@observe_dao
 async def mark_paid(
     session: AsyncSession,
-    order: Order,
+    order_id: int,
     telegram_payment_charge_id: str | None,
-) -> None:
-    order.status = OrderStatus.PAID
-    order.telegram_payment_charge_id = telegram_payment_charge_id
-    order.paid_at = datetime.utcnow()
-    await session.flush()
+    traceparent: str | None = None,
+) -> bool:
+    now = datetime.utcnow()
+    return await transition(
+        session,
+        order_id,
+        OrderStatus.PAID,
+        expected=(OrderStatus.DRAFT, OrderStatus.INVOICED),
+        telegram_payment_charge_id=telegram_payment_charge_id,
+        paid_at=now,
+        attempts=0,
+        next_attempt_at=now,
+        traceparent=traceparent,
+    )
 
 
-async def mark_submitted(session: AsyncSession, order: Order, task_id: str) -> None:
-    order.status = OrderStatus.SUBMITTED
-    order.task_id = task_id
-    await session.flush()
+@observe_dao
+async def apply_payment(
+    session: AsyncSession,
+    order_id: int,
+    telegram_payment_charge_id: str,
+    amount: int = 0,
+    traceparent: str | None = None,
+    telegram_user_id: int | None = None,
+) -> str:
+    """Платёж по заказу: "paid" — заказ поставлен в очередь, "duplicate" — уже обработан, "missing" — нет заказа.
+
+    При "missing" и известном telegram_user_id платёж сразу записан к возврату (request_refund).
+    """
+    # защита от повторной обработки: charge_id обрабатывается ровно один раз
+    if not await record_payment(session, telegram_payment_charge_id, order_id, amount):
+        return "duplicate"
+    paid = await mark_paid(session, order_id, telegram_payment_charge_id=telegram_payment_charge_id, traceparent=traceparent)
+    if paid:
+        # для пакета сразу ставим в очередь все дочерние треки
+        queued = await enqueue_batch(session, order_id, traceparent)
+        await bump_daily(session, {"status:PAID": queued or 1})
+        return "paid"
+    # переход не применился: заказа нет либо он уже не ждёт оплаты
+    if await get_order_by_id(session, order_id):
+        return "duplicate"
+    # счёт оплачен после удаления заказа (expire_abandoned_orders): Stars не оставляем себе
+    if telegram_user_id is not None:
+        await request_refund(session, telegram_payment_charge_id, telegram_user_id, amount, order_id)
+    return "missing"
+
+
+@observe_dao
+async def enqueue_batch(session: AsyncSession, parent_id: int, traceparent: str | None = None) -> int:
+    """После оплаты пакета ставит все дочерние заказы в очередь одним UPDATE."""
+    now = datetime.utcnow()
+    res = await session.execute(
+        update(Order)
+        .where(Order.parent_id == parent_id, Order.status == OrderStatus.DRAFT)
+        .values(status=OrderStatus.PAID, paid_at=now, attempts=0, next_attempt_at=now, traceparent=traceparent)
+        .returning(Order.id)
+        .execution_options(synchronize_session=False)
+    )
+    queued = len(res.scalars().all())
+    if queued:
+        _count_transitions(session, OrderStatus.PAID, queued)
+        # сам родитель генерацию не запускает: он в работе, пока не завершится последний трек (settle_batch)
+        await transition(session, parent_id, OrderStatus.PROCESSING, expected=(OrderStatus.PAID,))
+    return queued
+
+
+@observe_dao
+async def batch_child_submitted(session: AsyncSession, parent_id: int) -> tuple[int, int]:
+    """Атомарный счётчик запущенных треков пакета: (запущено, всего)."""
+    res = await session.execute(
+        update(Order)
+        .where(Order.id == parent_id)
+        .values(batch_submitted=Order.batch_submitted + 1)
+        .returning(Order.batch_submitted, Order.batch_size)
+        .execution_options(synchronize_session=False)
+    )
+    row = res.one()
+    return row[0], row[1]
+
+
+@observe_dao
+async def settle_batch(session: AsyncSession, parent_id: int) -> OrderStatus | None:
+    """Итог пакета после завершения трека: COMPLETED, если готов хоть один трек, иначе DEAD.
+
+    None — не все треки завершены или итог уже подвёл другой вызов: статус родителя
+    меняется ровно один раз, переходом из PROCESSING.
+    """
+    res = await session.execute(
+        select(Order.status).where(Order.parent_id == parent_id).distinct()
+    )
+    statuses = set(res.scalars())
+    if not statuses or not statuses.issubset(TERMINAL_STATUSES):
+        return None
+    final = OrderStatus.COMPLETED if OrderStatus.COMPLETED in statuses else OrderStatus.DEAD
+    # в отчётах считаем треки: родителю bump_daily не нужен
+    if not await transition(session, parent_id, final, expected=(OrderStatus.PROCESSING,)):
+        return None
+    return final
+
+
+@observe_dao
+async def claim_jobs(session: AsyncSession, limit: int = 1) -> list[Order]:
+    now = datetime.utcnow()
+    # на Postgres строки блокируются с SKIP LOCKED, на SQLite FOR UPDATE не рендерится,
+    # и от гонки защищает условие status == PAID в UPDATE ниже
+    res = await session.execute(
+        select(Order.id)
+        .where(
+            Order.status == OrderStatus.PAID,
+            or_(Order.next_attempt_at.is_(None), Order.next_attempt_at <= now),
+            Order.batch_size <= 1,
+        )
+        .order_by(Order.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    ids = list(res.scalars())
+    if not ids:
+        return []
+
+    res = await session.execute(
+        update(Order)
+        .where(Order.id.in_(ids), Order.status == OrderStatus.PAID)
+        .values(status=OrderStatus.PROCESSING, locked_at=now)
+        .returning(Order.id)
+    )
+    claimed = list(res.scalars())
+    if not claimed:
+        return []
+    _count_transitions(session, OrderStatus.PROCESSING, len(claimed))
+
+    res = await session.execute(
+        select(Order)
+        .where(Order.id.in_(claimed))
+        .options(selectinload(Order.user), selectinload(Order.parent))
+        .execution_options(populate_existing=True)
+    )
+    return list(res.scalars())
+
+
+@observe_dao
+async def retry_job(
+    session: AsyncSession,
+    order_id: int,
+    error: str,
+    delay: float,
+    count_attempt: bool = True,
+) -> bool:
+    # count_attempt=False — запрос до бэкенда не дошёл (цепь разомкнута), попытку не тратим
+    return await transition(
+        session,
+        order_id,
+        OrderStatus.PAID,
+        expected=(OrderStatus.PROCESSING,),
+        attempts=Order.attempts + 1 if count_attempt else Order.attempts,
+        next_attempt_at=datetime.utcnow() + timedelta(seconds=delay),
+        locked_at=None,
+        last_error=error,
+    )
+
+
+@observe_dao
+async def mark_dead(
+    session: AsyncSession,
+    order_id: int,
+    error: str,
+    expected: tuple[OrderStatus, ...] | None = None,
+) -> bool:
+    ok = await transition(
+        session,
+        order_id,
+        OrderStatus.DEAD,
+        expected=expected,
+        attempts=Order.attempts + 1,
+        locked_at=None,
+        last_error=error,
+    )
+    if ok:
+        await bump_daily(session, {"status:DEAD": 1})
+    return ok
+
+
+@observe_dao
+async def requeue_stale_processing(session: AsyncSession, locked_before: datetime) -> list[int]:
+    """Возвращает в очередь заказы, захваченные воркером, который так и не довёл их до SUBMITTED."""
+    res = await session.execute(
+        update(Order)
+        # родитель пакета в PROCESSING ждёт треки, воркер его не захватывает
+        .where(Order.status == OrderStatus.PROCESSING, Order.locked_at < locked_before, Order.batch_size <= 1)
+        .values(
+            status=OrderStatus.PAID,
+            locked_at=None,
+            next_attempt_at=datetime.utcnow(),
+            last_error="requeued by recovery: worker stopped while processing",
+        )
+        .returning(Order.id)
+        .execution_options(synchronize_session=False)
+    )
+    ids = list(res.scalars())
+    if ids:
+        _count_transitions(session, OrderStatus.PAID, len(ids))
+    return ids
+
+
+@observe_dao
+async def get_stuck_orders(
+    session: AsyncSession,
+    status: OrderStatus,
+    before: datetime,
+    after: datetime | None = None,
+    limit: int = 500,
+) -> list[Order]:
+    """Заказы, застрявшие в status: для PAID считаем от paid_at, для остальных — от created_at."""
+    column = Order.paid_at if status == OrderStatus.PAID else Order.created_at
+    query = select(Order).where(Order.status == status, column < before)
+    if after is not None:
+        query = query.where(column >= after)
+    res = await session.execute(
+        query.order_by(Order.id).limit(limit).options(selectinload(Order.user), selectinload(Order.parent))
+    )
+    return list(res.scalars())
+
+
+@observe_dao
+async def mark_submitted(session: AsyncSession, order_id: int, task_id: str) -> bool:
+    # тот же условный UPDATE, что в transition(), но с paid_at — для латентности в отчётах
+    res = await session.execute(
+        update(Order)
+        .where(Order.id == order_id, Order.status.in_(ALLOWED_FROM[OrderStatus.SUBMITTED]))
+        .values(status=OrderStatus.SUBMITTED, task_id=task_id, locked_at=None)
+        .returning(Order.paid_at)
+        .execution_options(synchronize_session=False)
+    )
+    row = res.first()
+    if row is None:
+        return False
+    _count_transitions(session, OrderStatus.SUBMITTED)
+    counters = {"status:SUBMITTED": 1}
+    if row.paid_at is not None:
+        latency = (datetime.utcnow() - row.paid_at).total_seconds()
+        counters[f"submit_latency:{bisect.bisect_left(SUBMIT_LATENCY_BUCKETS, latency)}"] = 1
+    await bump_daily(session, counters)
+    return True
+
+
+@observe_dao
+async def mark_completed(session: AsyncSession, order_id: int) -> bool:
+    ok = await transition(session, order_id, OrderStatus.COMPLETED)
+    if ok:
+        await bump_daily(session, {"status:COMPLETED": 1})
+    return ok
+
+
+@observe_dao
+async def mark_failed(session: AsyncSession, order_id: int) -> bool:
+    ok = await transition(session, order_id, OrderStatus.FAILED)
+    if ok:
+        await bump_daily(session, {"status:FAILED": 1})
+    return ok
+
+
+@observe_dao
+async def remember_prompt(session: AsyncSession, key: str, order_id: int, task_id: str, size: int) -> None:
+    """Запоминает отправленную задачу под ключом запроса; новая генерация вытесняет прежнюю."""
+    now = datetime.utcnow()
+    values = {"order_id": order_id, "task_id": task_id, "ready": False, "last_used_at": now}
+    insert = _dialect_insert(session)
+    if insert is None:
+        row = await session.get(PromptCache, key)
+        if row is None:
+            session.add(PromptCache(key=key, hits=0, created_at=now, **values))
+        else:
+            for name, value in values.items():
+                setattr(row, name, value)
+        await session.flush()
+    else:
+        stmt = insert(PromptCache).values(key=key, hits=0, created_at=now, **values)
+        await session.execute(stmt.on_conflict_do_update(
+            index_elements=["key"],
+            set_={**values, "hits": 0, "created_at": now},
+        ))
+
+    # LRU: оставляем size самых свежих ключей; key в сортировке разбивает равные last_used_at,
+    # так что удаляется ровно лишнее, а только что записанный ключ не трогаем никогда
+    res = await session.execute(
+        select(PromptCache.key)
+        .where(PromptCache.key != key)
+        .order_by(PromptCache.last_used_at.desc(), PromptCache.key)
+        .offset(max(size - 1, 0))
+    )
+    stale = res.scalars().all()
+    if stale:
+        await session.execute(delete(PromptCache).where(PromptCache.key.in_(stale)))
+
 
+@observe_dao
+async def prompt_ready(session: AsyncSession, order_id: int) -> None:
+    await session.execute(update(PromptCache).where(PromptCache.order_id == order_id).values(ready=True))
 
-async def mark_failed(session: AsyncSession, order: Order) -> None:
-    order.status = OrderStatus.FAILED
+
+@observe_dao
+async def forget_prompt(session: AsyncSession, order_id: int) -> None:
+    # неудачный результат повторно не предлагаем
+    await session.execute(delete(PromptCache).where(PromptCache.order_id == order_id))
+
+
+@observe_dao
+async def find_prompt(session: AsyncSession, key: str) -> tuple[PromptCache, Order] | None:
+    res = await session.execute(
+        select(PromptCache, Order).join(Order, Order.id == PromptCache.order_id).where(PromptCache.key == key)
+    )
+    row = res.first()
+    return (row[0], row[1]) if row is not None else None
+
+
+@observe_dao
+async def touch_prompt(session: AsyncSession, key: str) -> None:
+    await session.execute(
+        update(PromptCache)
+        .where(PromptCache.key == key)
+        .values(hits=PromptCache.hits + 1, last_used_at=datetime.utcnow())
+    )
+
+
+@observe_dao
+async def get_submitted_orders(session: AsyncSession, after_id: int = 0, limit: int = 100) -> list[Order]:
+    """Страница SUBMITTED по id после after_id (keyset, без OFFSET)."""
+    res = await session.execute(
+        select(Order)
+        .where(Order.status == OrderStatus.SUBMITTED, Order.task_id.is_not(None), Order.id > after_id)
+        .order_by(Order.id)
+        .limit(limit)
+        .options(selectinload(Order.user))
+    )
+    return list(res.scalars())
+
+
+@observe_dao
+async def get_order_history(
+    session: AsyncSession,
+    user_id: int,
+    before_id: int | None = None,
+    after_id: int | None = None,
+    limit: int = 5,
+) -> tuple[list[Order], bool, bool]:
+    """Страница истории по индексу (user_id, id), новые сверху: (заказы, есть старше, есть новее).
+
+    before_id — листаем к старым, after_id — обратно к новым. Без OFFSET:
+    каждая страница — один проход по индексу от курсора.
+    """
+    query = select(Order).where(
+        Order.user_id == user_id,
+        Order.parent_id.is_(None),
+        Order.status != OrderStatus.DRAFT,
+    )
+    if after_id is not None:
+        query = query.where(Order.id > after_id).order_by(Order.id.asc())
+    else:
+        if before_id is not None:
+            query = query.where(Order.id < before_id)
+        query = query.order_by(Order.id.desc())
+    res = await session.execute(query.limit(limit + 1))
+    orders = list(res.scalars())
+    more = len(orders) > limit
+    orders = orders[:limit]
+
+    if after_id is not None:
+        orders.reverse()
+        return orders, True, more
+    return orders, more, before_id is not None
+
+
+@observe_dao
+async def get_daily_rollups(session: AsyncSession, since: date) -> dict[str, int]:
+    """Сумма дневных счётчиков с since включительно — читает только daily_rollups."""
+    res = await session.execute(
+        select(DailyRollup.metric, func.sum(DailyRollup.value))
+        .where(DailyRollup.day >= since)
+        .group_by(DailyRollup.metric)
+    )
+    return {metric: int(value or 0) for metric, value in res.all()}
+
+
+def median_submit_latency(totals: dict[str, int]) -> float | None:
+    """Медиана по корзинам SUBMIT_LATENCY_BUCKETS с линейной интерполяцией внутри корзины."""
+    counts = [totals.get(f"submit_latency:{i}", 0) for i in range(len(SUBMIT_LATENCY_BUCKETS) + 1)]
+    total = sum(counts)
+    if not total:
+        return None
+    half = total / 2
+    seen = 0
+    for i, count in enumerate(counts):
+        if count and seen + count >= half:
+            low = SUBMIT_LATENCY_BUCKETS[i - 1] if i else 0
+            if i == len(SUBMIT_LATENCY_BUCKETS):
+                return float(low)
+            return low + (SUBMIT_LATENCY_BUCKETS[i] - low) * (half - seen) / count
+        seen += count
+    return None
+
+
+@observe_dao
+async def expire_abandoned_orders(session: AsyncSession, before: datetime, limit: int) -> int:
+    """Удаляет неоплаченные DRAFT/INVOICED старше before вместе с треками пакета; возвращает число счетов."""
+    res = await session.execute(
+        select(Order.id)
+        .where(
+            Order.parent_id.is_(None),
+            Order.status.in_((OrderStatus.DRAFT, OrderStatus.INVOICED)),
+            Order.created_at < before,
+        )
+        .order_by(Order.id)
+        .limit(limit)
+    )
+    ids = list(res.scalars())
+    if not ids:
+        return 0
+    await session.execute(delete(Order).where(Order.parent_id.in_(ids)))
+    await session.execute(delete(Order).where(Order.id.in_(ids)))
+    return len(ids)
+
+
+@observe_dao
+async def expire_states(session: AsyncSession, before: datetime, limit: int) -> int:
+    res = await session.execute(
+        select(State.user_id).where(State.updated_at < before).order_by(State.updated_at).limit(limit)
+    )
+    user_ids = list(res.scalars())
+    if not user_ids:
+        return 0
+    await session.execute(delete(State).where(State.user_id.in_(user_ids)))
+
+    def _evict() -> None:
+        for user_id in user_ids:
+            state_cache.pop(user_id)
+
+    after_commit(session, _evict)
+    return len(user_ids)
+
+
+def _archive_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value.value if isinstance(value, OrderStatus) else value
+
+
+@observe_dao
+async def archive_orders(session: AsyncSession, before: datetime, limit: int) -> int:
+    """Переносит в orders_archive до limit завершённых заказов (пакет — вместе с треками); возвращает число строк.
+
+    Пакет уходит в архив, только когда завершены все его треки.
+    """
+    child = aliased(Order)
+    unfinished = (
+        select(child.id)
+        .where(child.parent_id == Order.id, child.status.not_in(TERMINAL_STATUSES))
+        .exists()
+    )
+    res = await session.execute(
+        select(Order.id)
+        .where(
+            Order.parent_id.is_(None),
+            Order.status.in_(TERMINAL_STATUSES),
+            Order.created_at < before,
+            ~unfinished,
+        )
+        .order_by(Order.id)
+        .limit(limit)
+    )
+    ids = list(res.scalars())
+    if not ids:
+        return 0
+
+    res = await session.execute(select(Order).where(or_(Order.id.in_(ids), Order.parent_id.in_(ids))))
+    orders = list(res.scalars())
+    now = datetime.utcnow()
+    columns = [c.key for c in Order.__table__.columns]
+    session.add_all([
+        OrderArchive(
+            id=order.id,
+            user_id=order.user_id,
+            status=order.status.value,
+            created_at=order.created_at,
+            archived_at=now,
+            data=zlib.compress(json.dumps(
+                {name: _archive_value(getattr(order, name)) for name in columns}, ensure_ascii=False,
+            ).encode()),
+        )
+        for order in orders
+    ])
     await session.flush()
 
+    archived = [order.id for order in orders]
+    for order in orders:
+        session.expunge(order)
+    await session.execute(delete(PromptCache).where(PromptCache.order_id.in_(archived)))
+    await session.execute(delete(Order).where(Order.parent_id.in_(ids)))
+    await session.execute(delete(Order).where(Order.id.in_(ids)))
+    return len(archived)
 
+
+@observe_dao
 async def get_state(session: AsyncSession, user_id: int) -> State | None:
     return await session.get(State, user_id)
 
-async def get_or_create_state(session: AsyncSession, user: User) -> State:
-    st = await session.get(State, user.id)
+@observe_dao
+async def get_or_create_state(session: AsyncSession, user_id: int) -> State:
+    st = await session.get(State, user_id)
     if st:
         return st
-    st = State(user_id=user.id, step=None)
+    st = State(user_id=user_id, step=None)
     session.add(st)
     return st
 
+@observe_dao
 async def set_state(
     session: AsyncSession,
-    user: User,
+    user_id: int,
     *,
     step: str | None = None,
     function: str | None = None,
@@ -113,7 +908,7 @@ async def set_state(
     style: str | None = None,
     prompt: str | None = None,
 ) -> State:
-    st = await get_or_create_state(session, user)
+    st = await get_or_create_state(session, user_id)
 
     if step is not None:
         st.step = step
@@ -128,9 +923,13 @@ async def set_state(
     if prompt is not None:
         st.prompt = prompt
 
+    cached = CachedState.from_model(st)
+    after_commit(session, lambda: state_cache.set(user_id, cached))
     return st
 
-async def clear_state(session: AsyncSession, user: User) -> None:
-    st = await session.get(State, user.id)
+@observe_dao
+async def clear_state(session: AsyncSession, user_id: int) -> None:
+    after_commit(session, lambda: state_cache.pop(user_id))
+    st = await session.get(State, user_id)
     if st:
         await session.delete(st)
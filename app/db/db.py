@@ -1,16 +1,84 @@
 import os
+import logging
+from typing import Callable
+
 from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.orm import Session
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 
+from metrics import instrument_engine
+
 load_dotenv()
+log = logging.getLogger("aiogram-stars-bot.db")
 
 DATABASE_URL = os.environ["DATABASE_URL"]
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "8"))
+
+
+def _engine_kwargs() -> dict:
+    kwargs = {"echo": False, "pool_pre_ping": True}
+    if IS_SQLITE and ":memory:" not in DATABASE_URL:
+        # в WAL читатели не блокируют писателя, так что чтения идут параллельно по пулу соединений
+        kwargs["pool_size"] = SQLITE_POOL_SIZE
+    return kwargs
+
+
+engine = create_async_engine(DATABASE_URL, **_engine_kwargs())
+instrument_engine(engine)
+
+
+class _Session(Session):
+    pass
+
+
+SessionLocal = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession, sync_session_class=_Session)
+
+
+def after_commit(session: AsyncSession, fn: Callable[[], None]) -> None:
+    """Побочный эффект записи (метрика, кэш) — только после успешного коммита.
+
+    Если транзакция откатилась (например, пачку очереди записи повторяют поштучно),
+    эффект отбрасывается вместе с ней и не задваивается.
+    """
+    session.sync_session.info.setdefault("after_commit", []).append(fn)
+
+
+@event.listens_for(_Session, "after_commit")
+def _run_after_commit(session: Session) -> None:
+    for fn in session.info.pop("after_commit", ()):
+        try:
+            fn()
+        except Exception:
+            log.exception("after-commit hook failed")
+
+
+@event.listens_for(_Session, "after_rollback")
+def _drop_after_commit(session: Session) -> None:
+    session.info.pop("after_commit", None)
+
 
-engine = create_async_engine(DATABASE_URL, echo=False, pool_pre_ping=True)
-SessionLocal = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+if IS_SQLITE:
+    @event.listens_for(engine.sync_engine, "connect")
+    def _sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # раньше journal_mode: действует только на ещё пустой файл БД,
+        # на старых включится после разового VACUUM (см. workers/maintenance.py)
+        cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
 
 
 async def init_db() -> None:
-    from db.models import Base
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    from db.migrate import upgrade_to_head
+    await upgrade_to_head()
@@ -0,0 +1,78 @@
+import re
+import ast
+import logging
+from pathlib import Path
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+
+from db.db import engine
+
+log = logging.getLogger("aiogram-stars-bot.migrate")
+
+APP_DIR = Path(__file__).resolve().parents[1]
+BASELINE_REVISION = "0001_initial"
+# строки revision = "..." / down_revision = "..." в файлах миграций
+_REVISION_RE = re.compile(r"^(revision|down_revision)\s*=\s*(.+?)\s*$", re.MULTILINE)
+
+
+def alembic_config():
+    from alembic.config import Config
+
+    cfg = Config(str(APP_DIR / "alembic.ini"))
+    cfg.set_main_option("script_location", str(APP_DIR / "migrations"))
+    return cfg
+
+
+def script_heads() -> set[str] | None:
+    """Head-ревизии по файлам миграций без импорта alembic; None — файлы не удалось разобрать."""
+    revisions, parents = set(), set()
+    for path in (APP_DIR / "migrations" / "versions").glob("*.py"):
+        found = dict(_REVISION_RE.findall(path.read_text(encoding="utf-8")))
+        try:
+            revisions.add(ast.literal_eval(found["revision"]))
+            down = ast.literal_eval(found.get("down_revision", "None"))
+        except (KeyError, ValueError, SyntaxError):
+            return None
+        if isinstance(down, str):
+            parents.add(down)
+        elif down:
+            parents.update(down)
+    return revisions - parents or None
+
+
+def _at_head(connection: Connection) -> bool:
+    heads = script_heads()
+    if heads is None or not inspect(connection).has_table("alembic_version"):
+        return False
+    current = set(connection.execute(text("SELECT version_num FROM alembic_version")).scalars())
+    return current == heads
+
+
+def _upgrade(connection: Connection) -> None:
+    from alembic import command
+    from alembic.runtime.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+
+    cfg = alembic_config()
+    cfg.attributes["connection"] = connection
+    heads = set(ScriptDirectory.from_config(cfg).get_heads())
+    current = set(MigrationContext.configure(connection).get_current_heads())
+    if current == heads:
+        return
+
+    if not current and inspect(connection).has_table("orders"):
+        # база создана старым create_all: считаем её исходной схемой и догоняем миграциями
+        log.info("unversioned database found, stamping %s", BASELINE_REVISION)
+        command.stamp(cfg, BASELINE_REVISION)
+
+    log.info("upgrading schema %s -> %s", sorted(current) or "empty", sorted(heads))
+    command.upgrade(cfg, "head")
+
+
+async def upgrade_to_head() -> None:
+    async with engine.begin() as conn:
+        # обычный рестарт: схема уже на head, alembic не нужен вовсе
+        if await conn.run_sync(_at_head):
+            return
+        await conn.run_sync(_upgrade)
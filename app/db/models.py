@@ -1,8 +1,8 @@
 import enum
-from datetime import datetime
+from datetime import date, datetime
 from typing import Optional
 
-from sqlalchemy import String, Integer, DateTime, Text, ForeignKey, Enum, Boolean
+from sqlalchemy import String, Integer, DateTime, Date, Text, ForeignKey, Enum, Boolean, Index, LargeBinary
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -13,9 +13,12 @@ class Base(DeclarativeBase):
 class OrderStatus(str, enum.Enum):
     DRAFT = "DRAFT"         # собрали данные, ещё не оплатили
     INVOICED = "INVOICED"   # отправили инвойс
-    PAID = "PAID"           # оплатили
+    PAID = "PAID"           # оплатили, ждёт воркера генерации
+    PROCESSING = "PROCESSING" # воркер взял заказ и отправляет на генерацию; пакет — треки в работе
     SUBMITTED = "SUBMITTED" # отправили на генерацию, получили task_id
+    COMPLETED = "COMPLETED" # генерация завершена, результат доставлен
     FAILED = "FAILED"       # не смогли отправить/ошибка
+    DEAD = "DEAD"           # исчерпали попытки отправки, средства возвращены
 
 class Functions(str, enum.Enum):
     MUSIC_GENERATION = "MUSIC_GENERATION"
@@ -31,6 +34,8 @@ class User(Base):
     telegram_user_id: Mapped[int] = mapped_column(Integer, unique=True, index=True)
     username: Mapped[str | None] = mapped_column(String(64), nullable=True)
     first_name: Mapped[str | None] = mapped_column(String(128), nullable=True)
+    # язык клиента Telegram — для сообщений из воркеров, где апдейта нет
+    language_code: Mapped[str | None] = mapped_column(String(16), nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     orders: Mapped[list["Order"]] = relationship(back_populates="user")
     state: Mapped[Optional["State"]] = relationship(
@@ -42,8 +47,18 @@ class User(Base):
 
 class Order(Base):
     __tablename__ = "orders"
+    __table_args__ = (
+        Index("ix_orders_task_id", "task_id"),
+        Index("ix_orders_invoice_payload", "invoice_payload"),
+        Index("ix_orders_status_created_at", "status", "created_at"),
+        Index("ix_orders_status_next_attempt_at", "status", "next_attempt_at"),
+        Index("uq_orders_telegram_payment_charge_id", "telegram_payment_charge_id", unique=True),
+        Index("ix_orders_parent_id", "parent_id"),
+        # keyset-пагинация истории: WHERE user_id = ? AND id < ? ORDER BY id DESC
+        Index("ix_orders_user_id_id", "user_id", "id"),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
     chat_id: Mapped[int] = mapped_column(Integer)
     function: Mapped[str | None] = mapped_column(String(32), nullable=True)
     mode: Mapped[str | None] = mapped_column(String(32), nullable=True)
@@ -57,9 +72,25 @@ class Order(Base):
     invoice_payload: Mapped[str | None] = mapped_column(String(128), nullable=True)
     telegram_payment_charge_id: Mapped[str | None] = mapped_column(String(128), nullable=True)
     task_id: Mapped[str | None] = mapped_column(String(128), nullable=True)
+    # финальный ответ /music/status (JSON), пишется один раз при SUCCESS/ошибке
+    result: Mapped[str | None] = mapped_column(Text, nullable=True)
+    # file_id загруженных в Telegram треков (JSON-список по порядку sunoData)
+    audio_file_ids: Mapped[str | None] = mapped_column(Text, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     paid_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    # очередь генерации
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    next_attempt_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    locked_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    # пакетный заказ: родитель держит счёт (batch_size треков), дочерние — по одному треку
+    parent_id: Mapped[int | None] = mapped_column(ForeignKey("orders.id"), nullable=True)
+    batch_size: Mapped[int] = mapped_column(Integer, default=1)
+    batch_submitted: Mapped[int] = mapped_column(Integer, default=0)
+    # W3C traceparent апдейта оплаты: воркер генерации продолжает ту же трассу
+    traceparent: Mapped[str | None] = mapped_column(String(55), nullable=True)
     user: Mapped["User"] = relationship(back_populates="orders")
+    parent: Mapped[Optional["Order"]] = relationship(remote_side=[id])
 
 class State(Base):
     __tablename__ = "states"
@@ -83,3 +114,72 @@ class State(Base):
     )
 
     user: Mapped["User"] = relationship(back_populates="state")
+
+
+class ProcessedPayment(Base):
+    """Идемпотентность successful_payment: одна строка на telegram_payment_charge_id.
+
+    Заодно — состояние возврата: refund_due_at без refunded_at — возврат должен, но не прошёл,
+    его повторяет recovery.
+    """
+    __tablename__ = "processed_payments"
+    __table_args__ = (
+        Index("ix_processed_payments_refund_due_at", "refund_due_at"),
+    )
+
+    telegram_payment_charge_id: Mapped[str] = mapped_column(String(128), primary_key=True)
+    order_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    telegram_user_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    amount: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    refund_due_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    refunded_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+
+class DailyRollup(Base):
+    """Дневные агрегаты для отчётов: счётчик metric за день, обновляется вместе с заказом.
+
+    metric — "status:PAID", "payments", "stars_paid", "refunds", "stars_refunded",
+    "submit_latency:<номер корзины>".
+    """
+    __tablename__ = "daily_rollups"
+
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    metric: Mapped[str] = mapped_column(String(64), primary_key=True)
+    value: Mapped[int] = mapped_column(Integer, default=0)
+
+
+class PromptCache(Base):
+    """Последний результат по нормализованному запросу пользователя (см. prompt_key в workers/generation.py).
+
+    ready=False — задача отправлена и ещё генерируется; вытесняется самая давно
+    использованная запись (last_used_at), когда строк больше PROMPT_CACHE_SIZE.
+    """
+    __tablename__ = "prompt_cache"
+    __table_args__ = (
+        Index("ix_prompt_cache_order_id", "order_id"),
+        Index("ix_prompt_cache_last_used_at", "last_used_at"),
+    )
+
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    order_id: Mapped[int] = mapped_column(Integer)
+    task_id: Mapped[str] = mapped_column(String(128))
+    ready: Mapped[bool] = mapped_column(Boolean, default=False)
+    hits: Mapped[int] = mapped_column(Integer, default=0)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    last_used_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class OrderArchive(Base):
+    """Терминальные заказы, вынесенные из orders обслуживанием: вся строка — JSON, сжатый zlib."""
+    __tablename__ = "orders_archive"
+    __table_args__ = (
+        Index("ix_orders_archive_user_id", "user_id"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    user_id: Mapped[int] = mapped_column(Integer)
+    status: Mapped[str] = mapped_column(String(16))
+    created_at: Mapped[datetime] = mapped_column(DateTime)
+    archived_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    data: Mapped[bytes] = mapped_column(LargeBinary)
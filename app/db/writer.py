@@ -0,0 +1,119 @@
+import os
+import asyncio
+import logging
+import contextvars
+from typing import Any, Awaitable, Callable
+
+from dotenv import load_dotenv
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.db import SessionLocal, IS_SQLITE
+from tracing import Span, current_span, use_span
+
+load_dotenv()
+log = logging.getLogger("aiogram-stars-bot.db.writer")
+
+# по умолчанию очередь включена только для SQLite: там всё равно один писатель на файл
+WRITE_QUEUE = os.getenv("WRITE_QUEUE", "1" if IS_SQLITE else "0") == "1"
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "64"))
+WRITE_BATCH_DELAY = float(os.getenv("WRITE_BATCH_DELAY", "0.002"))
+
+WriteOp = Callable[[AsyncSession], Awaitable[Any]]
+
+
+class WriteQueue:
+    """Один писатель: мелкие записи копятся в пачку и коммитятся одной транзакцией (group commit)."""
+
+    def __init__(self, batch_size: int = WRITE_BATCH_SIZE, batch_delay: float = WRITE_BATCH_DELAY):
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        # None — стоп-метка от stop()
+        self._queue: asyncio.Queue[tuple[WriteOp, asyncio.Future, Span | None] | None] = asyncio.Queue()
+        self._task: asyncio.Task | None = None
+        self.batches = 0
+        self.ops = 0
+
+    async def submit(self, op: WriteOp) -> Any:
+        if self._task is None or self._task.done():
+            # своя пустая копия контекста: иначе писатель навсегда унаследует span первого вызвавшего
+            self._task = asyncio.create_task(self._run(), name="db-writer", context=contextvars.Context())
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((op, fut, current_span()))
+        return await fut
+
+    async def stop(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = None
+            return
+        # стоп-метка встаёт в очередь за уже принятыми записями: писатель дописывает их,
+        # включая пачку, которая коммитится прямо сейчас, и выходит сам — без cancel()
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stopping = False
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.batch_delay
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._commit(batch)
+            if stopping:
+                return
+
+    async def _commit(self, batch: list[tuple[WriteOp, asyncio.Future, Span | None]]) -> None:
+        try:
+            async with SessionLocal() as session:
+                results = []
+                for op, _, parent in batch:
+                    # операция выполняется в трассе того, кто её поставил в очередь
+                    with use_span(parent):
+                        results.append(await op(session))
+                await session.commit()
+        except Exception as e:
+            if len(batch) == 1:
+                _, fut, _ = batch[0]
+                if not fut.done():
+                    fut.set_exception(e)
+                return
+            # одна операция не должна валить чужие записи: повторяем пачку поштучно
+            log.warning("group commit of %s ops failed (%s), retrying one by one", len(batch), e)
+            for item in batch:
+                await self._commit([item])
+            return
+
+        self.batches += 1
+        self.ops += len(batch)
+        for (_, fut, _), result in zip(batch, results):
+            if not fut.done():
+                fut.set_result(result)
+
+    def stats(self) -> dict:
+        return {"pending": self._queue.qsize(), "batches": self.batches, "ops": self.ops}
+
+
+write_queue = WriteQueue()
+
+
+async def run_write(op: WriteOp) -> Any:
+    if WRITE_QUEUE:
+        return await write_queue.submit(op)
+    async with SessionLocal() as session:
+        result = await op(session)
+        await session.commit()
+        return result
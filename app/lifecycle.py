@@ -0,0 +1,89 @@
+import os
+import time
+import asyncio
+import inspect
+import logging
+from typing import Any, Callable
+
+from dotenv import load_dotenv
+
+from bot.middlewares import ConcurrencyLimitMiddleware
+
+load_dotenv()
+log = logging.getLogger("aiogram-stars-bot.lifecycle")
+
+# DRAIN_TIMEOUT — дождаться принятых апдейтов, SHUTDOWN_TIMEOUT — остановить всё остальное;
+# в сумме должно укладываться в stop_grace_period контейнера
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "25"))
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "15"))
+# даже после исчерпания бюджета каждый шаг получает столько, чтобы закрыть пулы и соединения
+SHUTDOWN_STEP_MIN = float(os.getenv("SHUTDOWN_STEP_MIN", "1"))
+
+Step = Callable[[], Any]
+
+
+async def _call(fn: Step) -> None:
+    result = fn()
+    if inspect.isawaitable(result):
+        await result
+
+
+class Lifecycle:
+    """Порядок запуска и остановки процесса.
+
+    Компоненты запускаются по очереди, остановка идёт в обратном порядке. При
+    остановке сначала перестаём принимать апдейты и дожидаемся уже принятых,
+    затем гасим фоновые задачи и в конце закрываем клиенты и пул БД.
+    """
+
+    def __init__(
+        self,
+        limiter: ConcurrencyLimitMiddleware,
+        drain_timeout: float = DRAIN_TIMEOUT,
+        timeout: float = SHUTDOWN_TIMEOUT,
+    ):
+        self.limiter = limiter
+        self.drain_timeout = drain_timeout
+        self.timeout = timeout
+        self.accepting = False
+        self._stops: list[tuple[str, Step]] = []
+        # длительность каждого шага запуска — для профиля холодного старта
+        self.timings: dict[str, float] = {}
+
+    async def start(self, name: str, start: Step | None, stop: Step | None = None) -> None:
+        if start is not None:
+            started = time.perf_counter()
+            try:
+                await _call(start)
+            except Exception:
+                # откатываем уже запущенное, чтобы процесс не завис на полуоткрытых ресурсах
+                log.exception("startup step %s failed, rolling back", name)
+                await self.shutdown()
+                raise
+            self.timings[name] = time.perf_counter() - started
+        if stop is not None:
+            self._stops.append((name, stop))
+
+    def ready(self) -> None:
+        self.accepting = True
+        log.info("started: %s", ", ".join(name for name, _ in self._stops))
+
+    async def shutdown(self) -> None:
+        self.accepting = False
+        if not await self.limiter.drain(self.drain_timeout):
+            log.warning("shutdown: %s updates abandoned", self.limiter.in_flight)
+
+        deadline = time.monotonic() + self.timeout
+        while self._stops:
+            name, stop = self._stops.pop()
+            budget = max(deadline - time.monotonic(), SHUTDOWN_STEP_MIN)
+            try:
+                await asyncio.wait_for(_call(stop), budget)
+            except asyncio.TimeoutError:
+                log.warning("shutdown step %s timed out after %.1fs", name, budget)
+            except Exception:
+                log.exception("shutdown step %s failed", name)
+
+    def stats(self) -> dict:
+        return {"accepting": int(self.accepting), "steps": len(self._stops)}
+
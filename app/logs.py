@@ -0,0 +1,76 @@
+import os
+import json
+import random
+import logging
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+from tracing import current_span
+
+load_dotenv()
+
+# json — одна запись на строку для сборщика логов; text — прежний формат для локальной отладки
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# доля INFO/DEBUG вне записываемых трасс; WARNING и выше пишутся всегда
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1"))
+# логгеры, пишущие на каждый апдейт/запрос: их INFO сэмплируются отдельно
+LOG_HOT_LOGGERS = tuple(x for x in os.getenv("LOG_HOT_LOGGERS", "aiogram.event,httpx").replace(" ", "").split(",") if x)
+LOG_HOT_SAMPLE_RATE = float(os.getenv("LOG_HOT_SAMPLE_RATE", "0.01"))
+
+# поля LogRecord, которые не относятся к extra=
+_RECORD_FIELDS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись — JSON-объект: время, уровень, логгер, сообщение, trace_id/span_id текущего span и поля extra=."""
+
+    def __init__(self, static: dict | None = None):
+        super().__init__()
+        self.static = static or {}
+
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **self.static,
+        }
+        span = current_span()
+        if span is not None:
+            out["trace_id"] = span.trace_id
+            out["span_id"] = span.span_id
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS:
+                out[key] = value
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Прореживает INFO/DEBUG; в записываемой трассе пишется всё, чтобы трасса и логи совпадали."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        span = current_span()
+        if span is not None and span.sampled:
+            return True
+        rate = LOG_HOT_SAMPLE_RATE if record.name.startswith(LOG_HOT_LOGGERS) else LOG_SAMPLE_RATE
+        return rate >= 1 or random.random() < rate
+
+
+def setup_logging() -> None:
+    # в дочернем процессе супервизора SHARD_INDEX уже выставлен: шард попадает в каждую запись
+    shard = os.environ.get("SHARD_INDEX")
+    handler = logging.StreamHandler()
+    handler.addFilter(SamplingFilter())
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter({"shard": int(shard)} if shard is not None else None))
+    else:
+        prefix = f"[shard {shard}] " if shard is not None else ""
+        handler.setFormatter(logging.Formatter(prefix + "%(levelname)s:%(name)s:%(message)s"))
+    logging.basicConfig(level=LOG_LEVEL, handlers=[handler], force=True)
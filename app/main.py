@@ -1,309 +1,358 @@
 import os
 import re
-import html
+import json
 import logging
+from datetime import datetime, timedelta
+
+# первым: профиль старта считает время всех импортов ниже
+from startup import profile
 
-import httpx
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery, LabeledPrice, PreCheckoutQuery
-from aiogram.methods import RefundStarPayment
 
-from db.db import SessionLocal, init_db
+from db.db import init_db, SessionLocal, engine
+from db.writer import run_write, write_queue
 from db.dao import (
-    get_or_create_user,
     create_order,
     set_order_invoiced,
     get_order_by_id,
-    mark_paid,
-    mark_submitted,
-    mark_failed,
-    get_state,
-    set_state,
-    clear_state
+    get_order_by_task_id,
+    apply_payment,
+    create_batch_order,
+    get_order_history,
+    get_daily_rollups,
+    median_submit_latency,
+    find_prompt,
+    touch_prompt,
 )
 from db.models import OrderStatus
-from bot.buttons import start_menu, generation_song_mode_menu, song_type_menu, main_menu
+from db.cache import CachedUser, CachedState, user_cache, state_cache
+from bot.middlewares import UserStateMiddleware, ConcurrencyLimitMiddleware, UpdateDedupMiddleware
+from bot.state_storage import create_state_storage
+from bot.throttling import ThrottlingMiddleware, SendRateLimiter
+from bot.messages import Texts, RESET_BUTTONS, MAX_PROMPT_CLASSIC, render_status, render_history, render_stats, texts_for
+from bot.buttons import history_nav
+from bot.miniapp import miniapp_payment
+from workers.poller import StatusPoller, POLL_INTERVAL, POLL_CALLBACK_INTERVAL
+from workers.generation import GenerationWorkerPool, PROMPT_CACHE_SIZE, prompt_key
+from workers.delivery import audio_delivery
+from workers.recovery import RecoverySweep
+from workers.maintenance import MaintenanceJob
+from workers.refunds import refund_payment
+from lifecycle import Lifecycle
+from metrics import HandlerMetricsMiddleware, register_stats, PROMPT_CACHE
+from tracing import TracingMiddleware, annotate, current_span, exporter
+from logs import setup_logging
+from server import HTTP_SERVER, build_web_app, callback_url, start_web_server
+from api.client import open_client, close_client, backend_breaker, generate_limiter
+from api.status import get_task_status, is_success, status_cache
+
+profile.imports_done()
 
 load_dotenv()
-logging.basicConfig(level=logging.INFO)
+setup_logging()
 log = logging.getLogger("aiogram-stars-bot")
 
 BOT_TOKEN = os.environ["BOT_TOKEN"]
-API_BASE_URL = os.getenv("API_BASE_URL", "http://127.0.0.1:8000").rstrip("/")
 MODEL = os.getenv("MODEL", "V4_5ALL")
 PRICE_STARS = int(os.getenv("PRICE_STARS", "6"))
-BOT_SERVICE_TOKEN=os.getenv("BOT_SERVICE_TOKEN")
-MAX_PROMPT_CLASSIC=500
-
-bot = Bot(token=BOT_TOKEN)
+RUN_MODE = os.getenv("RUN_MODE", "polling")
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "100"))
+BATCH_MAX = int(os.getenv("BATCH_MAX", "5"))
+# свой Bot API сервер (local bot api, заглушка в бенчмарках)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+# число процессов-шардов; 1 — всё в одном процессе, как раньше
+WORKERS = int(os.getenv("WORKERS", "1"))
+# супервизор и при одном шарде: строгий порядок апдейтов пользователя, перезапуск упавшего процесса
+SUPERVISOR = WORKERS > 1 or os.getenv("SUPERVISOR", "0") == "1"
+SHARD_INDEX = int(os.getenv("SHARD_INDEX", "0"))
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "5"))
+# telegram id администраторов через запятую: им доступна /stats
+ADMIN_IDS = frozenset(int(x) for x in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if x)
+STATS_DAYS = int(os.getenv("STATS_DAYS", "7"))
+# поллер статусов и HTTP-сервер нужны в одном экземпляре
+PRIMARY_SHARD = SHARD_INDEX == 0
+
+session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+bot = Bot(token=BOT_TOKEN, session=session)
+send_limiter = SendRateLimiter()
+bot.session.middleware(send_limiter)
 dp = Dispatcher()
-
-STATE: dict[int, dict] = {}
+state_storage = create_state_storage(run_mode=RUN_MODE)
+# первым: в span апдейта попадают и дедупликация, и ожидание слота
+dp.update.outer_middleware(TracingMiddleware())
+update_dedup = UpdateDedupMiddleware()
+dp.update.outer_middleware(update_dedup)
+update_limiter = ConcurrencyLimitMiddleware(MAX_CONCURRENT_UPDATES)
+dp.update.outer_middleware(update_limiter)
+throttling = ThrottlingMiddleware()
+dp.message.outer_middleware(throttling)
+dp.callback_query.outer_middleware(throttling)
+dp.message.middleware(UserStateMiddleware(state_storage))
+dp.callback_query.middleware(UserStateMiddleware(state_storage))
+dp.message.middleware(HandlerMetricsMiddleware())
+dp.callback_query.middleware(HandlerMetricsMiddleware())
+dp.pre_checkout_query.middleware(HandlerMetricsMiddleware())
+poller = StatusPoller(bot, interval=POLL_CALLBACK_INTERVAL if callback_url() else POLL_INTERVAL)
+generation_pool = GenerationWorkerPool(bot)
+recovery = RecoverySweep(bot, generation_pool)
+maintenance = MaintenanceJob()
+lifecycle = Lifecycle(update_limiter)
+web_runner = None
+
+register_stats("user_cache", user_cache)
+register_stats("state_cache", state_cache)
+register_stats("status_cache", status_cache)
+register_stats("throttling", throttling)
+register_stats("send_limiter", send_limiter)
+register_stats("updates", update_limiter)
+register_stats("update_dedup", update_dedup)
+register_stats("db_writer", write_queue)
+register_stats("audio_delivery", audio_delivery)
+register_stats("recovery", recovery)
+register_stats("maintenance", maintenance)
+register_stats("backend_breaker", backend_breaker)
+register_stats("generate_limiter", generate_limiter)
+register_stats("lifecycle", lifecycle)
+register_stats("startup", profile)
+register_stats("tracing", exporter)
 
 
 ORDER_PAYLOAD_RE = re.compile(r"^order:(\d+)$")
 MORDER_PAYLOAD_RE = re.compile(r"^morder:(\d+)$")
+BATCH_VARIATIONS_RE = re.compile(r"^[xх×](\d+)$", re.IGNORECASE)
 
 
-async def api_generate(payload: dict) -> str:
-    headers = {
-        "X-Bot-Token": BOT_SERVICE_TOKEN,
-        "Content-Type": "application/json",
-    }
-    async with httpx.AsyncClient(timeout=120) as client:
-        r = await client.post(f"{API_BASE_URL}/music/generate", json=payload, headers=headers)
-        if r.status_code == 422:
-            log.error("422 from API. Sent payload=%s", payload)
-            log.error("422 details=%s", r.text)
-        r.raise_for_status()
-        return r.json()["taskId"]
-
-async def check_task(task_id: str) -> dict:
-    async with httpx.AsyncClient(timeout=120) as client:
-        r = await client.get(f"{API_BASE_URL}/music/status/{task_id}")
-        r.raise_for_status()
-        return r.json()
-
-async def api_mark_paid(order_id: int, charge_id: str) -> None:
-    headers = {
-        "X-Bot-Token": BOT_SERVICE_TOKEN,
-        "Content-Type": "application/json",
-    }
-    payload = {"order_id": order_id, "telegram_payment_charge_id": charge_id}
-    async with httpx.AsyncClient(timeout=60) as client:
-        r = await client.post(f"{API_BASE_URL}/payments/stars/paid", json=payload, headers=headers)
-        r.raise_for_status()
-
 @dp.message(Command("start"))
-async def start_cmd(message: Message):
-    async with SessionLocal() as session:
-        user = await get_or_create_user(
-            session=session,
-            telegram_user_id=message.from_user.id,
-            username=message.from_user.username,
-            first_name=message.from_user.first_name,
-        )
-        await clear_state(session, user)
-        await session.commit()
+async def start_cmd(message: Message, user: CachedUser, texts: Texts):
+    await state_storage.clear(user.id)
 
-    await message.answer(
-        text='Бот умеет генерировать и редактировать музыку. Выбери действие.',
-        reply_markup=start_menu(),
-    )
-    await  message.answer(
-        text='Начать занаво можно нажав "Сбросить" в нижнем меню 👇',
-        reply_markup=main_menu(),
-    )
+    await message.answer(text=texts.start, reply_markup=texts.start_menu)
+    await message.answer(text=texts.start_hint, reply_markup=texts.main_menu)
 @dp.message(Command("status"))
-async def status_cmd(message: Message):
+async def status_cmd(message: Message, texts: Texts):
     parts = (message.text or "").strip().split(maxsplit=1)
     if len(parts) < 2 or not parts[1].strip():
-        await message.answer("Пришли так: <code>/status &lt;task_id&gt;</code>", parse_mode="HTML")
+        await message.answer(texts.status_usage, parse_mode="HTML")
         return
 
     task_id = parts[1].strip()
 
     try:
-        result = await check_task(task_id)
+        result = await get_task_status(task_id)
 
-        status = result.get("status") or "UNKNOWN"
+        await message.answer(
+            text=render_status(result, texts),
+            disable_web_page_preview=True,
+            parse_mode="HTML",
+        )
 
-        # Ожидаем список треков
-        data = (
-            result.get("raw", {})
-                  .get("data", {})
-                  .get("response", {})
-                  .get("sunoData")
-        ) or []
+    except Exception:
+        await message.answer(texts.status_error)
+        return
 
-        lines = [f"Статус: <b>{html.escape(str(status))}</b>"]
+    if is_success(result):
+        # сами треки — только в чат заказа; повторно уходят по сохранённым file_id
+        async with SessionLocal() as session:
+            order = await get_order_by_task_id(session, task_id)
+        if order is not None and order.chat_id == message.chat.id:
+            audio_delivery.submit(message.bot, order.id, order.chat_id, result, texts)
 
-        if status == "SUCCESS" and isinstance(data, list) and len(data) > 0:
-            for i, item in enumerate(data[:2], start=1):
-                if not isinstance(item, dict):
-                    continue
+async def _history_page(user_id: int, texts: Texts, before_id: int | None = None, after_id: int | None = None):
+    async with SessionLocal() as session:
+        orders, older, newer = await get_order_history(
+            session, user_id, before_id=before_id, after_id=after_id, limit=HISTORY_PAGE_SIZE,
+        )
+    if not orders:
+        return render_history(orders, texts), None
+    keyboard = history_nav(
+        texts.labels,
+        older=orders[-1].id if older else None,
+        newer=orders[0].id if newer else None,
+    )
+    return render_history(orders, texts), keyboard
 
-                image_url = item.get("imageUrl")
-                audio_url = item.get("audioUrl")
-                title = item.get("title") or f"Трек {i}"
 
-                block = [f"{"ПЕРВЫЙ" if i == 1 else "ВТОРОЙ"}\n<b>{html.escape(str(f'Название: {title}'))}</b>"]
+@dp.message(Command("history"))
+async def history_cmd(message: Message, user: CachedUser, texts: Texts):
+    text, keyboard = await _history_page(user.id, texts)
+    await message.answer(text, reply_markup=keyboard)
 
-                if image_url:
-                    block.append(f'🖼 <a href="{html.escape(image_url)}">Обложка</a>')
-                else:
-                    block.append("🖼 Обложка: нет ссылки")
 
-                if audio_url:
-                    block.append(f'🎵 <a href="{html.escape(audio_url)}">Трек</a>')
-                else:
-                    block.append("🎵 Трек: нет ссылки")
+@dp.callback_query(F.data.startswith("history:"))
+async def history_nav_chosen(callback: CallbackQuery, user: CachedUser, texts: Texts):
+    await callback.answer()
+    _, direction, cursor = callback.data.split(":", 2)
+    if direction == "older":
+        text, keyboard = await _history_page(user.id, texts, before_id=int(cursor))
+    else:
+        text, keyboard = await _history_page(user.id, texts, after_id=int(cursor))
+    await callback.message.edit_text(text, reply_markup=keyboard)
 
-                lines.append("\n".join(block))
 
-        await message.answer(
-            text="\n\n".join(lines),
-            disable_web_page_preview=True,
-            parse_mode="HTML",
-        )
+@dp.message(Command("stats"))
+async def stats_cmd(message: Message, texts: Texts):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    parts = (message.text or "").split()
+    days = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else STATS_DAYS
+    days = max(1, min(days, 366))
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    async with SessionLocal() as session:
+        totals = await get_daily_rollups(session, since)
+    await message.answer(render_stats(totals, days, median_submit_latency(totals), texts))
 
-    except Exception:
-        await message.answer(
-            "Что-то пошло не так. Проверь task_id или попробуй немного позже."
-        )
 
 @dp.callback_query(F.data.startswith("function:"))
-async def function_chosen(callback: CallbackQuery):
+async def function_chosen(callback: CallbackQuery, user: CachedUser, texts: Texts):
     await callback.answer()
     await callback.message.edit_reply_markup(reply_markup=None)
     function = callback.data.split(":", 1)[1]
 
-    async with SessionLocal() as session:
-        user = await get_or_create_user(
-            session=session,
-            telegram_user_id=callback.from_user.id,
-            username=callback.from_user.username,
-            first_name=callback.from_user.first_name,
-        )
-        await set_state(session, user, function=function, step="mode")
-        await session.commit()
-
-    if function == 'generation_music':
-        await callback.message.answer(
-            text="Выбери режим: \n\nОбычный - указывается только описание трека, "
-                 "по описанию генерируется текст песни и жанры."
-                 "\n\nРасширенный - Описываетсся жанр трека, выберается инмтрументальный трек или песня, "
-                 "для песни указывается текст.",
-            reply_markup=generation_song_mode_menu(),
-        )
+    await state_storage.update(user.id, function=function, step="mode")
+
+    if function in ('generation_music', 'batch_music'):
+        if function == 'batch_music':
+            await callback.message.answer(text=texts.batch_hint)
+        await callback.message.answer(text=texts.mode_prompt, reply_markup=texts.mode_menu)
     elif function == 'edit_music':
-        await callback.message.answer(
-            text='Функция пока в разработке',
-            reply_markup=start_menu(),
-        )
+        await callback.message.answer(text=texts.edit_unavailable, reply_markup=texts.start_menu)
 
 @dp.callback_query(F.data.startswith("mode:"))
-async def mode_chosen(callback: CallbackQuery):
+async def mode_chosen(callback: CallbackQuery, user: CachedUser, texts: Texts):
     await callback.answer()
     await callback.message.edit_reply_markup(reply_markup=None)
     mode = callback.data.split(":", 1)[1]
-    log.info(mode)
+    log.debug("mode chosen", extra={"mode": mode})
 
-    async with SessionLocal() as session:
-        user = await get_or_create_user(
-            session=session,
-            telegram_user_id=callback.from_user.id,
-            username=callback.from_user.username,
-            first_name=callback.from_user.first_name,
-        )
-        await set_state(session, user, mode=mode, step="instrumental")
-        await session.commit()
+    await state_storage.update(user.id, mode=mode, step="instrumental")
 
-    await callback.message.answer(
-        "Выбери что хочешь получить, мелодию(только музыка, без текста) или песню(с текстом)",
-        reply_markup=song_type_menu()
-    )
+    await callback.message.answer(texts.song_type_prompt, reply_markup=texts.song_type_menu)
 
 @dp.callback_query(F.data.startswith("instrumental:"))
-async def instrumental_chosen(callback: CallbackQuery):
+async def instrumental_chosen(callback: CallbackQuery, user: CachedUser, state: CachedState, texts: Texts):
     await callback.answer()
     await callback.message.edit_reply_markup(reply_markup=None)
     instrumental = callback.data.split(":", 1)[1] == "true"
 
-    async with SessionLocal() as session:
-        user = await get_or_create_user(
-            session=session,
-            telegram_user_id=callback.from_user.id,
-            username=callback.from_user.username,
-            first_name=callback.from_user.first_name,
-        )
-        st = await get_state(session, user.id)
-        mode = st.mode
-        step = "style" if mode == "custom" else "prompt"
-        await set_state(session, user, instrumental=instrumental, step=step)
-        await session.commit()
+    mode = state.mode
+    step = "style" if mode == "custom" else "prompt"
+    await state_storage.update(user.id, instrumental=instrumental, step=step)
 
     if mode == "classic":
-        await callback.message.answer(
-            text="Опиши стиль трека который хочешь получить. Описывать нужно в свободной форме.",
-            parse_mode="Markdown"
-        )
+        await callback.message.answer(text=texts.style_classic, parse_mode="Markdown")
     if mode == "custom":
-        await callback.message.answer(
-            text="Опиши стиль трека который хочешь получить. Описывать нужно в свободной форме на английском языке. например:\n"
-                    "Dark ambient techno, 128 BPM, deep drones, industrial textures, distorted kick, no vocals",
-            parse_mode="Markdown"
-        )
+        await callback.message.answer(text=texts.style_custom, parse_mode="Markdown")
 
-@dp.message(F.text == "❌ Сброс")
-async def reset_handler(message: Message):
-    # 1) сбрасываем state в БД
-    async with SessionLocal() as session:
-        user = await get_or_create_user(
-            session=session,
-            telegram_user_id=message.from_user.id,
-            username=message.from_user.username,
-            first_name=message.from_user.first_name,
-        )
-        await clear_state(session, user)
-        await session.commit()
+@dp.message(F.text.in_(RESET_BUTTONS))
+async def reset_handler(message: Message, user: CachedUser, texts: Texts):
+    # 1) сбрасываем state
+    await state_storage.clear(user.id)
 
     # 2) отвечаем пользователю
-    await message.answer(
-        "Состояние сброшено. Начнём заново 👌",
-        reply_markup=main_menu()
-    )
+    await message.answer(texts.reset_done, reply_markup=texts.main_menu)
 
     # 3) можно снова показать стартовое меню
-    await message.answer(
-        "Выбери действие:",
-        reply_markup=start_menu()
-    )
+    await message.answer(texts.choose_action, reply_markup=texts.start_menu)
 
 @dp.message(F.text)
-async def text_flow(message: Message):
+async def text_flow(message: Message, user: CachedUser, state: CachedState, texts: Texts):
     text = (message.text or "").strip()
     if not text:
         return
 
+    st = state
+    if st.mode == "classic" and st.function != "batch_music" and len(text) > MAX_PROMPT_CLASSIC:
+        await message.answer(texts.prompt_too_long(len(text)))
+        return
+
+    if not st.step:
+        await message.answer(text=texts.start, reply_markup=texts.start_menu)
+        await message.answer(text=texts.start_hint, reply_markup=texts.main_menu)
+        return
+
+    if st.step == "style" and st.mode == "custom":
+        await state_storage.update(user.id, style=text, step="prompt")
+
+        if not st.instrumental:
+            await message.answer(texts.lyrics_prompt)
+        return
+
+    if st.function == "batch_music":
+        await batch_flow(message, user, st, text, texts)
+        return
+
+    # такой запрос уже генерировали или генерируют — счёт не выставляем, предлагаем готовое
+    if await offer_cached_result(message, user, st, text, texts):
+        return
+
+    # бэкенд лежит — счёт не выставляем; шаг в состоянии сохраняется, промпт можно прислать позже
+    if backend_breaker.is_open:
+        await message.answer(texts.backend_unavailable)
+        return
+
+    await send_order_invoice(message, user, st, text, texts)
+
+
+async def offer_cached_result(message: Message, user: CachedUser, st: CachedState, text: str, texts: Texts) -> bool:
+    if PROMPT_CACHE_SIZE <= 0:
+        return False
+    key = prompt_key(user.id, st.mode, st.style, text, st.instrumental, MODEL)
     async with SessionLocal() as session:
-        user = await get_or_create_user(
-            session=session,
-            telegram_user_id=message.from_user.id,
-            username=message.from_user.username,
-            first_name=message.from_user.first_name,
+        found = await find_prompt(session, key)
+    if found is None:
+        PROMPT_CACHE.labels(outcome="miss").inc()
+        return False
+    entry, order = found
+
+    if entry.ready and order.status == OrderStatus.COMPLETED and order.result:
+        PROMPT_CACHE.labels(outcome="hit").inc()
+        result = json.loads(order.result)
+        await run_write(lambda session: touch_prompt(session, key))
+        # промпт — для кнопки «сгенерировать заново»
+        await state_storage.update(user.id, prompt=text)
+        await message.answer(texts.prompt_reused)
+        await message.answer(
+            text=render_status(result, texts),
+            disable_web_page_preview=True,
+            parse_mode="HTML",
+            reply_markup=texts.fresh_menu,
         )
+        # треки уходят по сохранённым file_id, без повторной загрузки
+        audio_delivery.submit(bot, order.id, message.chat.id, result, texts)
+        return True
 
-        st = await get_state(session, user.id)
-        if st.mode == "classic" and len(text) > 500:
-            await message.answer(
-                f"Слишком длинный запрос для обычного режима (лимит {MAX_PROMPT_CLASSIC} символов).\n"
-                f"Сейчас: {len(text)}.\n"
-            )
-            return
+    if not entry.ready and order.status == OrderStatus.SUBMITTED:
+        PROMPT_CACHE.labels(outcome="in_flight").inc()
+        await state_storage.update(user.id, prompt=text)
+        await message.answer(texts.prompt_in_flight, reply_markup=texts.fresh_menu)
+        return True
 
-        if not st or not st.step:
-            await message.answer(
-                text='Бот умеет генерировать и редактировать музыку. Выбери действие.',
-                reply_markup=start_menu(),
-            )
-            await  message.answer(
-                text='Начать занаво можно нажав "Сбросить" в нижнем меню 👇',
-                reply_markup=main_menu(),
-            )
-            return
+    PROMPT_CACHE.labels(outcome="miss").inc()
+    return False
 
-        if st.step == "style" and st.mode == "custom":
-            await set_state(session, user, style=text, step="prompt")
-            await session.commit()
 
-            if not st.instrumental:
-                await message.answer("2/2) Пришли текст песни (lyrics). Можно с [verse]/[chorus].")
-            return
+@dp.callback_query(F.data == "prompt:fresh")
+async def fresh_chosen(callback: CallbackQuery, user: CachedUser, state: CachedState, texts: Texts):
+    await callback.answer()
+    await callback.message.edit_reply_markup(reply_markup=None)
+    if not state.step or not state.prompt:
+        # состояние уже сброшено или счёт по этому запросу выставлен
+        await callback.message.answer(text=texts.start, reply_markup=texts.start_menu)
+        return
+    if backend_breaker.is_open:
+        await callback.message.answer(texts.backend_unavailable)
+        return
+    PROMPT_CACHE.labels(outcome="fresh").inc()
+    await send_order_invoice(callback.message, user, state, state.prompt, texts)
 
 
+async def send_order_invoice(message: Message, user: CachedUser, st: CachedState, text: str, texts: Texts):
+    async def _create(session) -> str:
         order = await create_order(
             session=session,
             user=user,
@@ -316,125 +365,197 @@ async def text_flow(message: Message):
             model=MODEL,
             price_stars=PRICE_STARS,
         )
-        log.info(f"{order.style=}")
+        log.debug("order %s created", order.id, extra={"order_id": order.id, "style": order.style})
+        annotate(order_id=order.id)
         invoice_payload = f"order:{order.id}"
-        await set_order_invoiced(session, order, invoice_payload)
-        await clear_state(session, user)
-        await session.commit()
+        await set_order_invoiced(session, order.id, invoice_payload)
+        return invoice_payload
+
+    invoice_payload = await run_write(_create)
+    await state_storage.clear(user.id)
+
+    await message.answer(texts.invoice_sending)
+
+    await bot.send_invoice(
+        chat_id=message.chat.id,
+        title=texts.invoice_title,
+        description=texts.invoice_description,
+        payload=invoice_payload,
+        provider_token="",
+        currency="XTR",
+        prices=[LabeledPrice(label=texts.invoice_label, amount=PRICE_STARS)],
+    )
+
+def split_batch_prompts(text: str) -> list[str]:
+    lines = text.strip().splitlines()
+    m = BATCH_VARIATIONS_RE.match(lines[-1].strip()) if lines else None
+    if m:
+        prompt = "\n".join(lines[:-1]).strip()
+        return [prompt] * int(m.group(1)) if prompt else []
+    parts = re.split(r"(?m)^\s*-{3,}\s*$", text)
+    return [p.strip() for p in parts if p.strip()]
+
+
+async def batch_flow(message: Message, user: CachedUser, st: CachedState, text: str, texts: Texts):
+    prompts = split_batch_prompts(text)
+    if not 2 <= len(prompts) <= BATCH_MAX:
+        await message.answer(texts.batch_count_invalid(len(prompts)))
+        return
+    if st.mode == "classic" and any(len(p) > MAX_PROMPT_CLASSIC for p in prompts):
+        await message.answer(texts.batch_prompt_too_long)
+        return
+    if backend_breaker.is_open:
+        await message.answer(texts.backend_unavailable)
+        return
+
+    async def _create(session) -> str:
+        parent = await create_batch_order(
+            session=session,
+            user=user,
+            chat_id=message.chat.id,
+            instrumental=st.instrumental,
+            function=st.function,
+            mode=st.mode,
+            style=st.style if st.mode == "custom" else "",
+            prompts=prompts,
+            model=MODEL,
+            price_stars=PRICE_STARS,
+        )
+        invoice_payload = f"order:{parent.id}"
+        await set_order_invoiced(session, parent.id, invoice_payload)
+        return invoice_payload
 
-    await message.answer("Ок. Отправляю счёт на оплату ⭐")
+    invoice_payload = await run_write(_create)
+    await state_storage.clear(user.id)
 
+    total = PRICE_STARS * len(prompts)
+    await message.answer(texts.batch_invoice_sending(len(prompts)))
     await bot.send_invoice(
         chat_id=message.chat.id,
-        title="AI Music Generation",
-        description=f"Запуск генерации (Suno). Цена: {PRICE_STARS}⭐",
+        title=texts.invoice_title,
+        description=texts.batch_invoice_description(count=len(prompts), total=total),
         payload=invoice_payload,
         provider_token="",
         currency="XTR",
-        prices=[LabeledPrice(label=f"{PRICE_STARS} Stars", amount=PRICE_STARS)],
+        prices=[LabeledPrice(label=texts.batch_invoice_label(len(prompts)), amount=total)],
     )
 
 
 @dp.pre_checkout_query()
 async def pre_checkout(pre_checkout_query: PreCheckoutQuery):
+    # счёт мог быть выставлен до размыкания цепи — последний шанс не списать Stars
+    if backend_breaker.is_open:
+        await bot.answer_pre_checkout_query(
+            pre_checkout_query.id,
+            ok=False,
+            error_message=texts_for(pre_checkout_query.from_user.language_code).backend_unavailable,
+        )
+        return
+    m = ORDER_PAYLOAD_RE.match(pre_checkout_query.invoice_payload or "")
+    if m:
+        # брошенные счета удаляет обслуживание — старый счёт в чате оплатить уже нельзя
+        async with SessionLocal() as session:
+            order = await get_order_by_id(session, int(m.group(1)))
+        if order is None or order.status not in (OrderStatus.DRAFT, OrderStatus.INVOICED):
+            await bot.answer_pre_checkout_query(
+                pre_checkout_query.id,
+                ok=False,
+                error_message=texts_for(pre_checkout_query.from_user.language_code).invoice_expired,
+            )
+            return
     await bot.answer_pre_checkout_query(pre_checkout_query.id, ok=True)
 
 
 @dp.message(F.successful_payment)
-async def successful_payment(message: Message):
+async def successful_payment(message: Message, texts: Texts):
     sp = message.successful_payment
     payload = sp.invoice_payload or ""
 
     m_mini = MORDER_PAYLOAD_RE.match(payload)
     if m_mini:
-        mini_order_id = int(m_mini.group(1))
-
-        # сообщаем FastAPI: miniapp order оплачен
-        try:
-            await api_mark_paid(mini_order_id, sp.telegram_payment_charge_id)
-            await message.answer("✅ Оплата получена! Запуск в MiniApp…")
-        except Exception as e:
-            log.exception("mark paid failed: %s", e)
-            # при желании: refund
-            await bot(RefundStarPayment(
-                user_id=message.from_user.id,
-                telegram_payment_charge_id=sp.telegram_payment_charge_id,
-            ))
-            await message.answer("⚠️ Не удалось запустить заказ MiniApp. Средства возвращены.")
+        await miniapp_payment(message, sp, int(m_mini.group(1)), texts)
         return
 
     m = ORDER_PAYLOAD_RE.match(sp.invoice_payload or "")
     if not m:
-        await message.answer("Оплата получена ✅, но payload заказа непонятен. /start")
+        await message.answer(texts.payment_bad_payload)
         return
 
     order_id = int(m.group(1))
+    annotate(order_id=order_id)
+    span = current_span()
+    # воркер генерации продолжит трассу этого апдейта
+    traceparent = span.traceparent if span is not None else None
+
+    # 1) Атомарно переводим заказ в PAID — он попадает в очередь генерации
+    outcome = await run_write(
+        lambda session: apply_payment(
+            session, order_id, sp.telegram_payment_charge_id, sp.total_amount,
+            traceparent=traceparent, telegram_user_id=message.from_user.id,
+        )
+    )
+    if outcome == "missing":
+        # возврат уже записан: не прошедший сейчас повторит recovery
+        await refund_payment(message.bot, sp.telegram_payment_charge_id, message.from_user.id)
+        await message.answer(texts.payment_order_missing)
+        return
+    if outcome == "duplicate":
+        await message.answer(texts.paid_duplicate)
+        return
 
-    # 1) Тянем заказ из БД
-    async with SessionLocal() as session:
-        order = await get_order_by_id(session, order_id)
-        if not order:
-            await message.answer("Оплата получена ✅, но заказ не найден. Напиши /start.")
-            return
-
-        # защита от повторной обработки
-        if order.status in (OrderStatus.PAID, OrderStatus.SUBMITTED):
-            await message.answer("Этот заказ уже оплачен и обрабатывается ✅")
-            return
-
-        await mark_paid(session, order, telegram_payment_charge_id=sp.telegram_payment_charge_id)
-        await session.commit()
-
-    await message.answer("✅ Оплата получена! Запускаю генерацию…")
-
-    # 2) Запускаем генерацию через твой FastAPI
-    try:
-        api_payload = {
-            "chatId": message.chat.id,
-            "userId": message.from_user.id,
-            "telegramPaymentChargeId": sp.telegram_payment_charge_id,
-            "prompt": order.prompt,
-            "style": order.style,
-            "customMode": True if order.mode == "custom" else False,
-            "title": "Paid via Telegram Stars",
-            "instrumental": order.instrumental,
-            "model": order.model
-        }
-        log.info(f"{order.style=}")
-        log.info(f"{api_payload=}")
-        task_id = await api_generate(api_payload)
+    generation_pool.notify()
+    await message.answer(texts.payment_queued)
 
-        async with SessionLocal() as session:
-            order = await get_order_by_id(session, order_id)
-            if order:
-                await mark_submitted(session, order, task_id=task_id)
-                await session.commit()
 
-        await message.answer(f"🎛 Генерация запущена!\n Для проверки статуса, отправь в чат:  \n `/status {task_id}`", parse_mode="Markdown")
+async def _start_web() -> None:
+    global web_runner
+    web_runner = await start_web_server(build_web_app(bot, lambda: lifecycle.accepting))
 
-    except Exception as e:
-        log.exception("generate after payment failed: %s", e)
-        async with SessionLocal() as session:
-            order = await get_order_by_id(session, order_id)
-            if order:
-                await mark_failed(session, order)
-                await session.commit()
-        await bot(RefundStarPayment(
-            user_id=message.from_user.id,
-            telegram_payment_charge_id=sp.telegram_payment_charge_id,
-        ))
-        await message.answer(
-            "⚠️ Неудалось запустить генерацию. Средства возвращены."
-        )
 
+async def _stop_web() -> None:
+    if web_runner is not None:
+        await web_runner.cleanup()
 
 
 async def on_startup(dispatcher: Dispatcher):
-    await init_db()
+    # экспорт трасс останавливается последним: в файл попадают span всей остановки
+    await lifecycle.start("tracing", exporter.start, exporter.stop)
+    # потоки aiosqlite не дают интерпретатору завершиться, пока пул не закрыт
+    await lifecycle.start("db", init_db, engine.dispose)
+    # getMe кэшируется в Bot: polling потом возьмёт готовый ответ
+    await lifecycle.start("get_me", bot.me)
+    await lifecycle.start("write_queue", None, write_queue.stop)
+    await lifecycle.start("state_storage", None, state_storage.close)
+    await lifecycle.start("http_client", open_client, close_client)
+    await lifecycle.start("audio_delivery", audio_delivery.start, audio_delivery.stop)
+    await lifecycle.start("generation", generation_pool.start, generation_pool.stop)
+    if PRIMARY_SHARD:
+        await lifecycle.start("poller", poller.start, poller.stop)
+        await lifecycle.start("recovery", recovery.start, recovery.stop)
+        await lifecycle.start("maintenance", maintenance.start, maintenance.stop)
+    if PRIMARY_SHARD and RUN_MODE != "webhook" and HTTP_SERVER:
+        await lifecycle.start("http_server", _start_web, _stop_web)
+    lifecycle.ready()
+    profile.ready(lifecycle.timings)
+
+async def on_shutdown(dispatcher: Dispatcher):
+    await lifecycle.shutdown()
 
 def main():
     dp.startup.register(on_startup)
-    dp.run_polling(bot)
+    dp.shutdown.register(on_shutdown)
+    if RUN_MODE == "webhook":
+        from server import run_webhook
+
+        if SUPERVISOR:
+            raise RuntimeError("WORKERS > 1 / SUPERVISOR=1 are supported only with RUN_MODE=polling")
+        run_webhook(dp, bot, lambda: lifecycle.accepting)
+    elif SUPERVISOR:
+        from supervisor import run_supervisor
+
+        run_supervisor(WORKERS)
+    else:
+        dp.run_polling(bot)
 
 
 if __name__ == "__main__":
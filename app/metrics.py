@@ -0,0 +1,243 @@
+import abc
+import time
+import functools
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Dict, Iterable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from tracing import annotate, child_span
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric(abc.ABC):
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        REGISTRY.append(self)
+
+    @abc.abstractmethod
+    def _samples(self) -> Iterable[str]:
+        ...
+
+    def render(self) -> str:
+        head = f"# HELP {self.name} {self.doc}\n# TYPE {self.name} {self.kind}\n"
+        return head + "".join(f"{line}\n" for line in self._samples())
+
+
+class _LabeledMetric(_Metric):
+    """Метрика, которая сама хранит значения по наборам меток (.labels(...))."""
+
+    def __init__(self, name: str, doc: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, doc, labelnames)
+        self._children: dict[tuple[str, ...], Any] = {}
+
+    def labels(self, **labels: Any):
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    @abc.abstractmethod
+    def _new_child(self):
+        ...
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+
+class Counter(_LabeledMetric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def _samples(self):
+        for key, child in self._children.items():
+            yield f"{self.name}_total{_fmt_labels(self.labelnames, key)} {child.value}"
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        # оценка по бакетам — верхняя граница бакета, в который попадает квантиль
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Histogram(_LabeledMetric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labelnames: Iterable[str] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, doc, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def _samples(self):
+        for key, child in self._children.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets, child.counts):
+                cumulative += n
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_fmt_labels(self.labelnames, key, le)} {cumulative}"
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_fmt_labels(self.labelnames, key, le)} {child.count}"
+            yield f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {child.sum}"
+            yield f"{self.name}_count{_fmt_labels(self.labelnames, key)} {child.count}"
+
+
+class Gauge(_Metric):
+    """Значения читаются в момент отдачи /metrics из callback'а: () -> {labels-tuple: value}."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, labelnames: Iterable[str], collect: Callable[[], Dict[tuple, float]]):
+        super().__init__(name, doc, labelnames)
+        self.collect = collect
+
+    def _samples(self):
+        for key, value in self.collect().items():
+            yield f"{self.name}{_fmt_labels(self.labelnames, key)} {value}"
+
+
+REGISTRY: list[_Metric] = []
+
+
+def render() -> str:
+    return "".join(m.render() for m in REGISTRY)
+
+
+HANDLER_LATENCY = Histogram("bot_handler_seconds", "Handler latency", ["handler"])
+HANDLER_ERRORS = Counter("bot_handler_errors", "Handler exceptions", ["handler"])
+DB_CALL_LATENCY = Histogram("db_dao_seconds", "db.dao call latency", ["function"])
+DB_QUERY_LATENCY = Histogram("db_query_seconds", "SQL statement latency", ["statement"])
+API_LATENCY = Histogram("api_request_seconds", "Backend API latency", ["endpoint"])
+API_REQUESTS = Counter("api_requests", "Backend API requests by status code", ["endpoint", "code"])
+ORDER_TRANSITIONS = Counter("order_transitions", "Order status transitions", ["status"])
+PROMPT_CACHE = Counter("prompt_cache", "Repeated request lookups: hit, in_flight, miss, fresh", ["outcome"])
+
+
+def observe_dao(fn):
+    name = fn.__name__
+    child = DB_CALL_LATENCY.labels(function=name)
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            with child_span(f"db.{name}"):
+                return await fn(*args, **kwargs)
+        finally:
+            child.observe(time.perf_counter() - started)
+
+    return wrapper
+
+
+def instrument_engine(engine) -> None:
+    from sqlalchemy import event
+
+    sync_engine = engine.sync_engine
+
+    # время старта живёт на контексте выполнения: при ошибке запроса он просто
+    # выбрасывается, в соединении ничего не копится
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        context._query_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_query_started", None)
+        if started is None:
+            return
+        kind = statement.lstrip().split(None, 1)[0].upper() if statement else "UNKNOWN"
+        DB_QUERY_LATENCY.labels(statement=kind).observe(time.perf_counter() - started)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_obj = data.get("handler")
+        name = getattr(getattr(handler_obj, "callback", None), "__name__", "unknown")
+        annotate(handler=name)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.labels(handler=name).inc()
+            raise
+        finally:
+            HANDLER_LATENCY.labels(handler=name).observe(time.perf_counter() - started)
+
+
+# всё, у чего есть stats() -> dict (кэши, лимитеры), отдаётся как bot_runtime{component, stat}
+STATS_SOURCES: dict[str, Any] = {}
+
+
+def register_stats(name: str, source: Any) -> None:
+    STATS_SOURCES[name] = source
+
+
+def _collect_stats() -> Dict[tuple, float]:
+    return {
+        (name, stat): value
+        for name, source in STATS_SOURCES.items()
+        for stat, value in source.stats().items()
+    }
+
+
+RUNTIME_STATS = Gauge("bot_runtime", "Cache, limiter and queue counters", ["component", "stat"], _collect_stats)
@@ -0,0 +1,72 @@
+"""initial schema: users, orders, states
+
+Revision ID: 0001_initial
+Revises:
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001_initial"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# значения OrderStatus на момент первой схемы
+ORDER_STATUS = sa.Enum("DRAFT", "INVOICED", "PAID", "SUBMITTED", "FAILED", name="orderstatus")
+
+
+def upgrade() -> None:
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("telegram_user_id", sa.Integer(), nullable=False),
+        sa.Column("username", sa.String(64), nullable=True),
+        sa.Column("first_name", sa.String(128), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+    )
+    op.create_index("ix_users_telegram_user_id", "users", ["telegram_user_id"], unique=True)
+
+    op.create_table(
+        "orders",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("chat_id", sa.Integer(), nullable=False),
+        sa.Column("function", sa.String(32), nullable=True),
+        sa.Column("mode", sa.String(32), nullable=True),
+        sa.Column("instrumental", sa.Boolean(), nullable=True),
+        sa.Column("style", sa.String(1000), nullable=True),
+        sa.Column("prompt", sa.Text(), nullable=True),
+        sa.Column("model", sa.String(32), nullable=False),
+        sa.Column("price_stars", sa.Integer(), nullable=False),
+        sa.Column("currency", sa.String(8), nullable=False),
+        sa.Column("status", ORDER_STATUS, nullable=False),
+        sa.Column("invoice_payload", sa.String(128), nullable=True),
+        sa.Column("telegram_payment_charge_id", sa.String(128), nullable=True),
+        sa.Column("task_id", sa.String(128), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("paid_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_orders_user_id", "orders", ["user_id"])
+
+    op.create_table(
+        "states",
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("function", sa.String(32), nullable=True),
+        sa.Column("mode", sa.String(32), nullable=True),
+        sa.Column("instrumental", sa.Boolean(), nullable=True),
+        sa.Column("style", sa.String(1000), nullable=True),
+        sa.Column("prompt", sa.Text(), nullable=True),
+        sa.Column("step", sa.String(32), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("states")
+    op.drop_index("ix_orders_user_id", table_name="orders")
+    op.drop_table("orders")
+    op.drop_index("ix_users_telegram_user_id", table_name="users")
+    op.drop_table("users")
+    ORDER_STATUS.drop(op.get_bind(), checkfirst=True)
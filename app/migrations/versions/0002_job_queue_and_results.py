@@ -0,0 +1,44 @@
+"""generation job queue columns, stored task result, new order statuses
+
+Revision ID: 0002_job_queue_and_results
+Revises: 0001_initial
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002_job_queue_and_results"
+down_revision = "0001_initial"
+branch_labels = None
+depends_on = None
+
+NEW_COLUMNS = [
+    sa.Column("attempts", sa.Integer(), nullable=False, server_default="0"),
+    sa.Column("next_attempt_at", sa.DateTime(), nullable=True),
+    sa.Column("locked_at", sa.DateTime(), nullable=True),
+    sa.Column("last_error", sa.Text(), nullable=True),
+    sa.Column("result", sa.Text(), nullable=True),
+]
+NEW_STATUSES = ("PROCESSING", "COMPLETED", "DEAD")
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name == "postgresql":
+        # PG 12+: ADD VALUE можно в транзакции, пока новое значение в ней не используется
+        for value in NEW_STATUSES:
+            op.execute(f"ALTER TYPE orderstatus ADD VALUE IF NOT EXISTS '{value}'")
+
+    # базы, созданные через create_all до миграций, уже могут иметь эти колонки
+    existing = {c["name"] for c in sa.inspect(bind).get_columns("orders")}
+    with op.batch_alter_table("orders") as batch:
+        for column in NEW_COLUMNS:
+            if column.name not in existing:
+                batch.add_column(column.copy())
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("orders") as batch:
+        for column in reversed(NEW_COLUMNS):
+            batch.drop_column(column.name)
@@ -0,0 +1,31 @@
+"""hot-path indexes on orders
+
+Revision ID: 0003_order_indexes
+Revises: 0002_job_queue_and_results
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+
+
+revision = "0003_order_indexes"
+down_revision = "0002_job_queue_and_results"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index("ix_orders_task_id", "orders", ["task_id"])
+    op.create_index("ix_orders_invoice_payload", "orders", ["invoice_payload"])
+    op.create_index("ix_orders_status_created_at", "orders", ["status", "created_at"])
+    op.create_index("ix_orders_status_next_attempt_at", "orders", ["status", "next_attempt_at"])
+    op.create_index(
+        "uq_orders_telegram_payment_charge_id", "orders", ["telegram_payment_charge_id"], unique=True,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("uq_orders_telegram_payment_charge_id", table_name="orders")
+    op.drop_index("ix_orders_status_next_attempt_at", table_name="orders")
+    op.drop_index("ix_orders_status_created_at", table_name="orders")
+    op.drop_index("ix_orders_invoice_payload", table_name="orders")
+    op.drop_index("ix_orders_task_id", table_name="orders")
@@ -0,0 +1,27 @@
+"""idempotency table for successful payments
+
+Revision ID: 0004_processed_payments
+Revises: 0003_order_indexes
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0004_processed_payments"
+down_revision = "0003_order_indexes"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "processed_payments",
+        sa.Column("telegram_payment_charge_id", sa.String(128), primary_key=True),
+        sa.Column("order_id", sa.Integer(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("processed_payments")
@@ -0,0 +1,32 @@
+"""batch orders: parent/child link and submit counter
+
+Revision ID: 0005_batch_orders
+Revises: 0004_processed_payments
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0005_batch_orders"
+down_revision = "0004_processed_payments"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("orders") as batch:
+        batch.add_column(sa.Column("parent_id", sa.Integer(), nullable=True))
+        batch.add_column(sa.Column("batch_size", sa.Integer(), nullable=False, server_default="1"))
+        batch.add_column(sa.Column("batch_submitted", sa.Integer(), nullable=False, server_default="0"))
+        batch.create_foreign_key("fk_orders_parent_id_orders", "orders", ["parent_id"], ["id"])
+        batch.create_index("ix_orders_parent_id", ["parent_id"])
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("orders") as batch:
+        batch.drop_index("ix_orders_parent_id")
+        batch.drop_constraint("fk_orders_parent_id_orders", type_="foreignkey")
+        batch.drop_column("batch_submitted")
+        batch.drop_column("batch_size")
+        batch.drop_column("parent_id")
@@ -0,0 +1,24 @@
+"""orders.audio_file_ids: cached Telegram file_id of delivered tracks
+
+Revision ID: 0006_audio_file_ids
+Revises: 0005_batch_orders
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0006_audio_file_ids"
+down_revision = "0005_batch_orders"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("orders") as batch:
+        batch.add_column(sa.Column("audio_file_ids", sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("orders") as batch:
+        batch.drop_column("audio_file_ids")
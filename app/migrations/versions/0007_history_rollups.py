@@ -0,0 +1,102 @@
+"""history keyset index and daily rollups for reporting
+
+Revision ID: 0007_history_rollups
+Revises: 0006_audio_file_ids
+Create Date: 2026-10-17 00:00:00
+
+Старые заказы переносятся в daily_rollups приблизительно: терминальные статусы
+и возвраты считаются по дню создания заказа (момент перехода не хранился),
+латентность отправки для них неизвестна.
+"""
+from collections import Counter
+from datetime import date
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0007_history_rollups"
+down_revision = "0006_audio_file_ids"
+branch_labels = None
+depends_on = None
+
+orders = sa.table(
+    "orders",
+    sa.column("status", sa.String),
+    sa.column("created_at", sa.DateTime),
+    sa.column("paid_at", sa.DateTime),
+    sa.column("parent_id", sa.Integer),
+    sa.column("batch_size", sa.Integer),
+    sa.column("price_stars", sa.Integer),
+)
+
+
+def _day(value) -> date:
+    # sqlite отдаёт date() строкой, postgres — датой
+    return date.fromisoformat(str(value)[:10])
+
+
+def _backfill() -> None:
+    bind = op.get_bind()
+    totals: Counter = Counter()
+    created = sa.func.date(orders.c.created_at)
+    paid = sa.func.date(orders.c.paid_at)
+    track = orders.c.batch_size <= 1
+
+    rows = bind.execute(
+        sa.select(created, orders.c.status, sa.func.count()).where(track).group_by(created, orders.c.status)
+    )
+    for day, status, n in rows:
+        totals[(_day(day), "status:DRAFT")] += n
+        if status in ("SUBMITTED", "COMPLETED", "FAILED", "DEAD"):
+            totals[(_day(day), f"status:{status}")] += n
+
+    rows = bind.execute(
+        sa.select(paid, sa.func.count()).where(track, orders.c.paid_at.is_not(None)).group_by(paid)
+    )
+    for day, n in rows:
+        totals[(_day(day), "status:PAID")] += n
+
+    rows = bind.execute(
+        sa.select(paid, sa.func.count(), sa.func.sum(orders.c.price_stars))
+        .where(orders.c.parent_id.is_(None), orders.c.paid_at.is_not(None))
+        .group_by(paid)
+    )
+    for day, n, stars in rows:
+        totals[(_day(day), "payments")] += n
+        totals[(_day(day), "stars_paid")] += stars or 0
+
+    rows = bind.execute(
+        sa.select(created, sa.func.count(), sa.func.sum(orders.c.price_stars))
+        .where(orders.c.parent_id.is_(None), orders.c.status == "DEAD")
+        .group_by(created)
+    )
+    for day, n, stars in rows:
+        totals[(_day(day), "refunds")] += n
+        totals[(_day(day), "stars_refunded")] += stars or 0
+
+    if totals:
+        op.bulk_insert(
+            sa.table("daily_rollups", sa.column("day", sa.Date), sa.column("metric", sa.String),
+                     sa.column("value", sa.Integer)),
+            [{"day": day, "metric": metric, "value": value} for (day, metric), value in totals.items()],
+        )
+
+
+def upgrade() -> None:
+    op.create_table(
+        "daily_rollups",
+        sa.Column("day", sa.Date(), primary_key=True),
+        sa.Column("metric", sa.String(64), primary_key=True),
+        sa.Column("value", sa.Integer(), nullable=False, server_default="0"),
+    )
+    # (user_id, id) покрывает и выборки по одному user_id
+    op.create_index("ix_orders_user_id_id", "orders", ["user_id", "id"])
+    op.drop_index("ix_orders_user_id", table_name="orders")
+    _backfill()
+
+
+def downgrade() -> None:
+    op.create_index("ix_orders_user_id", "orders", ["user_id"])
+    op.drop_index("ix_orders_user_id_id", table_name="orders")
+    op.drop_table("daily_rollups")
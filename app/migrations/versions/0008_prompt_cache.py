@@ -0,0 +1,35 @@
+"""prompt cache for reusing results of identical requests
+
+Revision ID: 0008_prompt_cache
+Revises: 0007_history_rollups
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0008_prompt_cache"
+down_revision = "0007_history_rollups"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "prompt_cache",
+        sa.Column("key", sa.String(64), primary_key=True),
+        sa.Column("order_id", sa.Integer(), nullable=False),
+        sa.Column("task_id", sa.String(128), nullable=False),
+        sa.Column("ready", sa.Boolean(), nullable=False),
+        sa.Column("hits", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("last_used_at", sa.DateTime(), nullable=False),
+    )
+    op.create_index("ix_prompt_cache_order_id", "prompt_cache", ["order_id"])
+    op.create_index("ix_prompt_cache_last_used_at", "prompt_cache", ["last_used_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_prompt_cache_last_used_at", table_name="prompt_cache")
+    op.drop_index("ix_prompt_cache_order_id", table_name="prompt_cache")
+    op.drop_table("prompt_cache")
@@ -0,0 +1,32 @@
+"""archive table for terminal orders moved out by maintenance
+
+Revision ID: 0009_orders_archive
+Revises: 0008_prompt_cache
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0009_orders_archive"
+down_revision = "0008_prompt_cache"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "orders_archive",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("status", sa.String(16), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("archived_at", sa.DateTime(), nullable=False),
+        sa.Column("data", sa.LargeBinary(), nullable=False),
+    )
+    op.create_index("ix_orders_archive_user_id", "orders_archive", ["user_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_orders_archive_user_id", table_name="orders_archive")
+    op.drop_table("orders_archive")
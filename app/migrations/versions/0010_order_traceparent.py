@@ -0,0 +1,24 @@
+"""orders.traceparent: trace of the payment update, continued by the generation worker
+
+Revision ID: 0010_order_traceparent
+Revises: 0009_orders_archive
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0010_order_traceparent"
+down_revision = "0009_orders_archive"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("orders") as batch:
+        batch.add_column(sa.Column("traceparent", sa.String(length=55), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("orders") as batch:
+        batch.drop_column("traceparent")
@@ -0,0 +1,34 @@
+"""orders.status: widen non-native enum column to fit PROCESSING
+
+Revision ID: 0011_order_status_width
+Revises: 0010_order_traceparent
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0011_order_status_width"
+down_revision = "0010_order_traceparent"
+branch_labels = None
+depends_on = None
+
+OLD_STATUS = sa.Enum("DRAFT", "INVOICED", "PAID", "SUBMITTED", "FAILED", name="orderstatus")
+ORDER_STATUS = sa.Enum(
+    "DRAFT", "INVOICED", "PAID", "PROCESSING", "SUBMITTED", "COMPLETED", "FAILED", "DEAD", name="orderstatus",
+)
+
+
+def upgrade() -> None:
+    # на Postgres orderstatus — нативный тип, значения добавила 0002; без него колонка — VARCHAR(9)
+    if op.get_bind().dialect.name == "postgresql":
+        return
+    with op.batch_alter_table("orders") as batch:
+        batch.alter_column("status", existing_type=OLD_STATUS, type_=ORDER_STATUS, existing_nullable=False)
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        return
+    with op.batch_alter_table("orders") as batch:
+        batch.alter_column("status", existing_type=ORDER_STATUS, type_=OLD_STATUS, existing_nullable=False)
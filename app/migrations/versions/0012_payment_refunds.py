@@ -0,0 +1,32 @@
+"""processed_payments: refund state, so failed refunds are retried by recovery
+
+Revision ID: 0012_payment_refunds
+Revises: 0011_order_status_width
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0012_payment_refunds"
+down_revision = "0011_order_status_width"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("processed_payments") as batch:
+        batch.add_column(sa.Column("telegram_user_id", sa.Integer(), nullable=True))
+        batch.add_column(sa.Column("amount", sa.Integer(), nullable=True))
+        batch.add_column(sa.Column("refund_due_at", sa.DateTime(), nullable=True))
+        batch.add_column(sa.Column("refunded_at", sa.DateTime(), nullable=True))
+    op.create_index("ix_processed_payments_refund_due_at", "processed_payments", ["refund_due_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_processed_payments_refund_due_at", table_name="processed_payments")
+    with op.batch_alter_table("processed_payments") as batch:
+        batch.drop_column("refunded_at")
+        batch.drop_column("refund_due_at")
+        batch.drop_column("amount")
+        batch.drop_column("telegram_user_id")
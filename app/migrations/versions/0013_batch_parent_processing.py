@@ -0,0 +1,28 @@
+"""batch parents stay PROCESSING until their last track finishes
+
+Revision ID: 0013_batch_parent_processing
+Revises: 0012_payment_refunds
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+
+
+revision = "0013_batch_parent_processing"
+down_revision = "0012_payment_refunds"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # раньше пакет становился COMPLETED сразу после оплаты: незавершённые возвращаем в работу,
+    # итог по ним подведёт settle_batch, когда завершится последний трек
+    op.execute(
+        "UPDATE orders SET status = 'PROCESSING' "
+        "WHERE batch_size > 1 AND status = 'COMPLETED' AND EXISTS ("
+        "SELECT 1 FROM orders AS child WHERE child.parent_id = orders.id "
+        "AND child.status NOT IN ('COMPLETED', 'FAILED', 'DEAD'))"
+    )
+
+
+def downgrade() -> None:
+    op.execute("UPDATE orders SET status = 'COMPLETED' WHERE batch_size > 1 AND status = 'PROCESSING'")
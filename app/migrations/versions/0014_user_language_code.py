@@ -0,0 +1,24 @@
+"""users.language_code: language of background messages (delivery, refunds)
+
+Revision ID: 0014_user_language_code
+Revises: 0013_batch_parent_processing
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0014_user_language_code"
+down_revision = "0013_batch_parent_processing"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("users") as batch:
+        batch.add_column(sa.Column("language_code", sa.String(16), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("users") as batch:
+        batch.drop_column("language_code")
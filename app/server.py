@@ -0,0 +1,156 @@
+import os
+import hmac
+import logging
+from typing import Callable
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from dotenv import load_dotenv
+
+import metrics
+from api.client import BOT_SERVICE_TOKEN
+from tracing import span
+from workers.delivery import handle_task_result
+
+load_dotenv()
+log = logging.getLogger("aiogram-stars-bot.server")
+
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("WEB_PORT", "8080"))
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None
+WEBHOOK_SET_ON_STARTUP = os.getenv("WEBHOOK_SET_ON_STARTUP", "1") == "1"
+# в режиме polling поднимать HTTP-сервер для /metrics и прочих служебных ручек
+HTTP_SERVER = os.getenv("HTTP_SERVER", "1") == "1"
+# публичный адрес этого процесса для колбэков /music/generate (по умолчанию — адрес вебхука)
+CALLBACK_BASE_URL = os.getenv("CALLBACK_BASE_URL", WEBHOOK_BASE_URL).rstrip("/")
+CALLBACK_PATH = os.getenv("CALLBACK_PATH", "/music/callback")
+
+
+def callback_url() -> str | None:
+    # без токена ручку не открываем: колбэк меняет статусы заказов
+    if not CALLBACK_BASE_URL or not BOT_SERVICE_TOKEN:
+        return None
+    return f"{CALLBACK_BASE_URL}{CALLBACK_PATH}"
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+
+async def health_handler(request: web.Request) -> web.Response:
+    # жив ли процесс и его event loop; о готовности принимать апдейты говорит /readyz
+    return web.json_response({"ok": True})
+
+
+async def ready_handler(request: web.Request) -> web.Response:
+    ready = request.app["ready"]()
+    return web.json_response({"ready": ready}, status=200 if ready else 503)
+
+
+def _authorized(request: web.Request) -> bool:
+    token = request.headers.get("X-Bot-Token")
+    if token is None:
+        auth = request.headers.get("Authorization", "")
+        if auth.startswith("Bearer "):
+            token = auth[len("Bearer "):]
+    return token is not None and hmac.compare_digest(token.encode(), BOT_SERVICE_TOKEN.encode())
+
+
+def _callback_task_id(body: dict) -> str | None:
+    task_id = body.get("taskId") or body.get("task_id")
+    if not task_id:
+        data = (body.get("raw") or {}).get("data") or {}
+        task_id = data.get("taskId") or data.get("task_id")
+    return str(task_id) if task_id else None
+
+
+async def callback_handler(request: web.Request) -> web.Response:
+    """Колбэк бэкенда о завершении задачи: тело в формате ответа /music/status."""
+    if not _authorized(request):
+        raise web.HTTPUnauthorized()
+    try:
+        body = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text="invalid json")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text="object expected")
+
+    task_id = _callback_task_id(body)
+    if task_id is None:
+        raise web.HTTPBadRequest(text="taskId is required")
+
+    # если бэкенд возвращает traceparent из /music/generate, колбэк попадает в трассу заказа
+    with span("backend.callback", parent=request.headers.get("traceparent"), root=True, task_id=task_id):
+        delivered = await handle_task_result(request.app["bot"], task_id, body)
+    if delivered is None:
+        # заказ ещё не сохранил task_id — результат в кэше, доставит поллер
+        log.warning("callback for unknown task %s", task_id)
+        return web.json_response({"ok": True, "accepted": True}, status=202)
+    return web.json_response({"ok": True, "delivered": delivered})
+
+
+def build_web_app(bot: Bot | None = None, ready: Callable[[], bool] | None = None) -> web.Application:
+    app = web.Application()
+    app["ready"] = ready or (lambda: True)
+    app.router.add_get("/metrics", metrics_handler)
+    app.router.add_get("/healthz", health_handler)
+    app.router.add_get("/readyz", ready_handler)
+    if bot is not None and callback_url():
+        app["bot"] = bot
+        app.router.add_post(CALLBACK_PATH, callback_handler)
+    return app
+
+
+async def start_web_server(app: web.Application) -> web.AppRunner:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEB_HOST, WEB_PORT).start()
+    log.info("http server listening on %s:%s", WEB_HOST, WEB_PORT)
+    return runner
+
+
+async def _set_webhook(bot: Bot, dispatcher: Dispatcher) -> None:
+    if not WEBHOOK_SET_ON_STARTUP:
+        return
+    if not WEBHOOK_BASE_URL:
+        raise RuntimeError("WEBHOOK_BASE_URL is required for RUN_MODE=webhook")
+    # setWebhook идемпотентен, поэтому несколько реплик могут вызывать его одновременно
+    await bot.set_webhook(
+        url=f"{WEBHOOK_BASE_URL}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dispatcher.resolve_used_update_types(),
+    )
+    log.info("webhook set to %s%s", WEBHOOK_BASE_URL, WEBHOOK_PATH)
+
+
+def accepting_gate(accepting: Callable[[], bool]):
+    """Пока процесс стартует или останавливается, вебхук отвечает 503 — Telegram повторит доставку позже."""
+
+    @web.middleware
+    async def gate(request: web.Request, handler):
+        if request.path == WEBHOOK_PATH and not accepting():
+            raise web.HTTPServiceUnavailable(headers={"Retry-After": "5"})
+        return await handler(request)
+
+    return gate
+
+
+def run_webhook(dispatcher: Dispatcher, bot: Bot, accepting: Callable[[], bool] | None = None) -> None:
+    dispatcher.startup.register(_set_webhook)
+
+    app = build_web_app(bot, accepting)
+    if accepting is not None:
+        app.middlewares.append(accepting_gate(accepting))
+    # порядок важен: сначала shutdown диспетчера (дренаж апдейтов), потом закрытие сессии бота
+    setup_application(app, dispatcher, bot=bot)
+    SimpleRequestHandler(
+        dispatcher=dispatcher,
+        bot=bot,
+        secret_token=WEBHOOK_SECRET,
+        handle_in_background=True,
+    ).register(app, path=WEBHOOK_PATH)
+
+    web.run_app(app, host=WEB_HOST, port=WEB_PORT, print=None)
@@ -0,0 +1,111 @@
+import os
+import sys
+import time
+import logging
+from collections import defaultdict
+from importlib.abc import MetaPathFinder
+
+from dotenv import load_dotenv
+
+load_dotenv()
+log = logging.getLogger("aiogram-stars-bot.startup")
+
+# подробный профиль импортов (перехват загрузки каждого модуля); время шагов старта пишется всегда
+STARTUP_PROFILE = os.getenv("STARTUP_PROFILE", "0") == "1"
+STARTUP_PROFILE_TOP = int(os.getenv("STARTUP_PROFILE_TOP", "15"))
+
+
+class _TimedLoader:
+    """Обёртка загрузчика на время exec_module; после загрузки модулю возвращается настоящий загрузчик."""
+
+    def __init__(self, loader, timer: "_ImportTimer"):
+        self.loader = loader
+        self.timer = timer
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module) -> None:
+        self.timer.enter()
+        try:
+            self.loader.exec_module(module)
+        finally:
+            self.timer.exit(module.__name__)
+            module.__loader__ = self.loader
+            if module.__spec__ is not None:
+                module.__spec__.loader = self.loader
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+
+class _ImportTimer(MetaPathFinder):
+    """Собственное время загрузки каждого модуля — как `python -X importtime`, но внутри процесса."""
+
+    def __init__(self):
+        # [начало, время вложенных импортов]
+        self._stack: list[list[float]] = []
+        self.self_time: dict[str, float] = {}
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            spec.loader = _TimedLoader(spec.loader, self)
+        return spec
+
+    def enter(self) -> None:
+        self._stack.append([time.perf_counter(), 0.0])
+
+    def exit(self, name: str) -> None:
+        started, nested = self._stack.pop()
+        total = time.perf_counter() - started
+        self.self_time[name] = total - nested
+        if self._stack:
+            self._stack[-1][1] += total
+
+
+class StartupProfile:
+    """Профиль холодного старта: импорты, шаги on_startup, время до готовности."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: dict[str, float] = {}
+        self._timer: _ImportTimer | None = None
+        if STARTUP_PROFILE:
+            self._timer = _ImportTimer()
+            sys.meta_path.insert(0, self._timer)
+
+    def imports_done(self) -> None:
+        self.phases["imports"] = time.perf_counter() - self.started
+        if self._timer is not None:
+            sys.meta_path.remove(self._timer)
+
+    def ready(self, steps: dict[str, float] | None = None) -> None:
+        self.phases.update(steps or {})
+        self.phases["ready"] = time.perf_counter() - self.started
+        log.info("startup profile: %s", self.report())
+
+    def report(self) -> str:
+        lines = [", ".join(f"{name} {seconds:.3f}s" for name, seconds in self.phases.items())]
+        if self._timer is not None:
+            packages: dict[str, float] = defaultdict(float)
+            for name, seconds in self._timer.self_time.items():
+                packages[name.split(".", 1)[0]] += seconds
+            top = sorted(packages.items(), key=lambda kv: kv[1], reverse=True)[:STARTUP_PROFILE_TOP]
+            lines.append("imports by package: " + ", ".join(f"{name} {s:.3f}s" for name, s in top))
+            top = sorted(self._timer.self_time.items(), key=lambda kv: kv[1], reverse=True)[:STARTUP_PROFILE_TOP]
+            lines.append("slowest modules: " + ", ".join(f"{name} {s:.3f}s" for name, s in top))
+        return "\n".join(lines)
+
+    def stats(self) -> dict:
+        return dict(self.phases)
+
+
+profile = StartupProfile()
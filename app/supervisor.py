@@ -0,0 +1,243 @@
+import os
+import queue
+import signal
+import asyncio
+import logging
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+load_dotenv()
+log = logging.getLogger("aiogram-stars-bot.supervisor")
+
+SHARD_QUEUE_SIZE = int(os.getenv("SHARD_QUEUE_SIZE", "1000"))
+SHARD_READY_TIMEOUT = float(os.getenv("SHARD_READY_TIMEOUT", "60"))
+POLLING_TIMEOUT = int(os.getenv("POLLING_TIMEOUT", "30"))
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "25"))
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "15"))
+
+
+def update_user_id(update: dict) -> int | None:
+    # у всех пользовательских событий отправитель лежит в поле "from" вложенного объекта
+    for value in update.values():
+        if isinstance(value, dict):
+            user = value.get("from")
+            if isinstance(user, dict) and "id" in user:
+                return int(user["id"])
+    return None
+
+
+def shard_of(user_id: int | None, workers: int) -> int:
+    # события без отправителя — в нулевой шард
+    if user_id is None:
+        return 0
+    return user_id % workers
+
+
+# --- дочерний процесс ---
+
+def _shard_main(index: int, workers: int, inbox: mp.Queue, ready: mp.Queue) -> None:
+    # останавливается по сигналу супервизора (None в очереди), а не по Ctrl+C группы процессов
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    os.environ["SHARD_INDEX"] = str(index)
+    os.environ["WORKERS"] = str(workers)
+    from logs import setup_logging
+
+    setup_logging()
+    asyncio.run(_serve_shard(index, inbox, ready))
+
+
+async def _serve_shard(index: int, inbox: mp.Queue, ready: mp.Queue) -> None:
+    import main as app
+    from aiogram.types import Update
+
+    loop = asyncio.get_running_loop()
+    reader = ThreadPoolExecutor(1, thread_name_prefix=f"shard-{index}-inbox")
+    # последняя задача каждого пользователя: следующий апдейт ждёт предыдущий,
+    # поэтому шаги мастера одного пользователя не обгоняют друг друга
+    tails: dict[int | None, asyncio.Task] = {}
+    parent = mp.parent_process()
+
+    def receive():
+        while True:
+            try:
+                return inbox.get(timeout=1.0)
+            except queue.Empty:
+                # супервизор убит без штатной остановки — не остаёмся сиротой
+                if parent is not None and not parent.is_alive():
+                    return None
+
+    async def handle(update: Update, previous: asyncio.Task | None) -> None:
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await app.dp.feed_update(app.bot, update)
+        except Exception:
+            log.exception("update %s failed in shard %s", update.update_id, index)
+
+    def release(user_id: int | None, task: asyncio.Task) -> None:
+        if tails.get(user_id) is task:
+            del tails[user_id]
+
+    await app.on_startup(app.dp)
+    ready.put(index)
+    try:
+        while True:
+            item = await loop.run_in_executor(reader, receive)
+            if item is None:
+                break
+            user_id, data = item
+            update = Update.model_validate(data, context={"bot": app.bot})
+            task = asyncio.create_task(handle(update, tails.get(user_id)))
+            tails[user_id] = task
+            task.add_done_callback(lambda t, u=user_id: release(u, t))
+        if tails:
+            await asyncio.wait(list(tails.values()), timeout=DRAIN_TIMEOUT)
+    finally:
+        await app.on_shutdown(app.dp)
+        await app.bot.session.close()
+        reader.shutdown(wait=False)
+
+
+# --- супервизор ---
+
+class Supervisor:
+    """Запускает WORKERS процессов-шардов и раздаёт им апдейты из long polling.
+
+    Апдейт уходит в шард по from_user.id, так что все события пользователя
+    обрабатывает один процесс в порядке поступления. Состояние шарды делят
+    через БД/внешнее хранилище; фоновые задачи (поллер статусов, HTTP-сервер)
+    работают только в нулевом шарде, пул генерации — во всех.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._ctx = mp.get_context("spawn")
+        self._ready = self._ctx.Queue()
+        self._inboxes = [self._ctx.Queue(SHARD_QUEUE_SIZE) for _ in range(workers)]
+        self._procs: list[mp.Process | None] = [None] * workers
+        self._stopping = asyncio.Event()
+        self.routed = [0] * workers
+
+    def _spawn(self, index: int) -> None:
+        proc = self._ctx.Process(
+            target=_shard_main,
+            args=(index, self.workers, self._inboxes[index], self._ready),
+            name=f"bot-shard-{index}",
+        )
+        proc.start()
+        self._procs[index] = proc
+        log.info("shard %s started, pid %s", index, proc.pid)
+
+    async def _wait_ready(self) -> bool:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + SHARD_READY_TIMEOUT
+        pending = self.workers
+        while pending and not self._stopping.is_set():
+            if loop.time() > deadline:
+                raise RuntimeError(f"{pending} shard(s) did not start in {SHARD_READY_TIMEOUT}s")
+            try:
+                # короткий таймаут, чтобы SIGTERM во время старта не ждал SHARD_READY_TIMEOUT
+                await loop.run_in_executor(None, self._ready.get, True, 0.5)
+                pending -= 1
+            except queue.Empty:
+                pass
+        return not pending
+
+    async def _route(self, update: dict) -> None:
+        user_id = update_user_id(update)
+        index = shard_of(user_id, self.workers)
+        inbox = self._inboxes[index]
+        while True:
+            try:
+                inbox.put_nowait((user_id, update))
+                break
+            except queue.Full:
+                # шард не успевает — притормаживаем чтение getUpdates
+                await asyncio.sleep(0.05)
+        self.routed[index] += 1
+
+    async def _watch(self) -> None:
+        # упавший шард перезапускаем с той же очередью: апдейты в ней не теряются
+        while not self._stopping.is_set():
+            for index, proc in enumerate(self._procs):
+                if proc is not None and not proc.is_alive():
+                    log.error("shard %s exited with code %s, restarting", index, proc.exitcode)
+                    self._spawn(index)
+            try:
+                await asyncio.wait_for(self._stopping.wait(), 1.0)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll(self) -> None:
+        import main as app
+        from aiogram.methods import GetUpdates
+
+        bot = app.bot
+        allowed = app.dp.resolve_used_update_types()
+        offset = None
+        try:
+            while not self._stopping.is_set():
+                try:
+                    updates = await bot(GetUpdates(offset=offset, timeout=POLLING_TIMEOUT, allowed_updates=allowed))
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    log.warning("getUpdates failed: %s", e)
+                    await asyncio.sleep(1)
+                    continue
+                for update in updates:
+                    await self._route(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+                    offset = update.update_id + 1
+        finally:
+            # Telegram считает апдейты полученными только по offset следующего getUpdates:
+            # без этого после рестарта уже разосланные по шардам апдейты придут ещё раз
+            if offset is not None:
+                try:
+                    await bot(GetUpdates(offset=offset, limit=1, timeout=0, allowed_updates=allowed))
+                except Exception as e:
+                    log.warning("could not confirm updates before %s: %s", offset, e)
+            await bot.session.close()
+
+    async def run(self) -> None:
+        from db.db import init_db, engine
+
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self._stopping.set)
+
+        # миграции — один раз до запуска шардов, чтобы они не гонялись за alembic_version
+        await init_db()
+        await engine.dispose()
+
+        for index in range(self.workers):
+            self._spawn(index)
+        try:
+            if await self._wait_ready():
+                log.info("all %s shards are ready", self.workers)
+                watcher = asyncio.create_task(self._watch())
+                poller = asyncio.create_task(self._poll())
+                await self._stopping.wait()
+                poller.cancel()
+                await asyncio.gather(poller, watcher, return_exceptions=True)
+        finally:
+            await self._shutdown()
+
+    async def _shutdown(self) -> None:
+        loop = asyncio.get_running_loop()
+        for inbox in self._inboxes:
+            inbox.put(None)
+        for index, proc in enumerate(self._procs):
+            if proc is None:
+                continue
+            await loop.run_in_executor(None, proc.join, DRAIN_TIMEOUT + SHUTDOWN_TIMEOUT + 10)
+            if proc.is_alive():
+                log.warning("shard %s did not stop in time, terminating", index)
+                proc.terminate()
+        log.info("routed updates per shard: %s", self.routed)
+
+
+def run_supervisor(workers: int) -> None:
+    asyncio.run(Supervisor(workers).run())
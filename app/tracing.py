@@ -0,0 +1,253 @@
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import logging
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterator
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from dotenv import load_dotenv
+
+load_dotenv()
+log = logging.getLogger("aiogram-stars-bot.tracing")
+
+# решение о записи трассы принимается в корневом span и наследуется дочерними
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+# JSONL, один span в формате OTLP JSON на строку
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+# OTLP/HTTP JSON, например http://otel-collector:4318/v1/traces
+TRACE_OTLP_URL = os.getenv("TRACE_OTLP_URL", "")
+TRACE_SERVICE = os.getenv("TRACE_SERVICE", "aiogram-stars-bot")
+TRACE_BUFFER = int(os.getenv("TRACE_BUFFER", "10000"))
+TRACE_FLUSH_INTERVAL = float(os.getenv("TRACE_FLUSH_INTERVAL", "2"))
+
+TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+STATUS_OK, STATUS_ERROR = 1, 2
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "sampled", "start", "end", "attributes", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: str | None, sampled: bool, attributes: dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.start = time.time_ns()
+        self.end = 0
+        self.attributes = attributes
+        self.error: str | None = None
+
+    @property
+    def traceparent(self) -> str:
+        # W3C Trace Context: https://www.w3.org/TR/trace-context/
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def set(self, **attributes: Any) -> None:
+        if self.sampled:
+            self.attributes.update(attributes)
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(self.end),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items() if v is not None],
+            "status": {"code": STATUS_ERROR, "message": self.error} if self.error else {"code": STATUS_OK},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_attribute(key: str, value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+_current: ContextVar[Span | None] = ContextVar("span", default=None)
+
+
+def current_span() -> Span | None:
+    return _current.get()
+
+
+def annotate(**attributes: Any) -> None:
+    """Атрибуты текущему span, если он есть (order_id, task_id — для поиска трассы по заказу)."""
+    span = _current.get()
+    if span is not None:
+        span.set(**attributes)
+
+
+def parse_traceparent(value: str | None) -> tuple[str, str, bool] | None:
+    m = TRACEPARENT_RE.match(value or "")
+    if m is None or m.group(1) == "0" * 32:
+        return None
+    return m.group(1), m.group(2), m.group(3) == "01"
+
+
+@contextmanager
+def span(name: str, parent: str | None = None, root: bool = False, **attributes: Any) -> Iterator[Span]:
+    """Span вокруг блока кода; без parent продолжает текущую трассу, root=True — всегда новая.
+
+    parent — traceparent вызывающей стороны или сохранённый в заказе.
+    """
+    current = None if root else _current.get()
+    remote = parse_traceparent(parent) if parent else None
+    if remote is not None:
+        trace_id, parent_id, sampled = remote
+    elif current is not None:
+        trace_id, parent_id, sampled = current.trace_id, current.span_id, current.sampled
+    else:
+        trace_id, parent_id = f"{random.getrandbits(128):032x}", None
+        sampled = random.random() < TRACE_SAMPLE_RATE
+    s = Span(name, trace_id, parent_id, sampled, attributes)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current.reset(token)
+        if s.sampled:
+            s.end = time.time_ns()
+            exporter.add(s)
+
+
+def child_span(name: str, **attributes: Any):
+    """Span только внутри записываемой трассы: на горячем пути несэмплированный запрос ничего не платит."""
+    current = _current.get()
+    if current is None or not current.sampled:
+        return nullcontext()
+    return span(name, **attributes)
+
+
+@contextmanager
+def use_span(s: Span | None) -> Iterator[None]:
+    """Делает s текущим — для работы, выполняемой чужой задачей от имени вызывающего (очередь записи)."""
+    token = _current.set(s)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+class SpanExporter:
+    """Буфер завершённых span; раз в TRACE_FLUSH_INTERVAL дописывает их в TRACE_FILE и/или шлёт в OTLP."""
+
+    def __init__(self, path: str = TRACE_FILE, url: str = TRACE_OTLP_URL, maxsize: int = TRACE_BUFFER):
+        self.path = path
+        self.url = url
+        self.maxsize = maxsize
+        self._buffer: list[Span] = []
+        self._task: asyncio.Task | None = None
+        self._client = None
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path or self.url)
+
+    def add(self, s: Span) -> None:
+        if not self.enabled:
+            return
+        if len(self._buffer) >= self.maxsize:
+            self.dropped += 1
+            return
+        self._buffer.append(s)
+
+    def start(self) -> None:
+        if self._task is None and self.enabled:
+            self._task = asyncio.create_task(self._run(), name="trace-exporter")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(TRACE_FLUSH_INTERVAL)
+            await self.flush()
+
+    async def flush(self) -> None:
+        batch, self._buffer = self._buffer, []
+        if not batch:
+            return
+        spans = [s.to_otlp() for s in batch]
+        try:
+            if self.path:
+                await asyncio.to_thread(self._write, spans)
+            if self.url:
+                await self._post(spans)
+            self.exported += len(spans)
+        except Exception as e:
+            self.failed += len(spans)
+            log.warning("trace export of %s spans failed: %s", len(spans), e)
+
+    def _write(self, spans: list[dict]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(s, ensure_ascii=False) + "\n" for s in spans)
+
+    async def _post(self, spans: list[dict]) -> None:
+        import httpx
+
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=5)
+        body = {"resourceSpans": [{
+            "resource": {"attributes": [_otlp_attribute("service.name", TRACE_SERVICE)]},
+            "scopeSpans": [{"scope": {"name": TRACE_SERVICE}, "spans": spans}],
+        }]}
+        r = await self._client.post(self.url, json=body)
+        r.raise_for_status()
+
+    def stats(self) -> dict:
+        return {
+            "buffered": len(self._buffer),
+            "exported": self.exported,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+
+exporter = SpanExporter()
+
+
+class TracingMiddleware(BaseMiddleware):
+    """Корневой span на каждый апдейт Telegram; регистрируется первым outer-middleware dp.update."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        with span("telegram.update", root=True, update_id=event.update_id, update_type=event.event_type) as s:
+            user = data.get("event_from_user")
+            if user is not None:
+                s.set(telegram_user_id=user.id)
+            return await handler(event, data)
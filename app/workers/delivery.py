@@ -0,0 +1,228 @@
+import os
+import json
+import asyncio
+import logging
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message, URLInputFile
+from dotenv import load_dotenv
+
+from api.status import STATUS_TERMINAL_TTL, is_success, is_failed, is_terminal, status_cache
+from bot.messages import DEFAULT_TEXTS, Texts, render_status, result_tracks, texts_for
+from db.db import SessionLocal
+from db.models import Order
+from db.writer import run_write
+from db.dao import (
+    get_order_by_id, get_order_by_task_id, save_task_result, set_audio_file_ids, mark_completed, mark_failed,
+    prompt_ready, forget_prompt, request_order_refund, settle_batch, charge_id,
+)
+from workers.refunds import notify, refund_payment
+
+load_dotenv()
+log = logging.getLogger("aiogram-stars-bot.delivery")
+
+# загрузка готовых треков в Telegram (send_audio) вместо одних только ссылок
+AUDIO_DELIVERY = os.getenv("AUDIO_DELIVERY", "1") == "1"
+AUDIO_UPLOAD_WORKERS = int(os.getenv("AUDIO_UPLOAD_WORKERS", "4"))
+AUDIO_UPLOAD_QUEUE = int(os.getenv("AUDIO_UPLOAD_QUEUE", "1000"))
+AUDIO_UPLOAD_TIMEOUT = int(os.getenv("AUDIO_UPLOAD_TIMEOUT", "300"))
+AUDIO_CHUNK_SIZE = int(os.getenv("AUDIO_CHUNK_SIZE", str(64 * 1024)))
+
+
+class AudioDeliveryPool:
+    """Ограниченный пул загрузок треков в чат.
+
+    Аудио и обложка стримятся из URL результата чанками (URLInputFile), без
+    буферизации файла в памяти. Полученные file_id сохраняются в заказе —
+    повторная отправка того же трека идёт по file_id, без скачивания.
+    """
+
+    def __init__(self, size: int = AUDIO_UPLOAD_WORKERS, maxsize: int = AUDIO_UPLOAD_QUEUE):
+        self.size = size
+        self._queue: asyncio.Queue[tuple[Bot, int, int, dict, Texts]] = asyncio.Queue(maxsize)
+        self._tasks: list[asyncio.Task] = []
+        self.uploaded = 0
+        self.reused = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def start(self) -> None:
+        if self._tasks or not AUDIO_DELIVERY:
+            return
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"audio-upload-{i}")
+            for i in range(self.size)
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, bot: Bot, order_id: int, chat_id: int, result: dict, texts: Texts = DEFAULT_TEXTS) -> bool:
+        if not self._tasks or not result_tracks(result):
+            return False
+        try:
+            self._queue.put_nowait((bot, order_id, chat_id, result, texts))
+        except asyncio.QueueFull:
+            # ссылки на треки пользователь уже получил в тексте
+            self.dropped += 1
+            log.warning("audio upload queue is full, order %s sent as links only", order_id)
+            return False
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "uploaded": self.uploaded,
+            "reused": self.reused,
+            "failed": self.failed,
+            "dropped": self.dropped,
+        }
+
+    async def _worker(self) -> None:
+        while True:
+            bot, order_id, chat_id, result, texts = await self._queue.get()
+            try:
+                await self.send_tracks(bot, order_id, chat_id, result, texts)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("audio delivery failed for order %s", order_id)
+            finally:
+                self._queue.task_done()
+
+    async def send_tracks(
+        self, bot: Bot, order_id: int, chat_id: int, result: dict, texts: Texts = DEFAULT_TEXTS,
+    ) -> None:
+        async with SessionLocal() as session:
+            order = await get_order_by_id(session, order_id)
+        if order is None:
+            return
+        file_ids: list[str | None] = json.loads(order.audio_file_ids) if order.audio_file_ids else []
+        changed = False
+
+        for i, track in enumerate(result_tracks(result)):
+            if not track.get("audioUrl"):
+                continue
+            title = str(track.get("title") or texts.track_default_title(i + 1))
+            cached = file_ids[i] if i < len(file_ids) else None
+
+            if cached:
+                try:
+                    await bot.send_audio(chat_id=chat_id, audio=cached, title=title)
+                    self.reused += 1
+                    continue
+                except TelegramBadRequest as e:
+                    # file_id мог протухнуть — загружаем заново
+                    log.warning("cached file_id rejected for order %s: %s", order_id, e)
+
+            sent = await self._upload(bot, chat_id, track, title)
+            if sent is None or sent.audio is None:
+                continue
+            file_ids.extend([None] * (i + 1 - len(file_ids)))
+            file_ids[i] = sent.audio.file_id
+            changed = True
+
+        if changed:
+            value = json.dumps(file_ids)
+            await run_write(lambda session: set_audio_file_ids(session, order_id, value))
+
+    async def _upload(self, bot: Bot, chat_id: int, track: dict, title: str) -> Message | None:
+        audio = URLInputFile(
+            track["audioUrl"],
+            filename=f"{title}.mp3",
+            chunk_size=AUDIO_CHUNK_SIZE,
+            timeout=AUDIO_UPLOAD_TIMEOUT,
+        )
+        thumbnail = None
+        if track.get("imageUrl"):
+            thumbnail = URLInputFile(track["imageUrl"], filename="cover.jpg", chunk_size=AUDIO_CHUNK_SIZE)
+        try:
+            sent = await bot.send_audio(
+                chat_id=chat_id,
+                audio=audio,
+                title=title,
+                thumbnail=thumbnail,
+                request_timeout=AUDIO_UPLOAD_TIMEOUT,
+            )
+        except Exception as e:
+            self.failed += 1
+            log.warning("audio upload to chat %s failed: %s", chat_id, e)
+            return None
+        self.uploaded += 1
+        return sent
+
+
+audio_delivery = AudioDeliveryPool()
+
+
+async def deliver_result(
+    bot: Bot, order_id: int, chat_id: int, task_id: str, result: dict, texts: Texts = DEFAULT_TEXTS,
+) -> bool:
+    """Переводит заказ в COMPLETED/FAILED и отправляет результат в чат на языке пользователя (texts).
+
+    Сообщение уходит только если переход применили именно мы — поэтому поллер и
+    колбэк бэкенда могут гоняться за одним заказом без двойной доставки.
+    """
+    if is_terminal(result):
+        # результат мог прийти только в кэш (колбэк раньше task_id) — сохраняем его в заказ
+        value = json.dumps(result, ensure_ascii=False)
+        await run_write(lambda session: save_task_result(session, task_id, value))
+
+    if is_success(result):
+        async def _completed(session) -> bool:
+            if not await mark_completed(session, order_id):
+                return False
+            await prompt_ready(session, order_id)
+            order = await get_order_by_id(session, order_id)
+            if order.parent_id is not None:
+                await settle_batch(session, order.parent_id)
+            return True
+
+        if not await run_write(_completed):
+            return False
+        await notify(bot, chat_id, render_status(result, texts), disable_web_page_preview=True, parse_mode="HTML")
+        audio_delivery.submit(bot, order_id, chat_id, result, texts)
+        return True
+
+    if is_failed(result):
+        async def _failed(session) -> tuple[str, Order | None]:
+            if not await mark_failed(session, order_id):
+                return "taken", None
+            await forget_prompt(session, order_id)
+            # генерация оплачена, но результата нет — возвращаем Stars, как при dead-letter
+            order = await get_order_by_id(session, order_id, related=True)
+            return await request_order_refund(session, order), order
+
+        outcome, order = await run_write(_failed)
+        if outcome == "taken":
+            return False
+        await notify(bot, chat_id, texts.generation_failed(task_id))
+        # не прошедший возврат повторит recovery
+        if outcome == "refund" and await refund_payment(bot, charge_id(order), order.user.telegram_user_id):
+            await notify(bot, chat_id, texts.payment_refunded)
+        return True
+
+    return False
+
+
+async def handle_task_result(bot: Bot, task_id: str, result: dict) -> bool | None:
+    """Обрабатывает результат задачи, присланный бэкендом.
+
+    None — заказ с таким task_id пока не найден (колбэк обогнал mark_submitted),
+    результат остаётся в status_cache и его подберёт поллер.
+    """
+    if not is_terminal(result):
+        status_cache.set(task_id, result)
+        return False
+
+    status_cache.set(task_id, result, ttl=STATUS_TERMINAL_TTL)
+    async with SessionLocal() as session:
+        order = await get_order_by_task_id(session, task_id, related=True)
+    if order is None:
+        return None
+
+    return await deliver_result(bot, order.id, order.chat_id, task_id, result, texts_for(order.user.language_code))
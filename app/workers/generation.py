@@ -0,0 +1,261 @@
+import os
+import re
+import random
+import hashlib
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+import httpx
+from aiogram import Bot
+from dotenv import load_dotenv
+
+from api.breaker import BackendUnavailable
+from api.client import api_generate
+from db.writer import run_write
+from db.dao import (
+    claim_jobs, mark_submitted, retry_job, mark_dead, batch_child_submitted, request_order_refund,
+    remember_prompt, charge_id,
+)
+from db.models import Order, OrderStatus
+from bot.messages import texts_for
+from server import callback_url
+from workers.refunds import notify, refund_payment
+from tracing import span
+
+load_dotenv()
+log = logging.getLogger("aiogram-stars-bot.generation")
+
+GENERATION_WORKERS = int(os.getenv("GENERATION_WORKERS", "4"))
+GENERATION_MAX_ATTEMPTS = int(os.getenv("GENERATION_MAX_ATTEMPTS", "5"))
+GENERATION_BACKOFF_BASE = float(os.getenv("GENERATION_BACKOFF_BASE", "2"))
+GENERATION_BACKOFF_MAX = float(os.getenv("GENERATION_BACKOFF_MAX", "120"))
+GENERATION_IDLE_POLL = float(os.getenv("GENERATION_IDLE_POLL", "5"))
+# сколько оплаченный заказ может ждать восстановления бэкенда, прежде чем вернём Stars
+GENERATION_MAX_WAIT = float(os.getenv("GENERATION_MAX_WAIT", "1800"))
+# сколько при остановке ждать уже начатую отправку в бэкенд
+GENERATION_STOP_TIMEOUT = float(os.getenv("GENERATION_STOP_TIMEOUT", "10"))
+# сколько последних запросов помнить для повторной выдачи результата; 0 — не запоминать
+PROMPT_CACHE_SIZE = int(os.getenv("PROMPT_CACHE_SIZE", "5000"))
+
+_SPACES_RE = re.compile(r"\s+")
+
+
+def _normalize(text: str | None) -> str:
+    return _SPACES_RE.sub(" ", text or "").strip().casefold()
+
+
+def prompt_key(user_id: int, mode: str | None, style: str | None, prompt: str | None,
+               instrumental: bool | None, model: str | None) -> str:
+    """Ключ запроса: поля api_payload, от которых зависит результат, без регистра и лишних пробелов.
+
+    Пользователь входит в ключ — чужие тексты и треки другим не показываем.
+    """
+    custom = mode == "custom"
+    parts = (str(user_id), "custom" if custom else "classic", _normalize(style) if custom else "",
+             _normalize(prompt), "1" if instrumental else "0", model or "")
+    return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+
+def order_prompt_key(order: Order) -> str:
+    return prompt_key(order.user_id, order.mode, order.style, order.prompt, order.instrumental, order.model)
+
+
+def build_api_payload(order: Order) -> dict:
+    payload = {
+        "chatId": order.chat_id,
+        "userId": order.user.telegram_user_id,
+        "telegramPaymentChargeId": charge_id(order),
+        "prompt": order.prompt,
+        "style": order.style,
+        "customMode": True if order.mode == "custom" else False,
+        "title": "Paid via Telegram Stars",
+        "instrumental": order.instrumental,
+        "model": order.model
+    }
+    url = callback_url()
+    if url:
+        payload["callBackUrl"] = url
+    return payload
+
+
+def backoff_delay(attempt: int) -> float:
+    # экспоненциальная задержка с «полным» джиттером, чтобы ретраи не шли пачкой
+    delay = min(GENERATION_BACKOFF_BASE * (2 ** attempt), GENERATION_BACKOFF_MAX)
+    return random.uniform(delay / 2, delay)
+
+
+def is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError):
+        code = exc.response.status_code
+        return code >= 500 or code in (408, 429)
+    return isinstance(exc, (httpx.TransportError, asyncio.TimeoutError))
+
+
+class GenerationWorkerPool:
+    """Пул воркеров, разбирающих оплаченные заказы (status == PAID) из таблицы orders."""
+
+    def __init__(self, bot: Bot, size: int = GENERATION_WORKERS):
+        self.bot = bot
+        self.size = size
+        self._wakeup = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+        self._stopping = False
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._stopping = False
+        self._tasks = [
+            asyncio.create_task(self._worker(i), name=f"generation-worker-{i}")
+            for i in range(self.size)
+        ]
+
+    async def stop(self, timeout: float = GENERATION_STOP_TIMEOUT) -> None:
+        """Новые заказы не берём; начатые дорабатывают до timeout, остальное отменяется.
+
+        Заказ, прерванный посреди отправки, остаётся в PROCESSING — его вернёт
+        в очередь recovery_sweep при следующем старте.
+        """
+        self._stopping = True
+        self._wakeup.set()
+        if self._tasks:
+            _, pending = await asyncio.wait(self._tasks, timeout=max(timeout, 0))
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self) -> None:
+        self._wakeup.set()
+
+    async def _worker(self, n: int) -> None:
+        while not self._stopping:
+            try:
+                jobs = await run_write(lambda session: claim_jobs(session, limit=1))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("claim failed in worker %s", n)
+                jobs = []
+
+            if not jobs:
+                if self._stopping:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), GENERATION_IDLE_POLL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            for order in jobs:
+                try:
+                    await self.process(order)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # воркер не должен умирать из-за одного заказа: иначе очередь встанет целиком
+                    log.exception("processing order %s failed in worker %s", order.id, n)
+                    try:
+                        await self._requeue_after_error(order, e)
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception:
+                        # БД недоступна: заказ вернёт в очередь периодический проход recovery
+                        log.exception("could not requeue order %s", order.id)
+
+    async def process(self, order: Order) -> None:
+        # продолжаем трассу апдейта оплаты: платёж, очередь и вызов бэкенда видны одной цепочкой
+        with span("generation.submit", parent=order.traceparent, root=True,
+                  order_id=order.id, attempt=order.attempts + 1):
+            await self._process(order)
+
+    async def _process(self, order: Order) -> None:
+        api_payload = build_api_payload(order)
+        log.info("submitting order %s, attempt %s", order.id, order.attempts + 1,
+                 extra={"order_id": order.id, "attempt": order.attempts + 1})
+        try:
+            task_id = await api_generate(api_payload)
+        except Exception as e:
+            await self._handle_failure(order, e)
+            return
+
+        async def _submitted(session) -> None:
+            if await mark_submitted(session, order.id, task_id=task_id) and PROMPT_CACHE_SIZE > 0:
+                await remember_prompt(session, order_prompt_key(order), order.id, task_id, PROMPT_CACHE_SIZE)
+
+        await run_write(_submitted)
+
+        texts = texts_for(order.user.language_code)
+        if order.parent_id is not None:
+            # по пакету — одно сообщение, когда запущены все треки
+            submitted, total = await run_write(lambda session: batch_child_submitted(session, order.parent_id))
+            if submitted == total:
+                await notify(self.bot, order.chat_id, texts.batch_started(total))
+            return
+
+        await notify(self.bot, order.chat_id, texts.generation_started(task_id), parse_mode="Markdown")
+
+    async def _handle_failure(self, order: Order, exc: Exception) -> None:
+        error = f"{type(exc).__name__}: {exc}"
+        if isinstance(exc, BackendUnavailable):
+            waited = datetime.utcnow() - (order.paid_at or datetime.utcnow())
+            if waited < timedelta(seconds=GENERATION_MAX_WAIT):
+                delay = exc.retry_after + random.uniform(0, GENERATION_IDLE_POLL)
+                await run_write(lambda session: retry_job(session, order.id, error, delay, count_attempt=False))
+                return
+            await self.dead_letter(order, error, expected=(OrderStatus.PROCESSING,))
+            return
+
+        attempt = order.attempts + 1
+        retry = is_retryable(exc) and attempt < GENERATION_MAX_ATTEMPTS
+
+        if retry:
+            delay = backoff_delay(attempt)
+            await run_write(lambda session: retry_job(session, order.id, error, delay))
+            log.warning("order %s failed (%s), retry in %.1fs", order.id, error, delay,
+                        extra={"order_id": order.id, "attempt": attempt})
+            return
+
+        await self.dead_letter(order, error, expected=(OrderStatus.PROCESSING,))
+
+    async def _requeue_after_error(self, order: Order, exc: Exception) -> None:
+        """Сбой внутри process() (например, не записался mark_submitted): заказ не остаётся в PROCESSING."""
+        error = f"{type(exc).__name__}: {exc}"
+        attempt = order.attempts + 1
+        if attempt < GENERATION_MAX_ATTEMPTS:
+            delay = backoff_delay(attempt)
+            # заказ уже ушёл дальше PROCESSING — retry_job ничего не изменит
+            await run_write(lambda session: retry_job(session, order.id, error, delay))
+            return
+        await self.dead_letter(order, error, expected=(OrderStatus.PROCESSING,))
+
+    async def dead_letter(
+        self,
+        order: Order,
+        error: str,
+        expected: tuple[OrderStatus, ...] | None = None,
+    ) -> bool:
+        """Переводит заказ в DEAD и возвращает Stars; False — заказ уже обработал кто-то другой."""
+        async def _dead(session) -> str:
+            # рефанд только если именно мы перевели заказ в DEAD
+            if not await mark_dead(session, order.id, error, expected=expected):
+                return "taken"
+            return await request_order_refund(session, order)
+
+        outcome = await run_write(_dead)
+        if outcome == "taken":
+            return False
+        log.error("order %s moved to dead-letter: %s", order.id, error, extra={"order_id": order.id})
+
+        texts = texts_for(order.user.language_code)
+        if outcome == "track":
+            await notify(self.bot, order.chat_id, texts.batch_track_failed)
+        elif outcome == "refund":
+            # не прошедший возврат остаётся должным: его повторит recovery и тогда же сообщит пользователю
+            if await refund_payment(self.bot, charge_id(order), order.user.telegram_user_id):
+                await notify(self.bot, order.chat_id, texts.generation_refunded)
+        elif charge_id(order) is None:
+            log.error("order %s has no payment charge id, nothing to refund", order.id)
+        return True
@@ -0,0 +1,122 @@
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+
+from db.db import engine, IS_SQLITE
+from db.writer import run_write
+from db.dao import expire_abandoned_orders, expire_states, archive_orders
+from workers.recovery import RECOVERY_INVOICE_WINDOW
+
+load_dotenv()
+log = logging.getLogger("aiogram-stars-bot.maintenance")
+
+MAINTENANCE_INTERVAL = float(os.getenv("MAINTENANCE_INTERVAL", str(6 * 3600)))
+# первый проход — не в момент старта, когда и так идёт recovery_sweep
+MAINTENANCE_START_DELAY = float(os.getenv("MAINTENANCE_START_DELAY", "600"))
+# неоплаченные счета живут дольше окна сверки recovery_sweep: потерянный платёж ещё успеют найти
+MAINTENANCE_ORDER_TTL = float(os.getenv("MAINTENANCE_ORDER_TTL", str(RECOVERY_INVOICE_WINDOW + 86400)))
+MAINTENANCE_STATE_TTL = float(os.getenv("MAINTENANCE_STATE_TTL", str(30 * 86400)))
+# завершённые заказы старше стольких дней уходят в orders_archive; 0 — не архивировать
+MAINTENANCE_ARCHIVE_DAYS = int(os.getenv("MAINTENANCE_ARCHIVE_DAYS", "90"))
+# строк за транзакцию и пауза между пачками: очередь записи не должна стоять за обслуживанием
+MAINTENANCE_CHUNK = int(os.getenv("MAINTENANCE_CHUNK", "200"))
+MAINTENANCE_PAUSE = float(os.getenv("MAINTENANCE_PAUSE", "0.05"))
+MAINTENANCE_VACUUM_PAGES = int(os.getenv("MAINTENANCE_VACUUM_PAGES", "2000"))
+
+
+class MaintenanceJob:
+    """Периодическая чистка БД: брошенные счета, старые состояния, архив заказов, incremental vacuum."""
+
+    def __init__(self, interval: float = MAINTENANCE_INTERVAL):
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+        self.runs = 0
+        self.expired_orders = 0
+        self.expired_states = 0
+        self.archived = 0
+        self.vacuumed_pages = 0
+        self.last_duration = 0.0
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop(), name="maintenance")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "expired_orders": self.expired_orders,
+            "expired_states": self.expired_states,
+            "archived": self.archived,
+            "vacuumed_pages": self.vacuumed_pages,
+            "last_duration": self.last_duration,
+        }
+
+    async def _loop(self) -> None:
+        await asyncio.sleep(MAINTENANCE_START_DELAY)
+        while True:
+            try:
+                await self.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("maintenance run failed")
+            await asyncio.sleep(self.interval)
+
+    async def run(self) -> None:
+        started = time.perf_counter()
+        now = datetime.utcnow()
+        self.expired_orders += await self._chunked(
+            expire_abandoned_orders, now - timedelta(seconds=MAINTENANCE_ORDER_TTL)
+        )
+        self.expired_states += await self._chunked(expire_states, now - timedelta(seconds=MAINTENANCE_STATE_TTL))
+        if MAINTENANCE_ARCHIVE_DAYS > 0:
+            self.archived += await self._chunked(archive_orders, now - timedelta(days=MAINTENANCE_ARCHIVE_DAYS))
+        if IS_SQLITE:
+            await self._compact()
+        self.runs += 1
+        self.last_duration = time.perf_counter() - started
+        log.info("maintenance done in %.1fs: %s", self.last_duration, self.stats())
+
+    async def _chunked(self, op, before: datetime) -> int:
+        # каждая пачка — своя короткая транзакция через общую очередь записи
+        total = 0
+        while True:
+            n = await run_write(lambda session: op(session, before, MAINTENANCE_CHUNK))
+            total += n
+            if n < MAINTENANCE_CHUNK:
+                return total
+            await asyncio.sleep(MAINTENANCE_PAUSE)
+
+    async def _compact(self) -> None:
+        # на Postgres этим занимается autovacuum
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            mode = (await conn.exec_driver_sql("PRAGMA auto_vacuum")).scalar()
+            free = (await conn.exec_driver_sql("PRAGMA freelist_count")).scalar()
+            if mode == 2:
+                # за раз освобождаем не больше MAINTENANCE_VACUUM_PAGES страниц, чтобы не держать блокировку долго
+                pages = min(free, MAINTENANCE_VACUUM_PAGES)
+                if pages:
+                    await conn.exec_driver_sql(f"PRAGMA incremental_vacuum({pages})")
+                    self.vacuumed_pages += pages
+            elif free:
+                log.info(
+                    "%s free pages, but auto_vacuum is not INCREMENTAL: run VACUUM once while the bot is stopped",
+                    free,
+                )
+            # ANALYZE только там, где статистика устарела
+            await conn.exec_driver_sql("PRAGMA optimize")
@@ -0,0 +1,116 @@
+import os
+import time
+import asyncio
+import logging
+
+from aiogram import Bot
+from dotenv import load_dotenv
+
+from api.status import get_task_status, is_terminal
+from db.db import SessionLocal
+from db.dao import get_submitted_orders
+from db.models import Order
+from bot.messages import texts_for
+from workers.delivery import deliver_result
+from tracing import span
+
+load_dotenv()
+log = logging.getLogger("aiogram-stars-bot.poller")
+
+POLL_INTERVAL = float(os.getenv("POLL_INTERVAL", "10"))
+POLL_MAX_BACKOFF = float(os.getenv("POLL_MAX_BACKOFF", "300"))
+POLL_BATCH = int(os.getenv("POLL_BATCH", "200"))
+POLL_CONCURRENCY = int(os.getenv("POLL_CONCURRENCY", "8"))
+# при включённых колбэках бэкенда опрос остаётся только подстраховкой
+POLL_CALLBACK_INTERVAL = float(os.getenv("POLL_CALLBACK_INTERVAL", "120"))
+
+
+class StatusPoller:
+    """Фоновый опрос /music/status для заказов в SUBMITTED и доставка результата в чат."""
+
+    def __init__(
+        self,
+        bot: Bot,
+        interval: float = POLL_INTERVAL,
+        max_backoff: float = POLL_MAX_BACKOFF,
+        batch: int = POLL_BATCH,
+        concurrency: int = POLL_CONCURRENCY,
+    ):
+        self.bot = bot
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.batch = batch
+        self._sem = asyncio.Semaphore(concurrency)
+        # order.id -> (текущая задержка, monotonic-время следующей проверки)
+        self._backoff: dict[int, tuple[float, float]] = {}
+        # последний id прошлой страницы: за несколько тиков обходим все SUBMITTED, а не первые batch
+        self._cursor = 0
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="status-poller")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("status poller tick failed")
+            await asyncio.sleep(self.interval)
+
+    async def tick(self) -> int:
+        low = self._cursor
+        async with SessionLocal() as session:
+            orders = await get_submitted_orders(session, after_id=low, limit=self.batch)
+        # неполная страница — дошли до конца, следующий тик начнёт сначала
+        high = orders[-1].id if len(orders) == self.batch else None
+        self._cursor = high or 0
+
+        now = time.monotonic()
+        alive = {o.id for o in orders}
+        for order_id in list(self._backoff):
+            # забываем только заказы из диапазона этой страницы, которые ушли из SUBMITTED
+            if low < order_id and (high is None or order_id <= high) and order_id not in alive:
+                del self._backoff[order_id]
+
+        due = [o for o in orders if self._backoff.get(o.id, (0.0, 0.0))[1] <= now]
+        await asyncio.gather(*(self._check(o) for o in due))
+        return len(due)
+
+    def _defer(self, order_id: int) -> None:
+        delay, _ = self._backoff.get(order_id, (self.interval / 2, 0.0))
+        delay = min(delay * 2, self.max_backoff)
+        self._backoff[order_id] = (delay, time.monotonic() + delay)
+
+    async def _check(self, order: Order) -> None:
+        with span("poller.check", parent=order.traceparent, root=True, order_id=order.id, task_id=order.task_id):
+            await self._check_order(order)
+
+    async def _check_order(self, order: Order) -> None:
+        async with self._sem:
+            try:
+                result = await get_task_status(order.task_id)
+            except Exception as e:
+                log.warning("status check failed for task %s: %s", order.task_id, e)
+                self._defer(order.id)
+                return
+
+        if is_terminal(result):
+            self._backoff.pop(order.id, None)
+            texts = texts_for(order.user.language_code)
+            await deliver_result(self.bot, order.id, order.chat_id, order.task_id, result, texts)
+        else:
+            self._defer(order.id)
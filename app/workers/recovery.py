@@ -0,0 +1,210 @@
+import os
+import re
+import asyncio
+import logging
+from typing import Collection
+from datetime import datetime, timedelta, timezone
+
+from aiogram import Bot
+from aiogram.methods import GetStarTransactions
+from aiogram.types import TransactionPartnerUser
+from dotenv import load_dotenv
+
+from db.db import SessionLocal
+from db.writer import run_write
+from db.dao import apply_payment, get_stuck_orders, requeue_stale_processing, get_pending_refunds
+from db.models import OrderStatus
+from bot.messages import texts_for
+from workers.generation import GenerationWorkerPool
+from workers.refunds import notify, refund_payment
+
+load_dotenv()
+log = logging.getLogger("aiogram-stars-bot.recovery")
+
+# PROCESSING дольше этого — воркер умер посреди отправки, заказ возвращается в очередь.
+# Проход идёт и в работающем процессе: порог больше самой долгой отправки (API_GENERATE_TIMEOUT + очередь лимитера)
+RECOVERY_PROCESSING_AFTER = float(os.getenv("RECOVERY_PROCESSING_AFTER", "300"))
+# PAID дольше этого так и не ушёл в генерацию — возвращаем Stars
+RECOVERY_REFUND_AFTER = float(os.getenv("RECOVERY_REFUND_AFTER", str(6 * 3600)))
+# INVOICED дольше этого сверяем с транзакциями Stars: successful_payment мог потеряться при остановке
+RECOVERY_INVOICE_AFTER = float(os.getenv("RECOVERY_INVOICE_AFTER", "600"))
+RECOVERY_INVOICE_WINDOW = float(os.getenv("RECOVERY_INVOICE_WINDOW", str(7 * 86400)))
+RECOVERY_BATCH = int(os.getenv("RECOVERY_BATCH", "500"))
+RECOVERY_STAR_PAGES = int(os.getenv("RECOVERY_STAR_PAGES", "50"))
+# как часто повторять весь проход в работающем процессе; 0 — только при старте
+RECOVERY_INTERVAL = float(os.getenv("RECOVERY_INTERVAL", "300"))
+# свежие долги не трогаем: первая попытка возврата может быть ещё в пути
+RECOVERY_REFUND_RETRY_AFTER = float(os.getenv("RECOVERY_REFUND_RETRY_AFTER", "60"))
+STAR_PAGE_SIZE = 100
+
+ORDER_PAYLOAD_RE = re.compile(r"^order:(\d+)$")
+
+
+class RecoverySweep:
+    """Разбирает застрявшие заказы: при старте (после падения или остановки) и дальше раз в RECOVERY_INTERVAL.
+
+    В работающем процессе заказ застревает, когда воркер не смог записать исход, а возврат Stars — когда
+    RefundStarPayment не прошёл: без повторного прохода они ждали бы следующего рестарта.
+    """
+
+    def __init__(self, bot: Bot, pool: GenerationWorkerPool):
+        self.bot = bot
+        self.pool = pool
+        self._task: asyncio.Task | None = None
+        self.requeued = 0
+        self.refunded = 0
+        self.reconciled = 0
+        self.refunds_retried = 0
+
+    def start(self) -> None:
+        # в фоне: старт бота не ждёт сверки со Stars
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="recovery-sweep")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "requeued": self.requeued,
+            "refunded": self.refunded,
+            "reconciled": self.reconciled,
+            "refunds_retried": self.refunds_retried,
+        }
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("recovery sweep failed")
+            if RECOVERY_INTERVAL <= 0:
+                return
+            await asyncio.sleep(RECOVERY_INTERVAL)
+
+    async def run(self) -> None:
+        now = datetime.utcnow()
+        # сначала PAID: только что возвращённые из PROCESSING заказы не должны сразу уйти в рефанд
+        await self._expire_paid(now)
+        await self._requeue_processing(now)
+        await self._reconcile_invoiced(now)
+        await self._retry_refunds(now)
+        log.info("recovery sweep done: %s", self.stats())
+
+    async def _requeue_processing(self, now: datetime) -> None:
+        before = now - timedelta(seconds=RECOVERY_PROCESSING_AFTER)
+        ids = await run_write(lambda session: requeue_stale_processing(session, before))
+        if ids:
+            self.requeued += len(ids)
+            log.warning("requeued %s orders stuck in PROCESSING: %s", len(ids), ids)
+            self.pool.notify()
+
+    async def _expire_paid(self, now: datetime) -> None:
+        before = now - timedelta(seconds=RECOVERY_REFUND_AFTER)
+        async with SessionLocal() as session:
+            orders = await get_stuck_orders(session, OrderStatus.PAID, before, limit=RECOVERY_BATCH)
+        for order in orders:
+            # expected=PAID: если воркер как раз взял заказ, рефанда не будет
+            if await self.pool.dead_letter(order, "expired in PAID", expected=(OrderStatus.PAID,)):
+                self.refunded += 1
+        # более свежие PAID просто разбудят воркеры
+        self.pool.notify()
+
+    async def _retry_refunds(self, now: datetime) -> None:
+        before = now - timedelta(seconds=RECOVERY_REFUND_RETRY_AFTER)
+        async with SessionLocal() as session:
+            payments = await get_pending_refunds(session, before, limit=RECOVERY_BATCH)
+        for payment, language_code in payments:
+            if payment.telegram_user_id is None:
+                continue
+            if await refund_payment(self.bot, payment.telegram_payment_charge_id, payment.telegram_user_id):
+                self.refunds_retried += 1
+                log.warning("refund of %s succeeded on retry", payment.telegram_payment_charge_id)
+                # в личке с ботом chat_id совпадает с id пользователя
+                await notify(self.bot, payment.telegram_user_id, texts_for(language_code).payment_refunded)
+
+    async def _reconcile_invoiced(self, now: datetime) -> None:
+        before = now - timedelta(seconds=RECOVERY_INVOICE_AFTER)
+        after = now - timedelta(seconds=RECOVERY_INVOICE_WINDOW)
+        async with SessionLocal() as session:
+            orders = await get_stuck_orders(session, OrderStatus.INVOICED, before, after, limit=RECOVERY_BATCH)
+        if not orders:
+            return
+
+        waiting = {order.id: order for order in orders}
+        paid = await self._paid_invoices(after, waiting.keys())
+        for order_id, (charge_id, amount) in paid.items():
+            telegram_user_id = waiting[order_id].user.telegram_user_id
+            outcome = await run_write(
+                lambda session: apply_payment(session, order_id, charge_id, amount, telegram_user_id=telegram_user_id)
+            )
+            if outcome == "paid":
+                self.reconciled += 1
+                log.warning("order %s was paid while the bot was down, queued", order_id)
+                order = waiting[order_id]
+                await notify(self.bot, order.chat_id, texts_for(order.user.language_code).payment_queued)
+        if self.reconciled:
+            self.pool.notify()
+        # неоплаченные INVOICED остаются как есть: пользователь ещё может оплатить счёт
+
+    async def _star_count(self) -> int:
+        """Число транзакций Stars: getStarTransactions не отдаёт total, ищем конец истории пробами по одной."""
+        async def exists(offset: int) -> bool:
+            result = await self.bot(GetStarTransactions(offset=offset, limit=1))
+            return bool(result.transactions)
+
+        first = await self.bot(GetStarTransactions(offset=0, limit=STAR_PAGE_SIZE))
+        if len(first.transactions) < STAR_PAGE_SIZE:
+            return len(first.transactions)
+        # lo — заведомо существующее смещение, hi — проверяемое дальше
+        lo, hi = STAR_PAGE_SIZE - 1, STAR_PAGE_SIZE * 2
+        while await exists(hi):
+            lo, hi = hi, hi * 2
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if await exists(mid):
+                lo = mid
+            else:
+                hi = mid
+        return hi
+
+    async def _paid_invoices(self, after: datetime, waiting: Collection[int]) -> dict[int, tuple[str, int]]:
+        """order_id -> (charge_id, сумма) по входящим платежам Stars, не отозванным рефандом."""
+        since = after.replace(tzinfo=timezone.utc)
+        paid: dict[int, tuple[str, int]] = {}
+        refunded: set[str] = set()
+        # история идёт в хронологическом порядке: листаем от свежего конца назад до since,
+        # иначе при длинной истории до недавних платежей не дойти. Рефанд всегда позже
+        # платежа, поэтому все рефанды платежей из окна тоже попадают в просмотр
+        end = await self._star_count()
+        for _ in range(RECOVERY_STAR_PAGES):
+            if end <= 0:
+                break
+            start = max(0, end - STAR_PAGE_SIZE)
+            result = await self.bot(GetStarTransactions(offset=start, limit=end - start))
+            for tx in result.transactions:
+                if tx.receiver is not None:
+                    # исходящая транзакция с тем же id — рефанд платежа
+                    refunded.add(tx.id)
+                    continue
+                if tx.date < since or not isinstance(tx.source, TransactionPartnerUser):
+                    continue
+                m = ORDER_PAYLOAD_RE.match(tx.source.invoice_payload or "")
+                if m and int(m.group(1)) in waiting:
+                    paid[int(m.group(1))] = (tx.id, tx.amount)
+            if not result.transactions or result.transactions[0].date < since:
+                break
+            end = start
+        else:
+            if end > 0:
+                log.warning("star transactions scan stopped after %s pages before reaching %s", RECOVERY_STAR_PAGES, since)
+        return {order_id: tx for order_id, tx in paid.items() if tx[0] not in refunded}
@@ -0,0 +1,39 @@
+import logging
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
+from aiogram.methods import RefundStarPayment
+
+from db.writer import run_write
+from db.dao import mark_refunded
+
+log = logging.getLogger("aiogram-stars-bot.refunds")
+
+
+async def notify(bot: Bot, chat_id: int, text: str, **kwargs) -> bool:
+    """Сообщение пользователю из фоновой работы: бот заблокирован или чат удалён — не повод ронять воркер."""
+    try:
+        await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+    except TelegramAPIError as e:
+        log.warning("message to chat %s not sent: %s", chat_id, e)
+        return False
+    return True
+
+
+async def refund_payment(bot: Bot, telegram_payment_charge_id: str, telegram_user_id: int) -> bool:
+    """Возвращает Stars по платежу, возврат которого уже записан через request_refund.
+
+    False — возврат не прошёл, долг остаётся в processed_payments до следующей попытки recovery.
+    """
+    try:
+        await bot(RefundStarPayment(user_id=telegram_user_id, telegram_payment_charge_id=telegram_payment_charge_id))
+    except TelegramBadRequest as e:
+        # прошлая попытка дошла до Telegram, но не успела записать refunded_at
+        if "ALREADY_REFUNDED" not in e.message:
+            log.error("refund of %s rejected: %s", telegram_payment_charge_id, e)
+            return False
+    except Exception:
+        log.exception("refund of %s failed, will retry", telegram_payment_charge_id)
+        return False
+    await run_write(lambda session: mark_refunded(session, telegram_payment_charge_id))
+    return True
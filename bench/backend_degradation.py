@@ -0,0 +1,112 @@
+"""Поведение клиента бэкенда при деградации: circuit breaker и AIMD-лимит /music/generate.
+
+Настоящий api/client.py против httpx.MockTransport, который проходит фазы
+«норма → медленно → 503 → восстановление». Времена сжаты (пороги ниже в
+секундах), чтобы прогон занимал полминуты. По фазам печатается, сколько
+запросов дошло до бэкенда, сколько отклонено сразу и сколько ждали вызывающие.
+
+    python bench/backend_degradation.py
+    python bench/backend_degradation.py --clients 64 --phase 4
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "app"))
+
+# масштаб времени: «медленно» — это 0.4 с вместо десятков секунд
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+os.environ.setdefault("BREAKER_WINDOW", "2")
+os.environ.setdefault("BREAKER_MIN_CALLS", "10")
+os.environ.setdefault("BREAKER_SLOW_CALL", "0.3")
+os.environ.setdefault("BREAKER_OPEN_FOR", "1")
+os.environ.setdefault("GENERATE_LIMIT_TARGET", "0.2")
+os.environ.setdefault("GENERATE_QUEUE_TIMEOUT", "1")
+
+import httpx  # noqa: E402
+
+from api import client  # noqa: E402
+from api.breaker import BackendUnavailable  # noqa: E402
+
+PHASES = [
+    ("норма", 0.05, 200),
+    ("медленно", 0.4, 200),
+    ("503", 0.02, 503),
+    ("восстановление", 0.05, 200),
+]
+
+
+class Backend:
+    def __init__(self):
+        self.latency = 0.05
+        self.code = 200
+        self.in_flight = 0
+        self.peak = 0
+        self.hits = 0
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.hits += 1
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            # перегруженный бэкенд отвечает тем медленнее, чем больше параллельных запросов
+            await asyncio.sleep(self.latency * max(1.0, self.in_flight / 8))
+        finally:
+            self.in_flight -= 1
+        if self.code != 200:
+            return httpx.Response(self.code)
+        return httpx.Response(200, json={"taskId": "t"})
+
+
+async def caller(stats: dict, stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            await client.api_generate({"prompt": "x"})
+            stats["ok"] += 1
+        except BackendUnavailable:
+            stats["rejected"] += 1
+            await asyncio.sleep(0.05)
+        except httpx.HTTPError:
+            stats["failed"] += 1
+        stats["waits"].append(time.perf_counter() - started)
+
+
+async def main(args: argparse.Namespace) -> None:
+    backend = Backend()
+    client._client = httpx.AsyncClient(base_url="http://api", transport=httpx.MockTransport(backend.handle))
+
+    print(f"{'фаза':<16} {'до бэкенда':>10} {'ok':>6} {'ошибки':>7} {'отказ':>6} "
+          f"{'p50, с':>7} {'p95, с':>7} {'пик парал.':>10} {'лимит':>6} {'цепь':>10}")
+    for name, latency, code in PHASES:
+        backend.latency, backend.code = latency, code
+        backend.hits = backend.peak = 0
+        stats = {"ok": 0, "failed": 0, "rejected": 0, "waits": []}
+        stop = asyncio.Event()
+        tasks = [asyncio.create_task(caller(stats, stop)) for _ in range(args.clients)]
+        await asyncio.sleep(args.phase)
+        stop.set()
+        await asyncio.gather(*tasks)
+        waits = sorted(stats["waits"]) or [0.0]
+        p95 = waits[int(len(waits) * 0.95) - 1] if len(waits) > 1 else waits[0]
+        print(f"{name:<16} {backend.hits:>10} {stats['ok']:>6} {stats['failed']:>7} {stats['rejected']:>6} "
+              f"{statistics.median(waits):>7.2f} {p95:>7.2f} {backend.peak:>10} "
+              f"{client.generate_limiter.stats()['limit']:>6} {client.backend_breaker.state:>10}")
+
+    await client.close_client()
+
+
+def parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--clients", type=int, default=32, help="одновременных отправителей (воркеров генерации)")
+    p.add_argument("--phase", type=float, default=5.0, help="длительность фазы, с")
+    return p.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
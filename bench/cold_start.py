@@ -0,0 +1,114 @@
+"""Холодный старт: время от запуска процесса до первого ответа бота.
+
+Бот запускается как есть (python app/main.py, polling) против заглушки Bot API,
+в которой ещё до запуска лежит апдейт /start. Замер — от exec процесса до
+первого sendMessage. Первый прогон идёт на пустой БД (миграции), остальные —
+на уже мигрированной, как обычный рестарт контейнера. С --max-seconds бенч
+падает (код 1), если медиана рестартов дольше порога.
+
+    python bench/cold_start.py
+    python bench/cold_start.py --runs 5 --max-seconds 8 --profile
+"""
+import os
+import sys
+import time
+import signal
+import asyncio
+import argparse
+import statistics
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "bench"))
+
+from stubs import StubTelegram, StubGenerationAPI, serve  # noqa: E402
+from load import message  # noqa: E402
+
+DB_PATH = ROOT / "bench" / "cold-start.db"
+
+
+async def run_once(gen_url: str, args: argparse.Namespace) -> tuple[float, str]:
+    tg = StubTelegram()
+    tg.feed([message(1000, "/start")])
+    tg_runner, tg_url = await serve(tg.app())
+
+    env = {
+        **os.environ,
+        "BOT_TOKEN": "42:bench",
+        "TELEGRAM_API_URL": tg_url,
+        "API_BASE_URL": gen_url,
+        "DATABASE_URL": f"sqlite+aiosqlite:///{DB_PATH}",
+        "RUN_MODE": "polling",
+        "WORKERS": "1",
+        "SUPERVISOR": "0",
+        "HTTP_SERVER": "0",
+        "STARTUP_PROFILE": "1" if args.profile else "0",
+        # отчёт профиля разбирается построчно из stderr
+        "LOG_FORMAT": "text",
+    }
+    started = time.perf_counter()
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, str(ROOT / "app" / "main.py"),
+        cwd=str(ROOT / "app"), env=env,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        while tg.first_reply is None:
+            if proc.returncode is not None:
+                raise RuntimeError(f"bot exited with code {proc.returncode}")
+            if time.perf_counter() - started > args.timeout:
+                raise RuntimeError(f"no reply in {args.timeout:.0f}s")
+            await asyncio.sleep(0.01)
+        elapsed = tg.first_reply - started
+    finally:
+        if proc.returncode is None:
+            proc.send_signal(signal.SIGTERM)
+        stderr = (await proc.communicate())[1].decode(errors="replace")
+        await tg_runner.cleanup()
+
+    report = ""
+    if args.profile:
+        lines = stderr.splitlines()
+        for i, line in enumerate(lines):
+            if "startup profile:" in line:
+                report = "\n".join([line.split("startup profile: ", 1)[1], *lines[i + 1:i + 3]])
+    return elapsed, report
+
+
+async def main(args: argparse.Namespace) -> int:
+    gen = StubGenerationAPI()
+    gen_runner, gen_url = await serve(gen.app())
+    for suffix in ("", "-wal", "-shm"):
+        Path(f"{DB_PATH}{suffix}").unlink(missing_ok=True)
+
+    results = []
+    for i in range(args.runs + 1):
+        elapsed, report = await run_once(gen_url, args)
+        kind = "пустая БД" if i == 0 else "рестарт"
+        print(f"{i + 1:>3} {kind:<10} {elapsed:>7.2f} с")
+        if report:
+            print("    " + report.replace("\n", "\n    "))
+        results.append(elapsed)
+    await gen_runner.cleanup()
+
+    restarts = results[1:]
+    median = statistics.median(restarts)
+    print(f"\nдо первого ответа: пустая БД {results[0]:.2f} с, рестарт — медиана {median:.2f} с, "
+          f"min {min(restarts):.2f} с, max {max(restarts):.2f} с")
+    if args.max_seconds and median > args.max_seconds:
+        print(f"FAIL: медиана {median:.2f} с дольше порога {args.max_seconds:.2f} с")
+        return 1
+    return 0
+
+
+def parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--runs", type=int, default=3, help="рестартов на уже мигрированной БД")
+    p.add_argument("--max-seconds", type=float, default=0.0, help="порог медианы рестарта, 0 — без проверки")
+    p.add_argument("--timeout", type=float, default=60.0)
+    p.add_argument("--profile", action="store_true", help="STARTUP_PROFILE=1 и отчёт профиля по каждому прогону")
+    return p.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
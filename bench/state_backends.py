@@ -0,0 +1,104 @@
+"""Проверка хранилищ состояния визарда для нескольких реплик webhook.
+
+Две «реплики» — два экземпляра хранилища — по очереди проходят шаги одного
+визарда: каждая должна видеть то, что записала другая. Redis по умолчанию —
+fakeredis (pip install -r bench/requirements.txt), с --redis-url — настоящий.
+memory проверяется для сравнения: у каждого процесса своё состояние.
+Заодно — выбор бэкенда по умолчанию (create_state_storage). Код выхода 1 — проверка не прошла.
+
+    python bench/state_backends.py
+    python bench/state_backends.py --redis-url redis://127.0.0.1:6379/15
+"""
+import os
+import sys
+import asyncio
+import argparse
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "app"))
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+from bot.state_storage import (  # noqa: E402
+    StateStorage, MemoryStateStorage, RedisStateStorage, create_state_storage,
+)
+
+USER_ID = 42
+
+
+async def shared(a: StateStorage, b: StateStorage) -> bool:
+    """Шаги визарда попеременно на двух репликах; True — обе видят одно состояние."""
+    await a.clear(USER_ID)
+    await a.update(USER_ID, function="generation_music", step="mode")
+    st = await b.get(USER_ID)
+    if st.step != "mode":
+        return False
+    await b.update(USER_ID, mode="classic", step="instrumental")
+    st = await a.get(USER_ID)
+    if (st.function, st.mode, st.step) != ("generation_music", "classic", "instrumental"):
+        return False
+    await b.clear(USER_ID)
+    return (await a.get(USER_ID)).step is None
+
+
+def redis_pair(url: str | None) -> tuple[RedisStateStorage, RedisStateStorage]:
+    if url:
+        return RedisStateStorage.from_url(url), RedisStateStorage.from_url(url)
+    import fakeredis
+
+    # один сервер, два клиента — как две реплики с общим Redis
+    server = fakeredis.FakeServer()
+    return (
+        RedisStateStorage(fakeredis.FakeAsyncRedis(server=server, decode_responses=True)),
+        RedisStateStorage(fakeredis.FakeAsyncRedis(server=server, decode_responses=True)),
+    )
+
+
+def check_defaults() -> list[str]:
+    errors = []
+    if not isinstance(create_state_storage("", "polling"), MemoryStateStorage):
+        errors.append("polling without STATE_BACKEND should use memory")
+    try:
+        create_state_storage("", "webhook")
+        errors.append("webhook without STATE_BACKEND should fail at startup")
+    except RuntimeError:
+        pass
+    return errors
+
+
+async def main(args: argparse.Namespace) -> int:
+    errors = check_defaults()
+
+    a, b = redis_pair(args.redis_url)
+    try:
+        redis_ok = await shared(a, b)
+        await a.update(USER_ID, step="mode")
+        ttl = await a.client.ttl(a._key(USER_ID))
+        await a.clear(USER_ID)
+    finally:
+        await a.close()
+        await b.close()
+    memory_ok = await shared(MemoryStateStorage(), MemoryStateStorage())
+
+    print(f"{'backend':<10} {'shared':>7}")
+    print(f"{'redis':<10} {str(redis_ok):>7}  ttl={ttl}s")
+    print(f"{'memory':<10} {str(memory_ok):>7}  (ожидаемо: состояние в процессе)")
+    if not redis_ok:
+        errors.append("redis replicas do not see each other's state")
+    if not 0 < ttl <= a.ttl:
+        errors.append(f"redis state has no TTL: {ttl}")
+    if memory_ok:
+        errors.append("memory replicas unexpectedly share state")
+    for error in errors:
+        print("FAIL:", error)
+    return 1 if errors else 0
+
+
+def parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--redis-url", default=None, help="настоящий Redis вместо fakeredis (ключи под REDIS_STATE_PREFIX)")
+    return p.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
@@ -0,0 +1,171 @@
+"""Локальные заглушки Telegram Bot API и бэкенда генерации для бенчмарков."""
+import time
+import asyncio
+import itertools
+
+from aiohttp import web
+
+_ids = itertools.count(1)
+
+
+def _message(payload: dict) -> dict:
+    chat_id = payload.get("chat_id") or 1
+    return {
+        "message_id": next(_ids),
+        "date": int(time.time()),
+        "chat": {"id": int(chat_id), "type": "private"},
+        "text": payload.get("text"),
+    }
+
+
+def _audio(payload: dict) -> dict:
+    audio = payload.get("audio")
+    # повторная отправка по file_id возвращает тот же file_id
+    file_id = audio if audio and not audio.startswith("attach://") else f"audio-{next(_ids)}"
+    return {"file_id": file_id, "file_unique_id": file_id, "duration": 1}
+
+
+class StubTelegram:
+    """Отвечает на /bot<token>/<method> как Bot API, считая вызовы по методам."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: dict[str, int] = {}
+        self.uploaded = 0
+        # очередь для getUpdates и отметки времени для замеров пропускной способности
+        self.pending: list[dict] = []
+        self.first_served: float | None = None
+        self.first_reply: float | None = None
+        self.last_call: float | None = None
+
+    def feed(self, updates: list[dict]) -> None:
+        self.pending.extend(updates)
+
+    async def _get_updates(self, payload: dict) -> list[dict]:
+        offset = int(payload.get("offset") or 0)
+        self.pending = [u for u in self.pending if u["update_id"] >= offset]
+        batch = self.pending[:int(payload.get("limit") or 100)]
+        if not batch:
+            # укороченный long polling
+            await asyncio.sleep(min(float(payload.get("timeout") or 0), 0.2))
+        elif self.first_served is None:
+            self.first_served = time.perf_counter()
+        return batch
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if request.content_type == "application/json":
+            payload = await request.json()
+        elif request.content_type == "multipart/form-data":
+            payload = await self._multipart(request)
+        else:
+            payload = dict(await request.post())
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        name = method.lower()
+        if name == "getupdates":
+            return web.json_response({"ok": True, "result": await self._get_updates(payload)})
+        self.last_call = time.perf_counter()
+        if name == "getme":
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif name == "sendaudio":
+            result = {**_message(payload), "audio": _audio(payload)}
+        elif name.startswith(("send", "copy", "forward")):
+            if self.first_reply is None:
+                self.first_reply = self.last_call
+            result = _message(payload)
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def _multipart(self, request: web.Request) -> dict:
+        # загружаемые файлы вычитываем и выбрасываем, не держа в памяти
+        payload = {}
+        reader = await request.multipart()
+        async for part in reader:
+            if part.filename:
+                while await part.read_chunk():
+                    pass
+                self.uploaded += 1
+            else:
+                payload[part.name] = await part.text()
+        return payload
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+
+class StubGenerationAPI:
+    """/music/generate сразу выдаёт taskId, /music/status отдаёт SUCCESS через ready_after секунд, /files/* — «треки»."""
+
+    def __init__(self, latency: float = 0.0, ready_after: float = 0.0, file_size: int = 1024 * 1024):
+        self.latency = latency
+        self.ready_after = ready_after
+        self.file_size = file_size
+        self.created: dict[str, float] = {}
+        self.calls: dict[str, int] = {}
+
+    def _count(self, name: str) -> None:
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    async def generate(self, request: web.Request) -> web.Response:
+        self._count("generate")
+        await request.json()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        task_id = f"task-{next(_ids)}"
+        self.created[task_id] = time.monotonic()
+        return web.json_response({"taskId": task_id})
+
+    async def status(self, request: web.Request) -> web.Response:
+        self._count("status")
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        task_id = request.match_info["task_id"]
+        created = self.created.get(task_id, 0.0)
+        if time.monotonic() - created < self.ready_after:
+            return web.json_response({"status": "PENDING", "raw": {}})
+        base = f"{request.scheme}://{request.host}/files"
+        return web.json_response({
+            "status": "SUCCESS",
+            "raw": {"data": {"response": {"sunoData": [
+                {"title": f"{task_id} #1", "audioUrl": f"{base}/{task_id}-1.mp3", "imageUrl": f"{base}/{task_id}-1.jpg"},
+                {"title": f"{task_id} #2", "audioUrl": f"{base}/{task_id}-2.mp3", "imageUrl": f"{base}/{task_id}-2.jpg"},
+            ]}}},
+        })
+
+    async def file(self, request: web.Request) -> web.StreamResponse:
+        self._count("file")
+        response = web.StreamResponse()
+        await response.prepare(request)
+        for _ in range(self.file_size // 65536):
+            await response.write(b"\0" * 65536)
+        await response.write_eof()
+        return response
+
+    async def paid(self, request: web.Request) -> web.Response:
+        self._count("paid")
+        await request.json()
+        return web.json_response({"ok": True})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/music/generate", self.generate)
+        app.router.add_get("/music/status/{task_id}", self.status)
+        app.router.add_post("/payments/stars/paid", self.paid)
+        app.router.add_get("/files/{name}", self.file)
+        return app
+
+
+async def serve(app: web.Application, host: str = "127.0.0.1", port: int = 0) -> tuple[web.AppRunner, str]:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    sock = site._server.sockets[0]
+    bound_port = sock.getsockname()[1]
+    return runner, f"http://{host}:{bound_port}"
@@ -0,0 +1,139 @@
+"""Микробенчмарк bot/messages.py: готовые тексты/клавиатуры против сборки на каждый ответ.
+
+«Было» — как до каталога: клавиатуры из bot/buttons.py собираются заново,
+строки склеиваются f-строками в хендлере, render_status экранирует целые блоки.
+«Стало» — объекты из CATALOGS и шаблоны со str.format.
+
+    python bench/templates.py
+    python bench/templates.py --number 20000
+"""
+import sys
+import html
+import timeit
+import argparse
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "app"))
+
+from bot import buttons  # noqa: E402
+from bot.messages import SOURCES, PRICE_STARS, texts_for, render_status  # noqa: E402
+
+RU = SOURCES["ru"]
+RESULT = {
+    "status": "SUCCESS",
+    "raw": {"data": {"response": {"sunoData": [
+        {"title": "Night <drive>", "audioUrl": "https://cdn.example/a.mp3?x=1&y=2", "imageUrl": "https://cdn.example/a.jpg"},
+        {"title": "Night & day", "audioUrl": "https://cdn.example/b.mp3", "imageUrl": None},
+    ]}}},
+}
+
+
+def legacy_render_status(result: dict) -> str:
+    status = result.get("status") or "UNKNOWN"
+    data = (
+        result.get("raw", {})
+              .get("data", {})
+              .get("response", {})
+              .get("sunoData")
+    ) or []
+    lines = [f"Статус: <b>{html.escape(str(status))}</b>"]
+    if status == "SUCCESS" and isinstance(data, list) and len(data) > 0:
+        for i, item in enumerate(data[:2], start=1):
+            if not isinstance(item, dict):
+                continue
+            image_url = item.get("imageUrl")
+            audio_url = item.get("audioUrl")
+            title = item.get("title") or f"Трек {i}"
+            ordinal = "ПЕРВЫЙ" if i == 1 else "ВТОРОЙ"
+            block = [f"{ordinal}\n<b>{html.escape(str(f'Название: {title}'))}</b>"]
+            if image_url:
+                block.append(f'🖼 <a href="{html.escape(image_url)}">Обложка</a>')
+            else:
+                block.append("🖼 Обложка: нет ссылки")
+            if audio_url:
+                block.append(f'🎵 <a href="{html.escape(audio_url)}">Трек</a>')
+            else:
+                block.append("🎵 Трек: нет ссылки")
+            lines.append("\n".join(block))
+    return "\n\n".join(lines)
+
+
+def legacy_start():
+    return (
+        ("Бот умеет генерировать и редактировать музыку. Выбери действие.", buttons.start_menu(RU)),
+        ('Начать занаво можно нажав "Сбросить" в нижнем меню 👇', buttons.main_menu(RU)),
+    )
+
+
+def legacy_invoice(count: int):
+    total = PRICE_STARS * count
+    return (
+        f"Запуск генерации (Suno). Цена: {PRICE_STARS}⭐",
+        f"Пакетная генерация (Suno): {count} трека(ов). Цена: {total}⭐",
+        f"{count} × {PRICE_STARS} Stars",
+    )
+
+
+def catalog_start():
+    texts = texts_for("ru")
+    return (texts.start, texts.start_menu), (texts.start_hint, texts.main_menu)
+
+
+def catalog_invoice(count: int):
+    texts = texts_for("ru")
+    return (
+        texts.invoice_description,
+        texts.batch_invoice_description(count=count, total=PRICE_STARS * count),
+        texts.batch_invoice_label(count),
+    )
+
+
+def catalog_render_status(result: dict) -> str:
+    return render_status(result, texts_for("ru"))
+
+
+CASES = [
+    ("/start: 2 текста + 2 клавиатуры", legacy_start, catalog_start),
+    ("описание счёта", lambda: legacy_invoice(3), lambda: catalog_invoice(3)),
+    ("render_status, 2 трека", lambda: legacy_render_status(RESULT), lambda: catalog_render_status(RESULT)),
+]
+
+
+def per_call_us(fn, number: int) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+def allocated_bytes(fn, number: int) -> float:
+    # суммарный объём выделений на вызов, включая то, что сразу освобождается
+    tracemalloc.start()
+    total = 0
+    for _ in range(number):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        fn()
+        total += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return total / number
+
+
+def main(args: argparse.Namespace) -> None:
+    assert catalog_render_status(RESULT) == legacy_render_status(RESULT)
+
+    print(f"{'case':<34} {'было, мкс':>10} {'стало, мкс':>11} {'x':>6} {'было, Б':>9} {'стало, Б':>9}")
+    for name, legacy, catalog in CASES:
+        t_old, t_new = per_call_us(legacy, args.number), per_call_us(catalog, args.number)
+        m_old, m_new = allocated_bytes(legacy, args.alloc_number), allocated_bytes(catalog, args.alloc_number)
+        print(f"{name:<34} {t_old:>10.2f} {t_new:>11.2f} {t_old / t_new:>5.1f}x {m_old:>9.0f} {m_new:>9.0f}")
+
+
+def parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--number", type=int, default=5000)
+    p.add_argument("--alloc-number", type=int, default=500)
+    return p.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())